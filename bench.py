@@ -0,0 +1,231 @@
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import subprocess
+
+from typing import Optional
+
+from utils.ffmpeg.core import get_capabilities
+from utils.ffmpeg.transcoder import check_ffmpeg, build_command, run_ffmpeg
+from utils.ffmpeg.progress import Progress
+from utils.logger import prerror, prinfo, prsuccess, prwarn
+
+# Synthetic sources with different amount of motion,
+# noise changes every frame so it's the hardest to compress
+MOTION_SOURCES = {
+    "static": "smptebars=size={resolution}:rate=30",
+    "medium": "testsrc2=size={resolution}:rate=30",
+    "high": "testsrc2=size={resolution}:rate=30,noise=alls=30:allf=t+u",
+}
+
+# Encoders that need these ffmpeg encoders to be available
+ENCODER_REQUIREMENTS = {
+    "libx265": "libx265",
+    "nvenc": "hevc_nvenc",
+    "qsv": "hevc_qsv",
+    "amf": "hevc_amf",
+    "vaapi": "hevc_vaapi",
+}
+
+# Presets to try when none are given, None is the default preset of build_args
+DEFAULT_PRESETS = {
+    "libx265": [None, "medium", "fast"],
+    "nvenc": [None, "p4"],
+}
+
+def corpus_name(resolution: str, motion: str, duration: int) -> str:
+    return f"{motion}_{resolution}_{duration}s.mp4"
+
+def build_corpus(
+    folder: str,
+    resolutions: list[str],
+    motions: list[str],
+    durations: list[int],
+) -> list[dict]:
+    """
+    Generate synthetic clips with lavfi, clips that already
+    exist are reused so every run encodes the same input.
+
+    Returns:
+        list[dict]: Clips with path, resolution, motion and duration
+    """
+    os.makedirs(folder, exist_ok=True)
+    corpus = []
+    for resolution, motion, duration in itertools.product(resolutions, motions, durations):
+        path = os.path.join(folder, corpus_name(resolution, motion, duration))
+        if not os.path.exists(path):
+            prinfo(f"Generating: {path}")
+            # lavfi sources and settings are fixed, so the clip is
+            # the same with the same ffmpeg version
+            subprocess.run([
+                "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+                "-f", "lavfi", "-i", MOTION_SOURCES[motion].format(resolution=resolution),
+                "-f", "lavfi", "-i", f"sine=frequency=1000:sample_rate=48000:duration={duration}",
+                "-c:v", "libx264", "-preset", "veryfast", "-crf", "18",
+                "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "128k",
+                "-t", str(duration),
+                path,
+            ], check=True)
+        corpus.append({
+            "path": path,
+            "resolution": resolution,
+            "motion": motion,
+            "duration": duration,
+        })
+    return corpus
+
+def run_case(
+    clip: dict,
+    encoder: str,
+    preset: Optional[str],
+    cq: int,
+    target_resolution: str,
+    output_folder: str,
+) -> dict:
+    """Encode one clip with one set of settings and measure it"""
+    hw = None if encoder == "libx265" else encoder
+    output_path = os.path.join(output_folder, "bench_output.mp4")
+    frames = []
+
+    def on_progress(p: Progress):
+        frames[:] = [p.frame]
+
+    start = time.time()
+    run_ffmpeg(build_command(
+        clip["path"], output_path, hw,
+        ten_bit=True,
+        cq=cq,
+        target_resolution=target_resolution,
+        preset=preset,
+    ), on_progress)
+    wall_time = time.time() - start
+
+    input_bytes = os.path.getsize(clip["path"])
+    output_bytes = os.path.getsize(output_path)
+    os.remove(output_path)
+    frame_count = frames[0] if frames else clip["duration"] * 30
+    return {
+        "clip": os.path.basename(clip["path"]),
+        "encoder": encoder,
+        "preset": preset or "default",
+        "cq": cq,
+        "target_resolution": target_resolution,
+        "wall_time": round(wall_time, 3),
+        "fps": round(frame_count / wall_time, 2) if wall_time else 0.0,
+        "output_bytes": output_bytes,
+        "compression_ratio": round(output_bytes / input_bytes, 4),
+    }
+
+def case_key(result: dict) -> str:
+    return "|".join(str(result[k]) for k in ("clip", "encoder", "preset", "cq", "target_resolution"))
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float = 0.1) -> list[str]:
+    """
+    Compare results with a baseline.
+
+    Args:
+        results (list[dict]): Results of this run
+        baseline (list[dict]): Results of the baseline run
+        tolerance (float): Allowed relative change, 0.1 is 10%
+
+    Returns:
+        list[str]: Description of every regression
+    """
+    base = {case_key(r): r for r in baseline}
+    regressions = []
+    for result in results:
+        old = base.get(case_key(result))
+        if old is None:
+            continue
+        if old["fps"] and result["fps"] < old["fps"] * (1 - tolerance):
+            regressions.append(f"{case_key(result)}: fps {old['fps']} -> {result['fps']}")
+        if old["output_bytes"] and result["output_bytes"] > old["output_bytes"] * (1 + tolerance):
+            regressions.append(
+                f"{case_key(result)}: size {old['output_bytes']} -> {result['output_bytes']}")
+    return regressions
+
+def available_encoders() -> list[str]:
+    encoders = set(get_capabilities()["encoders"])
+    return [key for key, name in ENCODER_REQUIREMENTS.items() if name in encoders]
+
+def split(value: str) -> list[str]:
+    return [v.strip() for v in value.split(",") if v.strip()]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark encoder settings on synthetic clips"
+    )
+    parser.add_argument("--corpus", type=str, default=os.path.join(".bench", "corpus"),
+        help="Folder for generated clips, clips are reused between runs")
+    parser.add_argument("--resolutions", type=str, default="640x360,1280x720,1920x1080",
+        help="Resolutions of generated clips")
+    parser.add_argument("--motions", type=str, default=",".join(MOTION_SOURCES),
+        help="Motion levels of generated clips")
+    parser.add_argument("--durations", type=str, default="2,5",
+        help="Durations of generated clips (seconds)")
+    parser.add_argument("--encoders", type=str, default=None,
+        help="Encoders to benchmark, all available by default")
+    parser.add_argument("--presets", type=str, default=None,
+        help="Presets to benchmark, \"default\" is the preset of build_args")
+    parser.add_argument("--cq", type=str, default="24,28",
+        help="CQ values to benchmark")
+    parser.add_argument("--targets", type=str, default="1280x720",
+        help="Target resolutions to benchmark")
+    parser.add_argument("--save-baseline", type=str, default=None,
+        help="Save results as a baseline JSON file")
+    parser.add_argument("--baseline", type=str, default=None,
+        help="Compare results with this baseline JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.1,
+        help="Allowed fps drop or size growth before flagging a regression (0.1 is 10%%)")
+    parser.add_argument("--debug", action="store_true", default=False,
+        help="Enable debug logging")
+    args = parser.parse_args()
+
+    import utils.logger
+    utils.logger.DEBUG = args.debug
+
+    check_ffmpeg()
+    encoders = split(args.encoders) if args.encoders else available_encoders()
+    corpus = build_corpus(
+        args.corpus,
+        split(args.resolutions),
+        split(args.motions),
+        [int(d) for d in split(args.durations)],
+    )
+
+    results = []
+    for encoder in encoders:
+        if args.presets:
+            presets = [None if p == "default" else p for p in split(args.presets)]
+        else:
+            presets = DEFAULT_PRESETS.get(encoder, [None])
+        for clip, preset, cq, target in itertools.product(
+            corpus, presets, [int(c) for c in split(args.cq)], split(args.targets)
+        ):
+            try:
+                result = run_case(clip, encoder, preset, cq, target, args.corpus)
+            except Exception as e:
+                prerror(f"Failed: {clip['path']} {encoder} {preset}: {e}")
+                continue
+            prinfo(f"{result['clip']} {encoder} {result['preset']} cq={cq} {target}: "
+                f"{result['fps']} fps, {result['wall_time']}s, "
+                f"{result['output_bytes']} bytes ({result['compression_ratio']})")
+            results.append(result)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        prsuccess(f"Baseline saved to: {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            prwarn(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+        prsuccess("No regressions")
@@ -1,51 +1,237 @@
 import os
+import time
+import socket
+import tempfile
+import threading
 import argparse
 
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from typing import Optional
 
-from utils.files import get_all_video_files, get_folder_size, get_output_path
-from utils.common import mb, to_mb, timed
-from utils.ffmpeg.transcoder import transcode
-from utils.logger import prerror, prinfo, prsuccess, prwarn
+from utils.files import FileIndex, scan_video_files, get_output_path, get_output_root
+from utils.watch import FolderWatcher
+from utils.common import to_mb, timed
+from utils.ffmpeg.core import detect_hw_encoder_key, SPEEDS
+from utils.ffmpeg.calibrate import ensure_calibrated
+from utils.ffmpeg.transcoder import (
+    transcode, remux, rendition_path, get_encoder, verify_output, Rendition,
+)
+from utils.ffmpeg.probe import probe, get_duration
+from utils.ffmpeg.progress import BatchProgress, Progress, ProgressCallback, eta
+from utils.ffmpeg.target import fit_cq
+from utils.ffmpeg.quality import check_quality
+from utils.ffmpeg.complexity import pick_profile
+from utils.ffmpeg.core import Profile, X265_CRF
+from utils.ffmpeg.policy import decide, DEFAULT_POLICY, SKIP, REMUX, ENCODE
+from utils.jobs import resolve_jobs, run_jobs
+from utils.journal import Journal, JOURNAL_NAME, file_state
+from utils.work_queue import (
+    WorkQueue, LeaseLostError, QUEUE_NAME, LEASE_TIME, LEASED, DONE, CLAIMED,
+)
+from utils.metrics import MetricsReport, source_info
+from utils.costs import CostModel, makespan
+from utils.cpu import CpuAllocator, thread_budget, PIN_NONE, PIN_CPUS, PIN_NUMA
+from utils.staging import Scratch, SCRATCH_PREFIX, recover_scratch
+from utils.dedup import FingerprintIndex, link_or_copy
+from utils.space import SpaceReserver, Need, MIN_FREE, SAFETY
+from utils.logger import prerror, prinfo, prsuccess, prwarn, prdebug
+
+# 10bit is recommended, it has more colors and better compression,
+# the only downside is that its not compatible on all devices
+TEN_BIT = True
+# Try to keep 96k unless theres music in the video, then use 128k or 256k
+AUDIO_BITRATE = "96k"
+# Audio that is already AAC/Opus at or below the bitrate is copied, the rest
+# is encoded with this, "opus" is smaller but "aac" plays on every device
+AUDIO_CODEC = "aac"
+# If you pick 1920x1080 it will take almost twice as long as 1280x720,
+# but conversion is almost the same size as 1280x720 for better quality.
+# Example: 1920x1080 is 2019.40 MB -> 155.57 MB (92.30%) (75.45s)
+#          1280x720  is 2019.40 MB -> 155.05 MB (92.32%) (40.06s)
+TARGET_RESOLUTION = "1280x720"
+# CQ of GPU encoders if none is given, libx265 uses its CRF of 24
+CQ = 28
+
+def encode_params(
+    cq: int,
+    encoder: Optional[str],
+    target_size: Optional[int] = None,
+    target_bitrate: Optional[int] = None,
+    renditions: Optional[list[Rendition]] = None,
+    speed: Optional[str] = None,
+    profiles: bool = False,
+    audio_codec: str = AUDIO_CODEC,
+) -> dict:
+    """Parameters that change the output, used to match journal entries"""
+    return {
+        "renditions": [list(r) for r in renditions] if renditions else None,
+        "cq": cq,
+        "target_size": target_size,
+        "target_bitrate": target_bitrate,
+        "encoder": encoder or "libx265",
+        "resolution": TARGET_RESOLUTION,
+        "ten_bit": TEN_BIT,
+        "audio_bitrate": AUDIO_BITRATE,
+        "audio_codec": audio_codec,
+        "speed": speed,
+        "profiles": profiles,
+    }
 
 def convert_video(
     input: str, 
     output: str, 
     overwriting: bool, 
     cq: int = 28,
-    delete_original: bool = False
+    delete_original: bool = False,
+    chunk_min_size: Optional[int] = None,
+    chunk_min_duration: Optional[float] = None,
+    chunks: Optional[int] = None,
+    remux_only: bool = False,
+    on_progress: Optional[ProgressCallback] = None,
+    renditions: Optional[list[Rendition]] = None,
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    cpus: Optional[list[int]] = None,
+    scratch: Optional[Scratch] = None,
+    keep_original: bool = False,
+    profile: Optional[Profile] = None,
+    audio_codec: str = AUDIO_CODEC,
 ) -> str:
     os.makedirs(os.path.dirname(output), exist_ok=True)
 
-    transcode(
-        # Input folder and output folder paths
-        input_path=input,
-        output_path=output,
-        # 10bit is recommended, it has more colors and better compression,
-        # the only downside is that its not compatible on all devices
-        ten_bit=True,
-        # Try to keep 96k unless theres music in the video, then use 128k or 256k
-        audio_bitrate="96k",
-        # Constant Quantization (0-51), the smaller number the better
-        # video quality is but bigger size, higher number is more compression
-        cq=cq,
-        # If you pick 1920x1080 it will take almost twice as long as 1280x720,
-        # but conversion is almost the same size as 1280x720 for better quality.
-        # Example: 1920x1080 is 2019.40 MB -> 155.57 MB (92.30%) (75.45s)
-        #          1280x720  is 2019.40 MB -> 155.05 MB (92.32%) (40.06s)
-        # target_resolution="1920x1080",
-    )
+    # Read and write on local disk, output is moved to its final path when verified
+    source = scratch.input(input) if scratch else input
+    target = scratch.output(input, output) if scratch else output
+
+    if remux_only:
+        remux(source, target, on_progress=on_progress,
+              audio_bitrate=AUDIO_BITRATE, audio_codec=audio_codec)
+    elif renditions:
+        # All renditions are encoded from one decode of the input
+        transcode(
+            input_path=source,
+            output_path=target,
+            ten_bit=TEN_BIT,
+            audio_bitrate=AUDIO_BITRATE,
+            audio_codec=audio_codec,
+            on_progress=on_progress,
+            renditions=renditions,
+            speed=speed,
+            threads=threads,
+            cpus=cpus,
+            profile=profile,
+        )
+    else:
+        transcode(
+            # Input folder and output folder paths
+            input_path=source,
+            output_path=target,
+            ten_bit=TEN_BIT,
+            audio_bitrate=AUDIO_BITRATE,
+            audio_codec=audio_codec,
+            # Constant Quantization (0-51), the smaller number the better
+            # video quality is but bigger size, higher number is more compression
+            cq=cq,
+            target_resolution=TARGET_RESOLUTION,
+            # Big files are split into chunks that are encoded in parallel
+            chunk_min_size=chunk_min_size,
+            chunk_min_duration=chunk_min_duration,
+            chunks=chunks,
+            on_progress=on_progress,
+            # Encoder and preset picked by calibration, None is best quality
+            speed=speed,
+            # Share of the cores of this job, so parallel jobs don't fight for them
+            threads=threads,
+            cpus=cpus,
+            # Changes to CQ, preset and frame rate for the content of this file
+            profile=profile,
+        )
+
+    # Nothing is published, deleted or replaced until every output is complete
+    suffixes = [r.suffix for r in renditions] if renditions else [""]
+    if scratch or overwriting or delete_original:
+        for suffix in suffixes:
+            verify_output(source, rendition_path(target, suffix))
 
+    if overwriting and scratch and not keep_original:
+        prwarn(f"Overwriting: {input}")
+        scratch.publish(target, input)
+        return input
+    if scratch:
+        for suffix in suffixes:
+            scratch.publish(rendition_path(target, suffix), rendition_path(output, suffix))
+    output = rendition_path(output, suffixes[0])
+
+    # Original is replaced or deleted later, once the output was checked
+    if keep_original:
+        return output
+    return release_original(input, output, overwriting, delete_original)
+
+def release_original(input: str, output: str, overwriting: bool, delete_original: bool) -> str:
+    """Replace the original with its output or delete it, return final output path"""
     if overwriting:
         prwarn(f"Overwriting: {input}")
         os.replace(output, input)
-        output = input
-    elif delete_original:
+        return input
+    if delete_original:
         prwarn(f"Deleting: {input}")
         os.remove(input)
-        
     return output
 
+def parse_renditions(value: str) -> list[Rendition]:
+    """Parse renditions like 1280x720:28:_720p,1920x1080:26:_1080p"""
+    renditions = []
+    for part in value.split(","):
+        resolution, cq, suffix = part.strip().split(":")
+        renditions.append(Rendition(resolution, int(cq), suffix))
+    return renditions
+
+def probe_duration(file_path: str) -> float:
+    """Return duration of a video, 0 if it can't be probed"""
+    try:
+        return get_duration(probe(file_path))
+    except RuntimeError:
+        return 0.0
+
+def order_jobs(files: list[str], estimate, order: str = "longest") -> list[str]:
+    """
+    Sort files by estimated encode time.
+
+    Args:
+        files (list[str]): Paths of the files
+        estimate (Callable): Returns (action, reason, seconds, output_bytes) of a file
+        order (str): "longest" or "shortest" first
+    """
+    times = {file_path: estimate(file_path)[2] for file_path in files}
+    return sorted(files, key=times.__getitem__, reverse=order == "longest")
+
+def plan_videos(files: list[str], estimate, index: FileIndex, workers: int, order: str):
+    """Print estimated time and savings of every file and of the whole run"""
+    input_bytes = output_bytes = 0
+    times = []
+    for file_path in files:
+        action, reason, seconds, size = estimate(file_path)
+        if action == SKIP:
+            prinfo(f"Skip: {file_path} ({reason})")
+            continue
+        input_bytes += index.size(file_path)
+        output_bytes += size
+        times.append(seconds)
+        prinfo(f"{action.capitalize()}: {file_path} ({to_mb(index.size(file_path))} -> "
+            f"~{to_mb(size)}, ~{eta(seconds, 1.0)})")
+
+    # Same order as the real run, so the ETA matches its scheduling
+    if order == "auto":
+        order = "scan" if workers == 1 else "longest"
+    if order != "scan":
+        times.sort(reverse=order == "longest")
+    prinfo(f"Files to convert: {len(times)} of {len(files)}")
+    prinfo(f"Estimated time: {eta(makespan(times, workers), 1.0)} with {workers} jobs "
+        f"({eta(sum(times), 1.0)} of encoding)")
+    saved = input_bytes - output_bytes
+    prinfo(f"Estimated size: {to_mb(input_bytes)} -> {to_mb(output_bytes)} "
+        f"(saves {to_mb(saved)}, {saved / input_bytes * 100 if input_bytes else 0:.2f}%)")
+
 @timed(prinfo)
 def convert_videos(
     input: str, 
@@ -53,8 +239,37 @@ def convert_videos(
     suffix: str = "_converted", 
     same_dir: bool = False, 
     ignore_suffix: Optional[str] = None, 
-    cq: int = 28,
-    delete_original: bool = False
+    cq: Optional[int] = None,
+    delete_original: bool = False,
+    jobs: str | int = 1,
+    chunk_min_size: Optional[int] = None,
+    chunk_min_duration: Optional[float] = None,
+    chunks: Optional[int] = None,
+    force: bool = False,
+    policy: Optional[dict] = None,
+    report: Optional[str] = None,
+    target_size: Optional[int] = None,
+    target_bitrate: Optional[int] = None,
+    watch: bool = False,
+    quiet_period: float = 30.0,
+    poll_interval: float = 5.0,
+    renditions: Optional[list[Rendition]] = None,
+    distributed: bool = False,
+    lease_time: float = LEASE_TIME,
+    plan: bool = False,
+    order: str = "auto",
+    speed: Optional[str] = None,
+    threads: str | int = "auto",
+    pin: str = PIN_NONE,
+    scratch_dir: Optional[str] = None,
+    scratch_budget: int = 50 * 1024**3,
+    dedup: bool = False,
+    verify_windows: int = 0,
+    verify_length: float = 2.0,
+    min_ssim: float = 0.9,
+    content_profiles: bool = False,
+    min_free: int = MIN_FREE,
+    audio_codec: str = AUDIO_CODEC,
 ) -> list[str]:
     """
     Convert all video files in the input folder.
@@ -64,40 +279,652 @@ def convert_videos(
         suffix (str): Suffix at the end of output file names
         same_dir (bool): Save to same directory as the input?
         ignore_suffix (str): Ignore files that already have this suffix
+        cq (int): Constant quality, CQ for GPU encoders and X265_CRF for libx265 if None
         delete_original (bool): Delete original file after conversion?
+        jobs (str | int): Number of files to convert at once or "auto"
+        chunk_min_size (int): Encode files bigger than this in chunks (bytes)
+        chunk_min_duration (float): Encode files longer than this in chunks (seconds)
+        chunks (int): Number of chunks for chunked encoding
+        force (bool): Convert files again even if journal says they are done
+        policy (dict): Rules for skipping or remuxing files, see DEFAULT_POLICY
+        report (str): Save metrics of every job to this JSON or CSV file
+        target_size (int): Pick CQ of every file to get this output size (bytes)
+        target_bitrate (int): Pick CQ of every file to get this average bitrate (bits/s)
+        watch (bool): Keep running and convert new files as they appear
+        quiet_period (float): Seconds a new file must not change before it's converted
+        poll_interval (float): Seconds between checks of the watched folder
+        renditions (list[Rendition]): Encode every file to all of these in one pass
+        distributed (bool): Share files with other workers through a queue in the output folder
+        lease_time (float): Seconds a claimed file is kept by a worker that stopped responding
+        plan (bool): Only estimate time and savings of the run, nothing is converted
+        order (str): Order of jobs, "scan", "longest" or "shortest" first by estimated
+            encode time, "auto" is longest first when running parallel jobs
+        speed (str): "fast", "balanced" or "archive", picks encoder and preset from
+            calibration, detected encoder at best quality if None
+        threads (str | int): Threads of every job, "auto" splits cores between parallel jobs
+        pin (str): Pin every job to its own CPUs ("cpus") or NUMA node ("numa"), or "none"
+        scratch_dir (str): Local folder to copy inputs to and write outputs in before
+            they are moved to the output folder, next inputs are prefetched into it
+        scratch_budget (int): Max bytes of files in the scratch folder
+        dedup (bool): Convert files with the same content once and link the outputs
+            to the other copies, also copies of files converted by earlier runs
+        verify_windows (int): Compare this many short windows of every output to its source
+            while the next file encodes, originals are kept if one scores too low, 0 is off
+        verify_length (float): Length of every compared window (seconds)
+        min_ssim (float): Lowest SSIM of a window that lets the original be deleted or replaced
+        content_profiles (bool): Analyze every file and change CQ, preset and frame rate
+            to match its content, see PROFILES
+        min_free (int): Bytes left free on the output and scratch disks, jobs whose
+            estimated output doesn't fit wait until others finish
+        audio_codec (str): Codec for audio that can't be copied, "aac" or "opus"
     """
-    video_files = get_all_video_files(input, ignore_suffix=ignore_suffix)
     converted_files = []
-    input_size = get_folder_size(input)
+    metrics = MetricsReport()
+
+    # Number of parallel jobs depends on the encoder we will use
+    if speed:
+        ensure_calibrated()
+        encoder = get_encoder(True, speed)
+    else:
+        encoder = detect_hw_encoder_key()
+    # libx265 keeps the CRF it always had unless CQ is given
+    given_cq = cq
+    if cq is None:
+        cq = X265_CRF if encoder in (None, "libx265") else CQ
+    workers = resolve_jobs(jobs, encoder)
+    if workers > 1:
+        prinfo(f"Converting with {workers} parallel jobs")
 
-    for file_path in video_files:
-        prinfo(f"Converting: {file_path} ({mb(file_path, ignore_suffix, suffix)})")
+    # Split cores between jobs, one job can use all of them
+    if threads == "auto":
+        threads = thread_budget(workers) if workers > 1 else None
+    else:
+        threads = int(threads)
+    allocator = CpuAllocator(workers, pin) if pin != PIN_NONE else None
+    if threads:
+        prinfo(f"Every job uses {threads} threads")
+
+    # Journal of finished files, so re-runs skip them
+    output_root = get_output_root(input, output, same_dir)
+    params = encode_params(
+        cq, encoder, target_size, target_bitrate, renditions, speed, content_profiles,
+        audio_codec)
+    work_queue = None
+    if distributed:
+        # Every node picks its own encoder and its default CQ, so they
+        # don't count when checking if another node already converted a file
+        queue_params = {**{k: v for k, v in params.items() if k != "encoder"}, "cq": given_cq}
+        if not plan:
+            work_queue = WorkQueue(
+                os.path.join(output_root, QUEUE_NAME), input, lease_time=lease_time)
+            prinfo(f"Distributed mode, worker: {work_queue.worker}")
+        # Appending to one journal from many machines is not safe on network
+        # shares, and partial outputs may belong to encodes still running elsewhere
+        name, ext = os.path.splitext(JOURNAL_NAME)
+        journal = Journal(
+            os.path.join(output_root, f"{name}.{socket.gethostname()}{ext}"),
+            discard_partial=False)
+    else:
+        journal = Journal(os.path.join(output_root, JOURNAL_NAME))
+    if not plan:
+        # Outputs of interrupted runs are discarded, not of ones still running
+        journal.recover()
+
+    # Scan input folder once, files are converted while the scan
+    # is still running and their sizes are taken from the index
+    exclude = [] if same_dir else [output_root]
+    if watch:
+        # Outputs written next to the inputs must not be picked up again
+        if same_dir and not ignore_suffix:
+            ignore_suffix = suffix or "."
+        if same_dir and renditions:
+            # Every rendition is named with its own suffix after the output suffix
+            ignore_suffix = (ignore_suffix, *(suffix + r.suffix for r in renditions))
+        prinfo(f"Watching: {input}")
+        index = FileIndex(FolderWatcher(
+            input,
+            quiet_period=quiet_period,
+            interval=poll_interval,
+            ignore_suffix=ignore_suffix,
+            exclude=exclude).watch())
+    else:
+        index = FileIndex(scan_video_files(input, ignore_suffix=ignore_suffix, exclude=exclude))
+    durations: dict[str, float] = {}
+    progress = BatchProgress()
+    costs = CostModel()
+    # Every run has its own scratch folder, runs may share the scratch dir
+    scratch = None
+    if scratch_dir and not plan:
+        os.makedirs(scratch_dir, exist_ok=True)
+        # Staged files of runs that crashed are removed, not of ones still running
+        recover_scratch(scratch_dir)
+        scratch = Scratch(
+            tempfile.mkdtemp(prefix=SCRATCH_PREFIX, dir=scratch_dir),
+            scratch_budget,
+            read_ahead=workers)
+
+    # Copies of files that are converted in this run, they get the outputs
+    # of the first copy when it's done, or are converted if it fails
+    fingerprints = FingerprintIndex() if dedup else None
+    duplicates: dict[str, list[str]] = {}
+    finished: dict[str, Optional[list[str]]] = {}
+    orphans: list[str] = []
+    dedup_lock = threading.Lock()
+
+    # Outputs are compared to their sources while the next files encode,
+    # originals are replaced or deleted when their check is done
+    verifier = ThreadPoolExecutor(max_workers=workers) if verify_windows else None
+    checks: list[Future] = []
+    deferred: set[str] = set()
+
+    def discover():
+        # Probe files as they are found to know duration of the batch,
+        # results are cached so files are not probed again later
+        for file in index:
+            if fingerprints and is_duplicate(file):
+                continue
+            durations[file.path] = probe_duration(file.path)
+            progress.add(durations[file.path])
+            yield file.path
+
+    # Files claimed by other workers, converted later if their lease expires
+    contended: list[str] = []
+
+    def requeued():
+        while orphans:
+            file_path = orphans.pop(0)
+            durations[file_path] = probe_duration(file_path)
+            progress.add(durations[file_path])
+            yield file_path
+        while contended:
+            time.sleep(poll_interval)
+            for file_path in list(contended):
+                state = work_queue.state(file_path, queue_params)
+                if state == LEASED:
+                    continue
+                contended.remove(file_path)
+                if state != DONE:
+                    progress.add(durations[file_path])
+                    yield file_path
+
+    def output_for(file_path: str) -> tuple[str, bool]:
+        output_path, overwriting = get_output_path(
+            file_path, 
+            input, 
+            output,
+            suffix, 
+            same_dir)
+        # Renditions are named by their own suffix, they never overwrite the input
+        if renditions and overwriting:
+            output_path, overwriting = file_path, False
+        return output_path, overwriting
+
+    def is_duplicate(file) -> bool:
+        """Check if a file gets the outputs of another copy instead of being converted"""
+        try:
+            primary = fingerprints.add(file)
+            if not force and journal.is_done(file.path, params):
+                return False
+            # Copy of a file converted by an earlier run
+            outputs = None if force else fingerprints.outputs_of(file.path, params)
+        except OSError as e:
+            prwarn(f"Can't fingerprint {file.path}: {e}")
+            return False
+        if outputs is None:
+            if primary is None:
+                return False
+            with dedup_lock:
+                if primary not in finished:
+                    prinfo(f"Same as {primary}, converting once: {file.path}")
+                    duplicates.setdefault(primary, []).append(file.path)
+                    return True
+                outputs = finished[primary]
+            if outputs is None:
+                return False
+        if not plan:
+            link_duplicate(file.path, outputs)
+        with dedup_lock:
+            finished.setdefault(file.path, outputs)
+        return True
+
+    def link_duplicate(file_path: str, outputs: list[str]):
+        output_path, overwriting = output_for(file_path)
+        if renditions:
+            targets = [rendition_path(output_path, r.suffix) for r in renditions]
+        else:
+            targets = [file_path if overwriting else output_path]
+        job = {"input": file_path, "input_bytes": index.size(file_path), "action": "duplicate"}
+        try:
+            state = file_state(file_path)
+            journal.start(file_path, targets, params)
+            for source, target in zip(outputs, targets):
+                link_or_copy(source, target)
+            if delete_original and not overwriting:
+                prwarn(f"Deleting: {file_path}")
+                os.remove(file_path)
+        except OSError as e:
+            prerror(f"Failed to link duplicate: {file_path}: {e}")
+            metrics.add(**job, status="failed", error=str(e))
+            return
+        journal.finish(file_path, targets, params, state)
+        metrics.add(**job, status="converted",
+            output=";".join(targets),
+            output_bytes=sum(os.path.getsize(path) for path in targets))
+        for target in targets:
+            prsuccess(f"Linked to: {target} (same as {outputs[0]})")
+            converted_files.append(target)
+
+    def settle(file_path: str, outputs: Optional[list[str]]):
+        """Give outputs of a finished file to its copies, or convert them if it has none"""
+        if outputs:
+            try:
+                fingerprints.record(file_path, params, outputs)
+            except OSError as e:
+                prdebug(f"Failed to fingerprint outputs of {file_path}: {e}")
+        with dedup_lock:
+            finished[file_path] = outputs or None
+            copies = duplicates.pop(file_path, [])
+        for copy in copies:
+            if outputs:
+                link_duplicate(copy, outputs)
+            elif watch:
+                prwarn(f"Not converted, will be on the next run: {copy}")
+            else:
+                prinfo(f"Converting copy on its own: {copy}")
+                orphans.append(copy)
+
+    def plan_file(file_path: str) -> tuple[Optional[dict], str, str, str, bool]:
+        # Decide if the file is worth re-encoding
+        try:
+            info = probe(file_path)
+            action, reason = decide(info, TARGET_RESOLUTION, policy)
+        except RuntimeError as e:
+            info = None
+            action, reason = ENCODE, f"probe failed: {e}"
+        if renditions and action == REMUX:
+            action, reason = ENCODE, f"{reason}, but renditions need encoding"
+        output_path, overwriting = output_for(file_path)
+        # Remuxing into the same file does nothing
+        if action == REMUX and overwriting:
+            action, reason = SKIP, f"{reason}, remuxing in place does nothing"
+        return info, action, reason, output_path, overwriting
+
+    def estimate(file_path: str) -> tuple[str, str, float, int]:
+        """Return action, reason, encode time and output size of a file"""
+        if not force and journal.is_done(file_path, params):
+            return SKIP, "already converted", 0.0, 0
+        _, action, reason, _, _ = plan_file(file_path)
+        if action == SKIP:
+            return action, reason, 0.0, 0
+        seconds, output_bytes = costs.estimate(
+            encoder, action, durations[file_path], index.size(file_path))
+        if renditions:
+            output_bytes *= len(renditions)
+        return action, reason, seconds, output_bytes
+
+    # Outputs of started jobs have their space reserved, jobs that
+    # don't fit wait for others to finish and free their originals
+    space = SpaceReserver(min_free)
+    needed: dict[str, list[Need]] = {}
+    waiting: set[str] = set()
+
+    def space_needed(file_path: str) -> list[Need]:
+        if file_path not in needed:
+            action, _, _, output_bytes = estimate(file_path)
+            needs = []
+            if action != SKIP:
+                output_bytes = int(output_bytes * SAFETY)
+                output_path, _ = output_for(file_path)
+                if renditions:
+                    targets = [rendition_path(output_path, r.suffix) for r in renditions]
+                else:
+                    targets = [output_path]
+                needs = [Need(os.path.dirname(path), output_bytes // len(targets), path)
+                         for path in targets]
+                if scratch:
+                    # Local copy of the input and the output before it's published
+                    needs.append(Need(scratch.folder, index.size(file_path) + output_bytes))
+            needed[file_path] = needs
+        return needed[file_path]
+
+    def admit(held: list[str]):
+        # Later jobs that fit go ahead of the ones that don't
+        for file_path in list(held):
+            try:
+                fits = space.reserve(file_path, space_needed(file_path))
+            except OSError as e:
+                prwarn(f"Can't check free space for {file_path}: {e}")
+                fits = space.reserve(file_path, [])
+            if fits:
+                held.remove(file_path)
+                yield file_path
+            elif file_path not in waiting:
+                waiting.add(file_path)
+                prinfo(f"Waiting for disk space: {file_path}")
+
+    def admitted(items):
+        held: list[str] = []
+        for file_path in items:
+            held.append(file_path)
+            yield from admit(held)
+        while held:
+            if space.idle():
+                # Nothing is running that could free space, the estimate may be
+                # too big, so the job runs alone and fails only if the disk fills up
+                file_path = held.pop(0)
+                prwarn(f"Estimated output doesn't fit, converting anyway: {file_path}")
+                space.reserve(file_path, [])
+                yield file_path
+                continue
+            space.wait(poll_interval)
+            yield from admit(held)
+
+    def staged(items):
+        # Inputs are prefetched in the order jobs will start
+        for file_path in items:
+            scratch.expect(file_path)
+            yield file_path
+
+    def convert(file_path: str) -> Optional[list[str]]:
+        # Every running job has its own CPUs when pinning
+        cpus = allocator.acquire() if allocator else None
+        try:
+            return claim_and_convert(file_path, cpus)
+        finally:
+            space.release(file_path)
+            needed.pop(file_path, None)
+            if allocator:
+                allocator.release(cpus)
+            if scratch:
+                scratch.release(file_path)
+
+    def claim_and_convert(file_path: str, cpus: Optional[list[int]]) -> Optional[list[str]]:
+        if work_queue is None:
+            return convert_file(file_path, cpus)
+
+        if not force and work_queue.state(file_path, queue_params) == DONE:
+            prinfo(f"Skipping, converted by another worker: {file_path}")
+            progress.skip(durations[file_path])
+            return None
+        claim = work_queue.try_claim(file_path, queue_params)
+        if claim == DONE:
+            prinfo(f"Skipping, converted by another worker: {file_path}")
+            progress.skip(durations[file_path])
+            return None
+        if claim != CLAIMED:
+            prinfo(f"Skipping for now, claimed by another worker: {file_path}")
+            progress.skip(durations[file_path])
+            contended.append(file_path)
+            return None
+        try:
+            outputs = convert_file(file_path, cpus)
+        except LeaseLostError as e:
+            prwarn(f"Stopped converting, {e}: {file_path}")
+            return None
+        except BaseException:
+            work_queue.release(file_path)
+            raise
+        work_queue.complete(file_path, queue_params)
+        return outputs
+
+    def check_file(
+        file_path: str,
+        result_path: str,
+        overwriting: bool,
+        outputs: list[str],
+        state: dict,
+        record: dict,
+    ):
+        try:
+            scores = [check_quality(
+                file_path, path,
+                windows=verify_windows,
+                length=verify_length,
+                min_ssim=min_ssim,
+                threads=threads,
+                duration=durations.get(file_path)) for path in outputs]
+        except Exception as e:
+            # Like a source that can't be read anymore, the original is kept
+            # and the entry finished, so the error is not lost in the future
+            prwarn(f"Keeping original, quality check failed: {file_path}: {e}")
+            metrics.update(record, error=f"quality check failed: {e}")
+            scores = None
+        if scores:
+            ssim = min(score["ssim"] for score in scores)
+            metrics.update(record,
+                ssim=round(ssim, 5),
+                psnr=round(min(score["psnr"] for score in scores), 2))
+            if not all(score["passed"] for score in scores):
+                prwarn(f"Keeping original, SSIM {ssim:.4f} is below {min_ssim}: {file_path}")
+                metrics.update(record, error=f"SSIM {ssim:.4f} below {min_ssim}")
+                scores = None
+            else:
+                prdebug(f"Quality OK, SSIM {ssim:.4f}: {file_path}")
+
+        if scores:
+            try:
+                result_path = release_original(file_path, result_path, overwriting, delete_original)
+                metrics.update(record, output=result_path if overwriting else ";".join(outputs))
+            except OSError as e:
+                prerror(f"Failed to replace or delete original: {file_path}: {e}")
+                scores = None
+        journal.finish(file_path, outputs if renditions else result_path, params, state)
+        if fingerprints:
+            # Copies don't get outputs that were rejected
+            settle(file_path, ([result_path] if overwriting else outputs) if scores else None)
+
+    def check_failed(file_path: str, check: Future):
+        # Nothing waits for the result of a check, so its errors are logged here
+        if not check.cancelled() and check.exception():
+            prerror(f"Failed to finish quality check: {file_path}: {check.exception()}")
+
+    def convert_file(file_path: str, cpus: Optional[list[int]] = None) -> Optional[list[str]]:
+        deferred.discard(file_path)
+        duration = durations[file_path]
+        job = {
+            "input": file_path,
+            "input_bytes": index.size(file_path),
+            "duration": duration,
+            "encoder": encoder or "libx265",
+            "threads": threads,
+            "cpus": ",".join(map(str, cpus)) if cpus else None,
+        }
+        if not force and journal.is_done(file_path, params):
+            prinfo(f"Skipping, already converted: {file_path}")
+            progress.skip(duration)
+            metrics.add(**job, status="skipped", action="journal")
+            return None
+
+        # Probe, analysis and sample encodes can fail too, so every
+        # file that is not converted has its record in the report
+        output_path = None
+        try:
+            info, action, reason, output_path, overwriting = plan_file(file_path)
+            job.update(source_info(info), action=action)
+            if action == SKIP:
+                prinfo(f"Skipping: {file_path} ({reason})")
+                progress.skip(duration)
+                metrics.add(**job, status="skipped")
+                return None
+            prdebug(f"{action.capitalize()}: {file_path} ({reason})")
+
+            # Static screen recordings and high motion footage get their own settings
+            profile = None
+            if content_profiles and action == ENCODE:
+                profile = pick_profile(file_path, duration, threads)
+                job["profile"] = profile.name
+
+            # Find CQ that hits the target with a few short sample encodes
+            file_cq = cq
+            if action == ENCODE and (target_size or target_bitrate) and not renditions:
+                file_cq = fit_cq(
+                    file_path, encoder,
+                    target_size=target_size,
+                    target_bitrate=target_bitrate,
+                    ten_bit=TEN_BIT,
+                    audio_bitrate=AUDIO_BITRATE,
+                    target_resolution=TARGET_RESOLUTION,
+                    start_cq=cq,
+                    speed=speed,
+                    threads=threads,
+                    cpus=cpus,
+                    profile=profile)
+                prinfo(f"Using CQ {file_cq} for: {file_path}")
+            job["cq"] = file_cq
+
+            prinfo(f"Converting: {file_path} ({to_mb(index.size(file_path))})")
+            state = file_state(file_path)
+            if fingerprints and (overwriting or delete_original):
+                # Original is gone after this run, later copies are matched by this hash
+                try:
+                    fingerprints.hash_source(file_path)
+                except OSError as e:
+                    prdebug(f"Failed to hash {file_path}: {e}")
+            # Every rendition is recorded, so all of them are cleaned up after a crash
+            journal.start(file_path, [rendition_path(output_path, r.suffix) for r in renditions]
+                          if renditions else output_path, params)
+        except Exception as e:
+            progress.skip(duration)
+            metrics.add(**job, status="failed", error=str(e), output=output_path)
+            raise
+
+        # Only encodes are checked, remuxed video is a copy of the source
+        verify = verifier is not None and action == ENCODE
+
+        # Keep the last progress update to know how many frames were encoded
+        last_progress: list[Progress] = []
+        on_progress = progress.callback(file_path, duration)
+        def track_progress(p: Progress):
+            # ffmpeg is stopped, so two workers don't write the same output
+            if work_queue and not work_queue.holds(file_path):
+                raise LeaseLostError("another worker took it over")
+            last_progress[:] = [p]
+            on_progress(p)
+
+        start = time.time()
         try:
-            # Convert the file
-            output_path, overwriting = get_output_path(
-                file_path, 
-                input, 
-                output,
-                suffix, 
-                same_dir)
             result_path = convert_video(
                 file_path, 
                 output_path, 
                 overwriting, 
-                cq=cq,
-                delete_original=delete_original)
-
-            prsuccess(f"Converted to: {result_path} ({mb(result_path, ignore_suffix, suffix)})")
-            converted_files.append(result_path)
+                cq=file_cq,
+                delete_original=delete_original,
+                chunk_min_size=chunk_min_size,
+                chunk_min_duration=chunk_min_duration,
+                chunks=chunks,
+                remux_only=action == REMUX,
+                on_progress=track_progress,
+                renditions=renditions,
+                speed=speed,
+                threads=threads,
+                cpus=cpus,
+                scratch=scratch,
+                keep_original=verify,
+                profile=profile,
+                audio_codec=audio_codec)
         except Exception as e:
-            prerror(f"Failed to convert: {file_path}: {e}")
+            progress.finish(file_path, 0)
+            progress.skip(duration)
+            metrics.add(**job, status="failed", error=str(e),
+                output=output_path, wall_time=round(time.time() - start, 3))
+            raise
+        wall_time = time.time() - start
+        progress.finish(file_path, duration)
+        if renditions:
+            outputs = [rendition_path(output_path, r.suffix) for r in renditions]
+        else:
+            outputs = [result_path]
+        if not verify:
+            journal.finish(file_path, outputs, params, state)
+
+        frames = last_progress[0].frame if last_progress else 0
+        record = metrics.add(**job, status="converted",
+            output=";".join(outputs),
+            output_bytes=sum(os.path.getsize(path) for path in outputs),
+            wall_time=round(wall_time, 3),
+            fps=round(frames / wall_time, 2) if frames and wall_time else None)
+        if verify:
+            # Finished, but not checked, if the run stops now the original is kept
+            journal.finish(file_path, outputs, params, state, pending=True)
+            deferred.add(file_path)
+            check = verifier.submit(
+                check_file, file_path, result_path, overwriting, outputs, state, record)
+            check.add_done_callback(lambda f, file_path=file_path: check_failed(file_path, f))
+            checks.append(check)
+            # Output replaces the input once it's checked
+            return [file_path] if overwriting else outputs
+        return outputs
+
+    # Planning only reads, outputs, journal, queue and fingerprints are left alone
+    if plan:
+        plan_videos(list(discover()), estimate, index, workers, order)
+        return converted_files
+
+    # Start the longest jobs first, so parallel runs don't end with one
+    # big file running alone, the scan must finish before anything starts
+    items = discover()
+    if order == "auto":
+        order = "scan" if watch or workers == 1 else "longest"
+    if order != "scan" and not watch:
+        items = order_jobs(list(items), estimate, order)
+
+    # Convert the files, results come in the order they finish
+    if work_queue:
+        work_queue.start()
+    try:
+        while True:
+            items = admitted(items)
+            if scratch:
+                items = staged(items)
+            for file_path, result_paths, error in run_jobs(convert, items, workers):
+                # Watch mode never waits for all checks, so drop the finished ones
+                checks[:] = [check for check in checks if not check.done()]
+                # Keep report up to date, watch mode only stops when interrupted
+                if watch and report:
+                    metrics.write(report)
+                if fingerprints and (error or file_path not in deferred):
+                    settle(file_path, None if error else result_paths)
+                if error:
+                    prerror(f"Failed to convert: {file_path}: {error}")
+                    continue
+                for result_path in result_paths or []:
+                    prsuccess(f"Converted to: {result_path} ({to_mb(os.path.getsize(result_path))})")
+                    converted_files.append(result_path)
+            # Copies of files that fail their check are converted on their own
+            wait(checks)
+            checks.clear()
+            # Wait for files of other workers, they are taken over if a worker dies
+            if not contended and not orphans:
+                break
+            if contended:
+                prinfo(f"Waiting for {len(contended)} files claimed by other workers")
+            items = requeued()
+    except KeyboardInterrupt:
+        if not watch:
+            raise
+        prwarn("Stopped watching")
+    finally:
+        if work_queue:
+            work_queue.stop()
+        if scratch:
+            scratch.close()
+        if verifier:
+            verifier.shutdown(wait=True, cancel_futures=True)
+        if fingerprints:
+            fingerprints.save()
     
-    # Calculate size reduction
-    output_folder = os.path.join(os.getcwd(), "converted") if not same_dir else input
-    output_size = get_folder_size(output_folder)
-    reduction = (((input_size - output_size) / input_size) * 100) if input_size > 0 else 0
-    prinfo(f"Size reduction: {to_mb(input_size)} -> "
-        f"{to_mb(output_size)} ({reduction:.2f}%)")
+    # Learn speed and compression of this machine for the next estimates
+    if not renditions:
+        costs.learn(metrics.jobs)
+        costs.save()
+
+    # Calculate size reduction of converted files
+    totals = metrics.totals()
+    prinfo(f"Size reduction: {to_mb(totals['input_bytes'])} -> "
+        f"{to_mb(totals['output_bytes'])} ({totals['reduction']:.2f}%)")
+    if report:
+        metrics.write(report)
+        prinfo(f"Report saved to: {report}")
 
     return converted_files
 
@@ -117,8 +944,77 @@ if __name__ == "__main__":
         help="Should we save to same directory as the input?")
     parser.add_argument("-del", "--delete-original", action="store_true", default=False, 
         help="Should we delete original files after conversion?")
-    parser.add_argument("-cq", type=int, default=28, 
-        help="Constant Quantization for video encoding (0-51)")
+    parser.add_argument("-cq", type=int, default=None, 
+        help=f"Constant Quantization for video encoding (0-51), {CQ} for GPU encoders "
+            f"and CRF {X265_CRF} for libx265 if not given")
+    parser.add_argument("-j", "--jobs", type=str, default="1", 
+        help="Number of videos to convert at once, or \"auto\" to pick by encoder")
+    parser.add_argument("--chunk-min-size", type=float, default=None, 
+        help="Split videos bigger than this (MB) into chunks encoded in parallel")
+    parser.add_argument("--chunk-min-duration", type=float, default=None, 
+        help="Split videos longer than this (seconds) into chunks encoded in parallel")
+    parser.add_argument("--chunks", type=int, default=None, 
+        help="Number of chunks for chunked encoding, picked by encoder by default")
+    parser.add_argument("--max-bitrate", type=int, default=DEFAULT_POLICY["max_bitrate"] // 1000, 
+        help="Keep HEVC/AV1 videos with lower bitrate than this (kb/s) without re-encoding")
+    parser.add_argument("--min-bitrate", type=int, default=DEFAULT_POLICY["min_bitrate"] // 1000, 
+        help="Keep any video with lower bitrate than this (kb/s) without re-encoding")
+    parser.add_argument("--efficient-action", type=str, default=DEFAULT_POLICY["efficient_action"], 
+        choices=[SKIP, REMUX, ENCODE],
+        help="What to do with videos that don't need re-encoding")
+    parser.add_argument("--target-size", type=float, default=None, 
+        help="Pick CQ of every video to get about this output size (MB)")
+    parser.add_argument("--target-bitrate", type=int, default=None, 
+        help="Pick CQ of every video to get about this average bitrate (kb/s)")
+    parser.add_argument("--renditions", type=str, default=None, 
+        help="Encode every video to several outputs in one pass, "
+            "like \"1280x720:28:_720p,1920x1080:26:_1080p\" (resolution:cq:suffix)")
+    parser.add_argument("--audio-codec", type=str, default=AUDIO_CODEC, choices=["aac", "opus"], 
+        help="Codec for audio that can't be copied")
+    parser.add_argument("-w", "--watch", action="store_true", default=False, 
+        help="Keep running and convert new videos as they appear in the input folder")
+    parser.add_argument("--quiet-period", type=float, default=30.0, 
+        help="Seconds a new video must not change before it's converted in watch mode")
+    parser.add_argument("--poll-interval", type=float, default=5.0, 
+        help="Seconds between checks of the input folder in watch mode")
+    parser.add_argument("--distributed", action="store_true", default=False, 
+        help="Share work with other machines running with the same output folder")
+    parser.add_argument("--lease-time", type=float, default=LEASE_TIME, 
+        help="Seconds before files claimed by a worker that stopped responding are converted again")
+    parser.add_argument("--plan", action="store_true", default=False, 
+        help="Only print estimated time and savings of the run, nothing is converted")
+    parser.add_argument("--order", type=str, default="auto", choices=["auto", "scan", "longest", "shortest"], 
+        help="Order of jobs by estimated encode time, auto is longest first with parallel jobs")
+    parser.add_argument("-r", "--report", type=str, default=None, 
+        help="Save metrics of every job to this file (.json or .csv)")
+    parser.add_argument("-f", "--force", action="store_true", default=False, 
+        help="Convert all videos again, even if journal says they are already converted")
+    parser.add_argument("--speed", type=str, default=None, choices=SPEEDS, 
+        help="Pick encoder and preset by speed and size of calibration encodes, best quality by default")
+    parser.add_argument("--calibrate", action="store_true", default=False, 
+        help="Measure speed and size of every encoder again")
+    parser.add_argument("--threads", type=str, default="auto", 
+        help="Threads of every job, \"auto\" splits cores between parallel jobs")
+    parser.add_argument("--pin", type=str, default=PIN_NONE, choices=[PIN_NONE, PIN_CPUS, PIN_NUMA], 
+        help="Pin every job to its own CPUs or NUMA node (Linux only)")
+    parser.add_argument("--scratch-dir", type=str, default=None, 
+        help="Local folder to encode in, inputs are prefetched and outputs are moved into place when verified")
+    parser.add_argument("--scratch-size", type=float, default=50, 
+        help="Max size of files in the scratch folder (GB)")
+    parser.add_argument("--dedup", action="store_true", default=False, 
+        help="Convert files with the same content once and hard link or copy the output to the other copies")
+    parser.add_argument("--verify-windows", type=int, default=0, 
+        help="Compare this many short windows of every output to its source, originals are kept if one scores too low")
+    parser.add_argument("--verify-length", type=float, default=2.0, 
+        help="Length of every compared window (seconds)")
+    parser.add_argument("--min-ssim", type=float, default=0.9, 
+        help="Lowest SSIM of a window that lets the original be deleted or replaced")
+    parser.add_argument("--profiles", action="store_true", default=False, 
+        help="Analyze every file and change CQ, preset and frame rate to match its content")
+    parser.add_argument("--min-free", type=float, default=MIN_FREE / 1024**3, 
+        help="Free space left on the output and scratch disks (GB), jobs that don't fit wait for others")
+    parser.add_argument("--refresh-capabilities", action="store_true", default=False, 
+        help="Detect hardware and ffmpeg encoders again instead of using cache")
     parser.add_argument("--debug", action="store_true", default=False, 
         help="Enable debug logging")
     args = parser.parse_args()
@@ -137,9 +1033,56 @@ if __name__ == "__main__":
         args.output = None
     
     # Check if CQ value is valid
-    if not (0 <= args.cq <= 51):
-        prwarn(f"Invalid CQ value: {args.cq}, using default value (28)")
-        args.cq = 28
+    if args.cq is not None and not (0 <= args.cq <= 51):
+        prwarn(f"Invalid CQ value: {args.cq}, using default value")
+        args.cq = None
+
+    # Check if jobs value is valid
+    if args.jobs != "auto" and not (args.jobs.isdigit() and int(args.jobs) > 0):
+        prwarn(f"Invalid jobs value: {args.jobs}, using default value (1)")
+        args.jobs = "1"
+
+    # Check if threads value is valid
+    if args.threads != "auto" and not (args.threads.isdigit() and int(args.threads) > 0):
+        prwarn(f"Invalid threads value: {args.threads}, using default value (auto)")
+        args.threads = "auto"
+
+    # Check if renditions are valid
+    renditions = None
+    if args.renditions:
+        try:
+            renditions = parse_renditions(args.renditions)
+        except ValueError:
+            prerror(f"Invalid renditions: {args.renditions}")
+            exit(1)
+        suffixes = [r.suffix for r in renditions]
+        if "" in suffixes or len(set(suffixes)) != len(suffixes):
+            prerror("Every rendition needs its own suffix")
+            exit(1)
+
+    # Plan needs the whole list of files, watch mode never ends it
+    if args.plan and args.watch:
+        prwarn("Ignoring watch option since plan option is enabled")
+        args.watch = False
+
+    # Only one target can be used
+    if args.target_size and args.target_bitrate:
+        prwarn("Ignoring target bitrate since target size is set")
+        args.target_bitrate = None
+
+    # Every rendition has its own CQ and all of them are encoded in one pass
+    if renditions and (args.target_size or args.target_bitrate):
+        prwarn("Ignoring target size and bitrate since renditions are set")
+        args.target_size = args.target_bitrate = None
+    if renditions and (args.chunk_min_size or args.chunk_min_duration):
+        prwarn("Ignoring chunked encoding since renditions are set")
+        args.chunk_min_size = args.chunk_min_duration = None
+
+    # Detect encoders once, every job will use the cached result
+    if args.refresh_capabilities:
+        detect_hw_encoder_key(refresh=True)
+    if args.calibrate:
+        ensure_calibrated(refresh=True)
 
     convert_videos(args.input,
         output=args.output,
@@ -147,5 +1090,38 @@ if __name__ == "__main__":
         same_dir=args.same_dir,
         ignore_suffix=args.ignore_suffix,
         cq=args.cq,
-        delete_original=args.delete_original
+        delete_original=args.delete_original,
+        jobs=args.jobs,
+        chunk_min_size=int(args.chunk_min_size * 1024**2) if args.chunk_min_size else None,
+        chunk_min_duration=args.chunk_min_duration,
+        chunks=args.chunks,
+        force=args.force,
+        policy={
+            "max_bitrate": args.max_bitrate * 1000,
+            "min_bitrate": args.min_bitrate * 1000,
+            "efficient_action": args.efficient_action,
+        },
+        report=args.report,
+        target_size=int(args.target_size * 1024**2) if args.target_size else None,
+        target_bitrate=args.target_bitrate * 1000 if args.target_bitrate else None,
+        watch=args.watch,
+        quiet_period=args.quiet_period,
+        distributed=args.distributed,
+        lease_time=args.lease_time,
+        plan=args.plan,
+        order=args.order,
+        poll_interval=args.poll_interval,
+        renditions=renditions,
+        speed=args.speed,
+        threads=args.threads,
+        pin=args.pin,
+        scratch_dir=args.scratch_dir,
+        scratch_budget=int(args.scratch_size * 1024**3),
+        dedup=args.dedup,
+        verify_windows=args.verify_windows,
+        verify_length=args.verify_length,
+        min_ssim=args.min_ssim,
+        content_profiles=args.profiles,
+        min_free=int(args.min_free * 1024**3),
+        audio_codec=args.audio_codec,
     )
@@ -0,0 +1,56 @@
+import sys
+import time
+import asyncio
+import pytest
+from utils.ffmpeg.async_transcoder import run_ffmpeg_async, TranscodeStalledError, TranscodeTimeoutError
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="uses a shell script as ffmpeg")
+
+
+def fake_ffmpeg(tmp_path, body):
+    """Create a script that ignores ffmpeg arguments """
+    path = tmp_path / "ffmpeg"
+    path.write_text(f"#!/bin/sh\n{body}\n")
+    path.chmod(0o755)
+    return str(path)
+
+
+def test_stalled_job_is_killed_and_cleaned_up(tmp_path):
+    """Test that a job without progress is stopped and its output removed """
+    output = tmp_path / "output.mp4"
+    ffmpeg = fake_ffmpeg(tmp_path, f"echo partial > '{output}'\nsleep 30")
+
+    start = time.monotonic()
+    with pytest.raises(TranscodeStalledError):
+        asyncio.run(run_ffmpeg_async([ffmpeg], stall_timeout=1, output_path=str(output)))
+    assert time.monotonic() - start < 10
+    assert not output.exists()
+
+
+def test_timeout_and_cancel(tmp_path):
+    """Test wall-clock timeout and cancellation of running jobs """
+    ffmpeg = fake_ffmpeg(tmp_path, "while true; do echo frame=1; echo progress=continue; sleep 0.1; done")
+    with pytest.raises(TranscodeTimeoutError):
+        asyncio.run(run_ffmpeg_async([ffmpeg], timeout=1))
+
+    async def cancel_jobs():
+        tasks = [asyncio.create_task(run_ffmpeg_async([ffmpeg])) for _ in range(3)]
+        await asyncio.sleep(0.5)
+        for task in tasks:
+            task.cancel()
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    results = asyncio.run(cancel_jobs())
+    assert all(isinstance(r, asyncio.CancelledError) for r in results)
+
+
+def test_existing_output_is_kept(tmp_path):
+    """Test that a failed run without overwrite doesn't remove a file it didn't write """
+    output = tmp_path / "output.mp4"
+    output.write_bytes(b"converted earlier")
+    # ffmpeg -n exits with an error when the output exists
+    ffmpeg = fake_ffmpeg(tmp_path, "exit 1")
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(run_ffmpeg_async([ffmpeg, "-n"], output_path=str(output)))
+    assert output.read_bytes() == b"converted earlier"
@@ -0,0 +1,14 @@
+from bench import compare
+
+
+def make_result(fps, size):
+    return {"clip": "static_1280x720_2s.mp4", "encoder": "libx265", "preset": "default",
+            "cq": 28, "target_resolution": "1280x720", "fps": fps, "output_bytes": size}
+
+
+def test_compare_flags_regressions():
+    """Test that slower or bigger results are flagged """
+    baseline = [make_result(100.0, 1000)]
+    assert compare([make_result(95.0, 1050)], baseline, 0.1) == []
+    assert len(compare([make_result(80.0, 1000)], baseline, 0.1)) == 1
+    assert len(compare([make_result(80.0, 2000)], baseline, 0.1)) == 2
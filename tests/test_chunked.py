@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import pytest
+from utils.ffmpeg import transcoder
+from utils.ffmpeg.transcoder import should_chunk, transcode_chunked, encoder_sessions, verify_chunked
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="uses shell scripts as ffmpeg")
+
+PROBE = {
+    "format": {"duration": "3.0"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1920, "height": 1080},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "bit_rate": "96000"},
+    ],
+}
+
+# Logs every command, the segment command writes three chunks
+# and every other command writes its last argument as output
+FFMPEG = """#!/bin/sh
+echo "$*" >> "$FAKE_LOG"
+for out; do :; done
+case "$*" in
+    *"-f segment"*)
+        for i in 0000 0001 0002; do echo chunk > "$(dirname "$out")/source_$i.mkv"; done;;
+    *)
+        echo out_time_us=1000000; echo progress=end
+        echo encoded > "$out";;
+esac
+"""
+
+FFPROBE = f"""#!/bin/sh
+case "$*" in
+    *-count_packets*) echo 90;;
+    *) echo '{json.dumps(PROBE)}';;
+esac
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Put scripts that act like ffmpeg and ffprobe first in PATH """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "ffmpeg").write_text(FFMPEG)
+    (bin_dir / "ffprobe").write_text(FFPROBE)
+    for name in ("ffmpeg", "ffprobe"):
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_LOG", str(tmp_path / "commands.log"))
+    # Two encoder sessions, fresh for every test
+    monkeypatch.setattr(transcoder, "_sessions", {})
+    monkeypatch.setattr(transcoder, "max_parallel_jobs", lambda hw: 2)
+    source = tmp_path / "in" / "video.mkv"
+    source.parent.mkdir()
+    source.write_bytes(b"x" * 100)
+    return str(source)
+
+
+def test_should_chunk(fake_ffmpeg):
+    """Test size and duration thresholds of chunked encoding """
+    assert not should_chunk(fake_ffmpeg)
+    assert should_chunk(fake_ffmpeg, min_size=100)
+    assert not should_chunk(fake_ffmpeg, min_size=101)
+    assert should_chunk(fake_ffmpeg, min_duration=3.0)
+    assert not should_chunk(fake_ffmpeg, min_size=101, min_duration=5.0)
+
+
+def test_split_encode_and_join(fake_ffmpeg, tmp_path, monkeypatch):
+    """Test that chunks are split on keyframes, encoded and joined with the source audio """
+    # Eight cores, split between two chunks at once
+    budget = transcoder.thread_budget
+    monkeypatch.setattr(transcoder, "thread_budget", lambda jobs, cpus=None: budget(jobs, cpus or 8))
+    output = str(tmp_path / "out" / "video.mkv")
+    os.makedirs(os.path.dirname(output))
+    updates = []
+    transcode_chunked(fake_ffmpeg, output, prefer_gpu=False, chunks=3, on_progress=updates.append)
+
+    with open(tmp_path / "commands.log") as f:
+        commands = f.read().splitlines()
+    split, *encodes, join = commands
+    assert "-f segment" in split and "-segment_time 1.000" in split and "-c copy -an" in split
+    assert sorted(c.split(" -i ")[1].split()[0].rsplit("/", 1)[1] for c in encodes) == [
+        "source_0000.mkv", "source_0001.mkv", "source_0002.mkv"]
+    assert all("-x265-params pools=4:frame-threads=2" in c for c in encodes)
+    assert "-f concat" in join and f"-i {fake_ffmpeg}" in join and "-c:v copy" in join
+    assert open(output).read() == "encoded\n"
+    assert updates and updates[-1].out_time == 3.0
+    # Chunks are removed
+    assert os.listdir(os.path.dirname(output)) == ["video.mkv"]
+
+
+def test_chunks_share_encoder_sessions(fake_ffmpeg, tmp_path, monkeypatch):
+    """Test that chunks only run in encoder sessions other jobs don't use """
+    pools = []
+    pool = transcoder.ThreadPoolExecutor
+    monkeypatch.setattr(transcoder, "ThreadPoolExecutor",
+                        lambda max_workers: pools.append(max_workers) or pool(max_workers))
+    output = str(tmp_path / "out.mkv")
+
+    transcode_chunked(fake_ffmpeg, output, prefer_gpu=False, chunks=3)
+    # Another job encodes in one of the two sessions
+    sessions = encoder_sessions(None)
+    with sessions:
+        transcode_chunked(fake_ffmpeg, output, prefer_gpu=False, chunks=3)
+    assert pools == [2, 1]
+
+    # Every session is given back
+    assert sessions.acquire(blocking=False) and sessions.acquire(blocking=False)
+    assert not sessions.acquire(blocking=False)
+
+
+def test_verify_capped_frame_rate(monkeypatch):
+    """Test that frames dropped by a frame rate cap are not counted as lost """
+    frames = {"in.mkv": 300, "out.mkv": 150}
+    monkeypatch.setattr(transcoder, "probe", lambda path: {"format": {"duration": "10.0"}})
+    monkeypatch.setattr(transcoder, "count_video_frames", lambda path: frames[path])
+
+    # 30 fps source capped at 15 fps
+    verify_chunked("in.mkv", "out.mkv", 10.0, 3, max_fps=15)
+    with pytest.raises(RuntimeError, match="Frame count mismatch"):
+        verify_chunked("in.mkv", "out.mkv", 10.0, 3)
+    # Source below the cap keeps all of its frames
+    frames["out.mkv"] = 300
+    verify_chunked("in.mkv", "out.mkv", 10.0, 3, max_fps=60)
+
+
+def test_failed_encode_keeps_existing_output(fake_ffmpeg, tmp_path, monkeypatch):
+    """Test that an encode that fails before joining doesn't remove an output it didn't write """
+    output = tmp_path / "out.mkv"
+    output.write_text("converted earlier")
+    def fail(*args, **kwargs):
+        raise RuntimeError("encode failed")
+    monkeypatch.setattr(transcoder, "build_command", fail)
+
+    with pytest.raises(RuntimeError, match="encode failed"):
+        transcode_chunked(fake_ffmpeg, str(output), prefer_gpu=False, chunks=3)
+    assert output.read_text() == "converted earlier"
@@ -0,0 +1,20 @@
+from utils.ffmpeg.complexity import parse_frames, classify
+
+
+def test_parse_frames():
+    log = (
+        "[Parsed_metadata_4 @ 0x1] frame:0    pts:0       pts_time:0\n"
+        "[Parsed_metadata_4 @ 0x1] lavfi.scene_score=0.000000\n"
+        "[Parsed_metadata_4 @ 0x1] lavfi.signalstats.YDIF=0.000000\n"
+        "[Parsed_metadata_4 @ 0x1] frame:1    pts:1       pts_time:0.04\n"
+        "[Parsed_metadata_4 @ 0x1] lavfi.scene_score=0.512000\n"
+        "[Parsed_metadata_4 @ 0x1] lavfi.signalstats.YDIF=14.250000\n"
+    )
+    assert parse_frames(log) == [(0.0, 0.0), (0.512, 14.25)]
+
+
+def test_classify():
+    assert classify({"motion": 0.4, "still": 0.95, "cuts_per_minute": 10.0}) == "static"
+    assert classify({"motion": 5.0, "still": 0.2, "cuts_per_minute": 8.0}) == "normal"
+    assert classify({"motion": 15.0, "still": 0.0, "cuts_per_minute": 4.0}) == "motion"
+    assert classify({"motion": 6.0, "still": 0.1, "cuts_per_minute": 40.0}) == "motion"
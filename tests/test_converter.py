@@ -0,0 +1,101 @@
+import io
+import os
+import sys
+import json
+import pytest
+from concurrent.futures import CancelledError
+from utils.converter import Converter, DONE, FAILED, CANCELLED
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="uses shell scripts as ffmpeg")
+
+PROBE = {
+    "format": {"duration": "2.0"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "bit_rate": "96000"},
+    ],
+}
+
+# Writes the last argument as output and reports progress of two seconds
+FFMPEG = """#!/bin/sh
+for out; do :; done
+case "$FAKE_FFMPEG" in fail) exit 1;; esac
+echo out_time_us=1000000; echo progress=continue
+[ "$FAKE_FFMPEG" = slow ] && sleep 5
+echo out_time_us=2000000; echo progress=end
+echo encoded > "$out"
+"""
+
+
+@pytest.fixture
+def fake_ffmpeg(tmp_path, monkeypatch):
+    """Put scripts that act like ffmpeg and ffprobe first in PATH """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (bin_dir / "ffmpeg").write_text(FFMPEG)
+    (bin_dir / "ffprobe").write_text(f"#!/bin/sh\necho '{json.dumps(PROBE)}'\n")
+    for name in ("ffmpeg", "ffprobe"):
+        (bin_dir / name).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    source = tmp_path / "in" / "video.mp4"
+    source.parent.mkdir()
+    source.write_bytes(b"source")
+    return str(source)
+
+
+def read_events(stream):
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_submit_and_events(fake_ffmpeg, tmp_path):
+    events = io.StringIO()
+    with Converter(str(tmp_path / "out"), prefer_gpu=False, jobs=1,
+                   events=events, progress_interval=0) as converter:
+        job = converter.submit(fake_ffmpeg)
+        assert job.result(timeout=30) == str(tmp_path / "out" / "video_converted.mp4")
+    assert job.status == DONE and job.percent == 100.0
+    names = [e["event"] for e in read_events(events)]
+    assert names[0] == "queued" and names[1] == "started"
+    assert "progress" in names and names[-1] == "finished"
+    assert all(e["job"] == job.id for e in read_events(events))
+    # Finished jobs are not kept
+    assert converter.jobs == {}
+
+
+def test_existing_output_is_refused(fake_ffmpeg, tmp_path):
+    output = tmp_path / "out" / "video.mp4"
+    output.parent.mkdir()
+    output.write_bytes(b"converted earlier")
+    with Converter(prefer_gpu=False, jobs=1) as converter:
+        with pytest.raises(ValueError):
+            converter.submit(fake_ffmpeg, str(output))
+    assert output.read_bytes() == b"converted earlier"
+
+    with Converter(prefer_gpu=False, jobs=1, overwrite=True) as converter:
+        assert converter.submit(fake_ffmpeg, str(output)).result(timeout=30) == str(output)
+    assert output.read_bytes() == b"encoded\n"
+
+
+def test_failed_job(fake_ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG", "fail")
+    events = io.StringIO()
+    with Converter(str(tmp_path / "out"), prefer_gpu=False, jobs=1, events=events) as converter:
+        job = converter.submit(fake_ffmpeg)
+        with pytest.raises(RuntimeError):
+            job.result(timeout=30)
+    assert job.status == FAILED and job.error
+    assert read_events(events)[-1]["event"] == "failed"
+
+
+def test_cancel_running_job(fake_ffmpeg, tmp_path, monkeypatch):
+    monkeypatch.setenv("FAKE_FFMPEG", "slow")
+    with Converter(str(tmp_path / "out"), prefer_gpu=False, jobs=1) as converter:
+        job = converter.submit(fake_ffmpeg)
+        queued = converter.submit(fake_ffmpeg, str(tmp_path / "out" / "second.mp4"))
+        assert queued.cancel() and queued.status == CANCELLED
+        # Cancel is noticed with the next progress update
+        assert job.cancel()
+        with pytest.raises(CancelledError):
+            job.result(timeout=30)
+    assert job.status == CANCELLED
+    assert not os.path.exists(job.output)
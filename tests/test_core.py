@@ -0,0 +1,104 @@
+import os
+import json
+import utils.ffmpeg.core as core
+
+
+def test_capabilities_are_cached(tmp_path, monkeypatch):
+    """Test that detection runs once and is reused from disk cache """
+    calls = []
+    def fake_encoders():
+        calls.append(1)
+        return {"hevc_nvenc", "libx265"}
+
+    monkeypatch.setattr(core, "CAPABILITIES_CACHE", str(tmp_path / "caps.json"))
+    monkeypatch.setattr(core, "_capabilities", None)
+    monkeypatch.setattr(core, "get_ffmpeg_encoders", fake_encoders)
+    monkeypatch.setattr(core, "get_hardware_type", lambda: "nvidia")
+
+    assert core.detect_hw_encoder_key() == "nvenc"
+    assert core.detect_hw_encoder_key() == "nvenc"
+    assert len(calls) == 1
+    assert os.path.exists(tmp_path / "caps.json")
+
+    # New process should read it from disk
+    monkeypatch.setattr(core, "_capabilities", None)
+    assert core.detect_hw_encoder_key() == "nvenc"
+    assert len(calls) == 1
+
+    # Refresh should always detect again
+    core.detect_hw_encoder_key(refresh=True)
+    assert len(calls) == 2
+
+
+RESULTS = [
+    {"encoder": "libx264", "preset": "veryfast", "fps": 300.0, "bytes": 900_000, "ssim": 0.970},
+    {"encoder": "libx265", "preset": "fast", "fps": 60.0, "bytes": 500_000, "ssim": 0.972},
+    {"encoder": "libx265", "preset": "veryslow", "fps": 3.0, "bytes": 400_000, "ssim": 0.975},
+    # Tiny output, but quality is too low to compare
+    {"encoder": "svtav1", "preset": "10", "fps": 500.0, "bytes": 100_000, "ssim": 0.900},
+]
+
+
+def test_pick_calibrated():
+    """Test that every speed picks its trade-off among results of similar quality """
+    assert core.pick_calibrated(RESULTS, "fast")["preset"] == "veryfast"
+    assert core.pick_calibrated(RESULTS, "archive")["preset"] == "veryslow"
+    assert core.pick_calibrated(RESULTS, "balanced")["preset"] == "fast"
+    assert core.pick_calibrated([], "fast") is None
+
+
+def test_build_args_uses_speed_preset(tmp_path, monkeypatch):
+    """Test that speed picks calibrated preset of the picked encoder only """
+    monkeypatch.setattr(core, "load_calibration", lambda: RESULTS)
+    args = core.build_args(None, True, 28, speed="balanced")
+    assert args[args.index("-preset") + 1] == "fast"
+    # Not the calibrated encoder, default preset of this speed is used
+    args = core.build_args("svtav1", True, 28, speed="archive")
+    assert args[args.index("-preset") + 1] == "5"
+    assert args[args.index("-crf") + 1] == "35"
+    # Explicit preset always wins
+    args = core.build_args(None, True, 28, preset="slow", speed="fast")
+    assert args[args.index("-preset") + 1] == "slow"
+
+
+def test_build_args_profile(monkeypatch):
+    """Test that content profile changes CQ, preset and frame rate """
+    monkeypatch.setattr(core, "load_calibration", lambda: None)
+    args = core.build_args(None, True, 28, profile=core.PROFILES["static"])
+    assert args[args.index("-crf") + 1] == "34"
+    assert args[args.index("-preset") + 1] == "fast"
+    assert args[args.index("-fpsmax") + 1] == "15"
+    args = core.build_args(None, True, 50, profile=core.PROFILES["static"])
+    assert args[args.index("-crf") + 1] == "51"
+    args = core.build_args(None, True, 28, profile=core.PROFILES["motion"])
+    assert args[args.index("-crf") + 1] == "26"
+    assert args[args.index("-preset") + 1] == "veryslow"
+    assert "-fpsmax" not in args
+    args = core.build_args(None, True, 28, preset="slow", profile=core.PROFILES["static"])
+    assert args[args.index("-preset") + 1] == "slow"
+
+
+def test_calibration_is_read_once(tmp_path, monkeypatch):
+    """Test that calibration cache is read once per process until refreshed """
+    path = tmp_path / "calibration.json"
+    monkeypatch.setattr(core, "CALIBRATION_CACHE", str(path))
+    monkeypatch.setattr(core, "_calibration", None)
+    monkeypatch.setattr(core, "capabilities_key", lambda: "key")
+    assert core.load_calibration() is None
+
+    path.write_text(json.dumps({"key": "key", "results": RESULTS}))
+    assert core.load_calibration() is None
+    assert core.load_calibration(refresh=True) == RESULTS
+    path.unlink()
+    assert core.load_calibration() == RESULTS
+
+
+def test_build_args_default_cq(monkeypatch):
+    """Test that libx265 keeps CRF 24 unless CQ is given """
+    monkeypatch.setattr(core, "load_calibration", lambda: None)
+    args = core.build_args(None, True, None)
+    assert args[args.index("-crf") + 1] == "24"
+    args = core.build_args(None, True, 30)
+    assert args[args.index("-crf") + 1] == "30"
+    args = core.build_args("nvenc", True, None)
+    assert args[args.index("-cq:v") + 1] == str(core.DEFAULT_CQ)
@@ -0,0 +1,34 @@
+from utils.costs import CostModel, makespan
+
+
+def test_cost_model_learns_from_jobs(tmp_path):
+    """Test that estimates follow speed and bitrate of previous runs """
+    path = str(tmp_path / "costs.json")
+    model = CostModel(path)
+    # Defaults are used before there is any history
+    seconds, size = model.estimate("nvenc", "encode", 80.0, 100_000_000)
+    assert seconds == 10.0
+    assert size == 80 * 125_000
+
+    model.learn([
+        {"status": "converted", "encoder": "nvenc", "action": "encode",
+         "duration": 100.0, "wall_time": 25.0, "input_bytes": 50_000_000, "output_bytes": 5_000_000},
+        {"status": "failed", "encoder": "nvenc", "action": "encode",
+         "duration": 100.0, "wall_time": 1.0, "input_bytes": 1, "output_bytes": None},
+    ])
+    model.save()
+
+    model = CostModel(path)
+    seconds, size = model.estimate("nvenc", "encode", 200.0, 100_000_000)
+    assert seconds == 50.0
+    assert size == 10_000_000
+    # Output is never estimated bigger than the input
+    assert model.estimate("nvenc", "encode", 200.0, 1_000)[1] == 1_000
+
+
+def test_makespan():
+    """Test that longest jobs first finish sooner on parallel workers """
+    assert makespan([5, 5, 5, 5], 2) == 10
+    assert makespan([1, 1, 1, 1, 4], 2) == 6
+    assert makespan([4, 1, 1, 1, 1], 2) == 4
+    assert makespan([], 3) == 0
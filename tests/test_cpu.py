@@ -0,0 +1,39 @@
+from utils.cpu import parse_cpulist, split_cpus, thread_budget, CpuAllocator, PIN_NUMA
+from utils.ffmpeg.core import build_args
+
+NODES = [[0, 1, 2, 3, 4, 5], [6, 7, 8, 9, 10, 11]]
+
+
+def test_parse_cpulist():
+    assert parse_cpulist("0-3,8,10-11\n") == [0, 1, 2, 3, 8, 10, 11]
+    assert parse_cpulist("") == []
+
+
+def test_split_cpus_keeps_jobs_on_one_node():
+    """Test that CPU sets don't cross NUMA nodes when they fit in one """
+    assert split_cpus(2, nodes=NODES) == NODES
+    assert split_cpus(4, nodes=NODES) == [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9, 10, 11]]
+    # 12 / 5 = 2 cores, two are left over on every node
+    slots = split_cpus(5, nodes=NODES)
+    assert all(len(slot) == 2 for slot in slots)
+    assert len({cpu for slot in slots for cpu in slot}) == 10
+    # More jobs than CPUs have to share them
+    assert len(split_cpus(3, nodes=[[0, 1]])) == 3
+    assert split_cpus(3, PIN_NUMA, nodes=NODES) == [NODES[0], NODES[1], NODES[0]]
+
+
+def test_allocator_hands_out_distinct_sets(monkeypatch):
+    monkeypatch.setattr("utils.cpu.numa_nodes", lambda: NODES)
+    allocator = CpuAllocator(2)
+    first, second = allocator.acquire(), allocator.acquire()
+    assert set(first).isdisjoint(second)
+    allocator.release(first)
+    assert allocator.acquire() == first
+
+
+def test_thread_budget_and_x265_params():
+    assert thread_budget(4, cpus=16) == 4
+    assert thread_budget(32, cpus=16) == 1
+    args = build_args(None, True, 28, threads=4)
+    assert args[args.index("-x265-params") + 1] == "pools=4:frame-threads=2"
+    assert "-x265-params" not in build_args(None, True, 28)
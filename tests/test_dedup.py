@@ -0,0 +1,100 @@
+import os
+from utils.dedup import FingerprintIndex, link_or_copy, SAMPLE_BLOCKS, SAMPLE_SIZE
+from utils.files import VideoFile
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+    st = os.stat(path)
+    return VideoFile(str(path), st.st_size, st.st_mtime)
+
+
+def test_finds_links_and_copies(tmp_path):
+    data = os.urandom(SAMPLE_BLOCKS * SAMPLE_SIZE * 2)
+    a = write(tmp_path / "a" / "video.mkv", data)
+    b = write(tmp_path / "b" / "video.mkv", data)
+    os.link(a.path, tmp_path / "a" / "link.mkv")
+    link = VideoFile(str(tmp_path / "a" / "link.mkv"), a.size, a.mtime)
+    other = write(tmp_path / "c" / "video.mkv", os.urandom(len(data)))
+
+    index = FingerprintIndex(str(tmp_path / "fingerprints.json"))
+    assert index.add(a) is None
+    assert index.add(link) == a.path
+    assert index.add(b) == a.path
+    assert index.add(other) is None
+    # Only files with matching samples are hashed completely
+    assert index.files[a.path]["full"] is not None
+    assert index.files[other.path]["full"] is None
+
+
+def test_same_samples_different_content(tmp_path):
+    data = bytearray(os.urandom(SAMPLE_BLOCKS * SAMPLE_SIZE * 4))
+    a = write(tmp_path / "a.mkv", bytes(data))
+    # Change a byte between sampled blocks
+    data[SAMPLE_SIZE + 10] ^= 0xFF
+    b = write(tmp_path / "b.mkv", bytes(data))
+
+    index = FingerprintIndex(str(tmp_path / "fingerprints.json"))
+    assert index.add(a) is None
+    assert index.add(b) is None
+    assert index.files[a.path]["sample"] == index.files[b.path]["sample"]
+
+
+def test_outputs_of_earlier_run(tmp_path):
+    data = os.urandom(1000)
+    params = {"cq": 28}
+    a = write(tmp_path / "a.mkv", data)
+    out = write(tmp_path / "out" / "a.mkv", b"encoded")
+
+    index = FingerprintIndex(str(tmp_path / "fingerprints.json"))
+    index.add(a)
+    index.record(a.path, params, [out.path])
+    index.save()
+
+    b = write(tmp_path / "b.mkv", data)
+    index = FingerprintIndex(str(tmp_path / "fingerprints.json"))
+    assert index.add(b) is None
+    assert index.outputs_of(b.path, params) == [out.path]
+    assert index.outputs_of(b.path, {"cq": 30}) is None
+
+    # Changed outputs are not used
+    write(tmp_path / "out" / "a.mkv", b"changed output")
+    assert index.outputs_of(b.path, params) is None
+
+
+def test_outputs_of_deleted_source(tmp_path):
+    data = os.urandom(1000)
+    params = {"cq": 28}
+    a = write(tmp_path / "a.mkv", data)
+    out = write(tmp_path / "out" / "a.mkv", b"encoded")
+
+    index = FingerprintIndex(str(tmp_path / "fingerprints.json"))
+    index.add(a)
+    # Original is deleted after conversion
+    index.hash_source(a.path)
+    os.remove(a.path)
+    index.record(a.path, params, [out.path])
+    index.save()
+    # Files that are gone are not kept
+    assert a.path not in index.files
+
+    b = write(tmp_path / "b.mkv", data)
+    index = FingerprintIndex(str(tmp_path / "fingerprints.json"))
+    assert index.add(b) is None
+    assert index.outputs_of(b.path, params) == [out.path]
+
+    os.remove(out.path)
+    index.save()
+    assert index.outputs == {}
+
+
+def test_link_or_copy(tmp_path):
+    source = write(tmp_path / "out" / "a.mkv", b"encoded")
+    target = str(tmp_path / "out" / "sub" / "b.mkv")
+    write(target, b"old")
+    link_or_copy(source.path, target)
+    assert open(target, "rb").read() == b"encoded"
+    assert os.path.samefile(source.path, target)
+    assert os.listdir(tmp_path / "out" / "sub") == ["b.mkv"]
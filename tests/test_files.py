@@ -0,0 +1,48 @@
+import os
+from utils.files import FileIndex, scan_video_files, get_all_video_files
+
+
+def touch(path, size=0):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+
+
+def test_scan_video_files(tmp_path):
+    """Test that scan filters files and keeps their sizes """
+    touch(tmp_path / "a.mp4", 10)
+    touch(tmp_path / "b.txt", 10)
+    touch(tmp_path / "sub" / "c.MKV", 20)
+    touch(tmp_path / "sub" / "d_converted.mp4", 30)
+    touch(tmp_path / "converted" / "e.mp4", 40)
+
+    files = list(scan_video_files(
+        str(tmp_path),
+        ignore_suffix="_converted",
+        exclude=[str(tmp_path / "converted")]))
+    names = [os.path.basename(f.path) for f in files]
+    assert names == ["a.mp4", "c.MKV"]
+    assert [f.size for f in files] == [10, 20]
+
+    assert len(get_all_video_files(str(tmp_path))) == 4
+
+
+def test_file_index(tmp_path):
+    """Test that index serves sizes of files scanned so far """
+    touch(tmp_path / "a.mp4", 10)
+    touch(tmp_path / "b.mp4", 5)
+
+    index = FileIndex(scan_video_files(str(tmp_path)))
+    paths = [f.path for f in index]
+    assert index.size(paths[0]) == 10
+    assert index.total_size() == 15
+
+
+def test_hidden_folders(tmp_path):
+    """Test that only folders of this tool are skipped, other hidden folders are scanned """
+    touch(tmp_path / ".photos" / "a.mp4", 10)
+    touch(tmp_path / ".convert-videos" / "b.mp4", 10)
+    touch(tmp_path / ".chunks-video" / "c.mp4", 10)
+
+    names = [os.path.basename(f.path) for f in scan_video_files(str(tmp_path))]
+    assert names == ["a.mp4"]
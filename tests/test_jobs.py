@@ -0,0 +1,40 @@
+import time
+import pytest
+from utils.jobs import resolve_jobs, run_jobs
+from utils.ffmpeg.core import max_parallel_jobs
+
+
+def test_resolve_jobs_is_capped_by_encoder():
+    """Test that jobs never go over the encoder limit """
+    assert resolve_jobs("auto", "nvenc") == max_parallel_jobs("nvenc")
+    assert resolve_jobs(100, "nvenc") == max_parallel_jobs("nvenc")
+    assert resolve_jobs("1", None) == 1
+    with pytest.raises(ValueError):
+        resolve_jobs(0, None)
+
+
+def test_run_jobs_collects_results_and_errors():
+    """Test that results and errors are collected per item """
+    def work(n):
+        if n == 3:
+            raise RuntimeError("failed")
+        return n * 2
+
+    results = {item: (result, error) for item, result, error in run_jobs(work, range(5), 3)}
+    assert results[2] == (4, None)
+    assert isinstance(results[3][1], RuntimeError)
+    assert len(results) == 5
+
+
+def test_closed_run_doesnt_start_queued_jobs():
+    """Test that stopping the run cancels jobs that didn't start yet """
+    started = []
+    def work(n):
+        started.append(n)
+        time.sleep(0.2)
+        return n
+
+    results = run_jobs(work, range(10), 1)
+    assert next(results)[0] == 0
+    results.close()
+    assert len(started) <= 3
@@ -0,0 +1,95 @@
+import os
+import sys
+import subprocess
+from utils.journal import Journal, file_state
+
+PARAMS = {"cq": 28, "encoder": "libx265", "resolution": "1280x720",
+          "ten_bit": True, "audio_bitrate": "96k"}
+
+
+def write(path, data):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_journal_skips_finished_files(tmp_path):
+    """Test that finished files are skipped until input or params change """
+    src, out = str(tmp_path / "in.mp4"), str(tmp_path / "out.mp4")
+    journal_path = str(tmp_path / "journal.jsonl")
+    write(src, b"source" * 100)
+    write(out, b"output")
+
+    journal = Journal(journal_path)
+    state = file_state(src)
+    journal.start(src, out, PARAMS)
+    journal.finish(src, out, PARAMS, state)
+
+    journal = Journal(journal_path)
+    assert journal.is_done(src, PARAMS)
+    assert not journal.is_done(src, {**PARAMS, "cq": 30})
+
+    write(src, b"changed" * 100)
+    assert not journal.is_done(src, PARAMS)
+
+
+def test_journal_checks_every_rendition(tmp_path):
+    """Test that every rendition must still be there for the input to be skipped """
+    src = str(tmp_path / "in.mp4")
+    outputs = [str(tmp_path / "out_720p.mp4"), str(tmp_path / "out_1080p.mp4")]
+    journal_path = str(tmp_path / "journal.jsonl")
+    write(src, b"source" * 100)
+    for output in outputs:
+        write(output, b"output")
+
+    journal = Journal(journal_path)
+    journal.start(src, outputs, PARAMS)
+    journal.finish(src, outputs, PARAMS, file_state(src))
+
+    journal = Journal(journal_path)
+    assert journal.is_done(src, PARAMS)
+    os.remove(outputs[1])
+    assert not journal.is_done(src, PARAMS)
+
+
+def test_pending_check_is_converted_again(tmp_path):
+    """Test that outputs whose quality check didn't finish are kept, but not skipped """
+    src, out = str(tmp_path / "in.mp4"), str(tmp_path / "out.mp4")
+    journal_path = str(tmp_path / "journal.jsonl")
+    write(src, b"source" * 100)
+    write(out, b"output")
+
+    journal = Journal(journal_path)
+    journal.start(src, out, PARAMS)
+    journal.finish(src, out, PARAMS, file_state(src), pending=True)
+
+    journal = Journal(journal_path)
+    journal.recover()
+    assert os.path.exists(out)
+    assert not journal.is_done(src, PARAMS)
+
+
+def test_journal_discards_partial_outputs(tmp_path, monkeypatch):
+    """Test that outputs of interrupted encodes are removed, but not of running ones """
+    src, out = str(tmp_path / "in.mp4"), str(tmp_path / "out.mp4")
+    journal_path = str(tmp_path / "journal.jsonl")
+    write(src, b"source")
+    write(out, b"partial")
+
+    # Opening the journal doesn't touch outputs, this process is still converting
+    Journal(journal_path).start(src, out, PARAMS)
+    journal = Journal(journal_path)
+    journal.recover()
+    assert os.path.exists(out)
+
+    # Process that wrote the entry is gone
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                          capture_output=True, text=True)
+    monkeypatch.setattr(os, "getpid", lambda: int(dead.stdout))
+    Journal(journal_path).start(src, out, PARAMS)
+    monkeypatch.undo()
+
+    journal = Journal(journal_path)
+    assert os.path.exists(out)
+    journal.recover()
+    assert not os.path.exists(out)
+    assert not journal.is_done(src, PARAMS)
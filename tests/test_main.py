@@ -0,0 +1,132 @@
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="uses shell scripts as ffmpeg")
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+PROBE = {
+    "format": {"duration": "3.0", "bit_rate": "8000000"},
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264", "width": 1280, "height": 720},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "bit_rate": "96000"},
+    ],
+}
+
+# Logs every command, quality checks print FAKE_SSIM or a good score
+# and every other command writes every video file that is not an input
+FFMPEG = """#!/bin/sh
+echo "$*" >> "$FAKE_LOG"
+case "$*" in
+    *ssim*)
+        echo "SSIM Y:0.99 All:${FAKE_SSIM:-0.990000} (20.0)" >&2
+        echo "PSNR y:40.0 average:40.000000 min:40.0 max:40.0" >&2
+        exit 0;;
+esac
+prev=
+for arg; do
+    if [ "$prev" != "-i" ]; then
+        case "$arg" in *.mp4|*.mkv) echo encoded > "$arg";; esac
+    fi
+    prev=$arg
+done
+echo out_time_us=3000000
+echo progress=end
+"""
+
+FFPROBE = f"""#!/bin/sh
+case "$*" in
+    *-count_packets*) echo 90;;
+    *) echo '{json.dumps(PROBE)}';;
+esac
+"""
+
+
+@pytest.fixture
+def run_main(tmp_path):
+    """Run main.py with scripts that act like ffmpeg and ffprobe first in PATH """
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for name, script in (("ffmpeg", FFMPEG), ("ffprobe", FFPROBE)):
+        (bin_dir / name).write_text(script)
+        (bin_dir / name).chmod(0o755)
+    env = {
+        **os.environ,
+        "PATH": f"{bin_dir}{os.pathsep}{os.environ['PATH']}",
+        "FAKE_LOG": str(tmp_path / "commands.log"),
+        # Capabilities, fingerprints and costs of earlier tests are not used
+        "XDG_CACHE_HOME": str(tmp_path / "cache"),
+    }
+
+    def run(*args, seconds=None, **extra_env):
+        proc = subprocess.Popen(
+            [sys.executable, MAIN, *map(str, args)], env={**env, **extra_env},
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+        try:
+            output, _ = proc.communicate(timeout=seconds or 60)
+        except subprocess.TimeoutExpired:
+            # Watch mode runs until it's stopped
+            proc.terminate()
+            output, _ = proc.communicate()
+        return output
+    return run
+
+
+def test_watch_ignores_renditions_in_same_dir(run_main, tmp_path):
+    """Test that watching the output folder doesn't convert renditions again """
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    (videos / "v.mp4").write_text("source")
+
+    run_main(videos, "--same-dir", "--watch", "--quiet-period", 0.1, "--poll-interval", 0.1,
+             "--renditions", "1280x720:28:_720p,640x360:30:_360p", seconds=3)
+    assert sorted(os.listdir(videos)) == [
+        ".convert-videos-journal.jsonl", "v.mp4", "v_converted_360p.mp4", "v_converted_720p.mp4"]
+
+
+def read_report(path):
+    """Return jobs of a report by input name """
+    with open(path) as f:
+        return {os.path.basename(job["input"]): job for job in json.load(f)["jobs"]}
+
+
+def test_verify_dedup_and_held_jobs(run_main, tmp_path):
+    """Test that originals are deleted after their check and copies get linked outputs """
+    videos, out = tmp_path / "videos", tmp_path / "out"
+    videos.mkdir()
+    (videos / "a.mp4").write_text("same")
+    (videos / "b.mp4").write_text("same")
+    (videos / "c.mp4").write_text("other")
+
+    # No job fits in the free space, they run one at a time anyway
+    output = run_main(videos, "-o", out, "--verify-windows", 2, "--dedup", "--delete-original",
+                      "--min-free", 1_000_000, "--report", tmp_path / "report.json")
+    assert "converting anyway" in output
+    assert os.listdir(videos) == []
+    assert (out / "a.mp4").read_text() == "encoded\n"
+    assert os.stat(out / "b.mp4").st_ino == os.stat(out / "a.mp4").st_ino
+
+    # Copy is linked, not encoded or checked
+    with open(tmp_path / "commands.log") as f:
+        commands = f.read().splitlines()
+    assert sum(1 for c in commands if "ssim" not in c and "-encoders" not in c) == 2
+    assert sum(1 for c in commands if "ssim" in c) == 2
+    jobs = read_report(tmp_path / "report.json")
+    assert jobs["a.mp4"]["ssim"] == 0.99 and jobs["c.mp4"]["ssim"] == 0.99
+    assert jobs["b.mp4"]["action"] == "duplicate" and jobs["b.mp4"]["status"] == "converted"
+
+
+def test_failed_check_keeps_original(run_main, tmp_path):
+    """Test that originals of outputs with low quality are kept """
+    videos = tmp_path / "videos"
+    videos.mkdir()
+    (videos / "a.mp4").write_text("source")
+
+    run_main(videos, "-o", tmp_path / "out", "--verify-windows", 2, "--delete-original",
+             "--report", tmp_path / "report.json", FAKE_SSIM="0.500000")
+    assert (videos / "a.mp4").read_text() == "source"
+    assert read_report(tmp_path / "report.json")["a.mp4"]["error"] == "SSIM 0.5000 below 0.9"
@@ -0,0 +1,35 @@
+import csv
+import json
+from utils.metrics import MetricsReport, percentile
+
+
+def test_percentile():
+    """Test percentiles with interpolation between values """
+    assert percentile([], 50) == 0
+    assert percentile([1, 2, 3, 4], 50) == 2.5
+    assert percentile([5, 1, 3], 100) == 5
+
+
+def test_metrics_report(tmp_path):
+    """Test totals and JSON/CSV output of the report """
+    report = MetricsReport()
+    report.add(input="a.mp4", status="converted", input_bytes=1000, output_bytes=250,
+               duration=10.0, wall_time=5.0, fps=60.0)
+    report.add(input="b.mp4", status="converted", input_bytes=1000, output_bytes=750,
+               duration=10.0, wall_time=20.0, fps=15.0)
+    report.add(input="c.mp4", status="failed", error="ffmpeg failed")
+
+    totals = report.totals()
+    assert totals["converted"] == 2 and totals["failed"] == 1
+    assert totals["reduction"] == 50.0
+    assert totals["speed_p50"] == 1.25
+    assert report.jobs[0]["compression_ratio"] == 0.25
+
+    report.write(str(tmp_path / "report.json"))
+    with open(tmp_path / "report.json") as f:
+        assert len(json.load(f)["jobs"]) == 3
+
+    report.write(str(tmp_path / "report.csv"))
+    with open(tmp_path / "report.csv") as f:
+        assert len(list(csv.DictReader(f))) == 3
+    assert (tmp_path / "report.totals.json").exists()
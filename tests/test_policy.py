@@ -0,0 +1,20 @@
+from utils.ffmpeg.policy import decide, SKIP, REMUX, ENCODE
+
+
+def make_info(codec="h264", size="1280x720", bitrate=5_000_000):
+    width, height = size.split("x")
+    return {
+        "format": {"bit_rate": str(bitrate), "duration": "10.0"},
+        "streams": [{"codec_type": "video", "codec_name": codec,
+                     "width": int(width), "height": int(height)}],
+    }
+
+
+def test_decide():
+    """Test skip, remux and encode decisions """
+    assert decide(make_info())[0] == ENCODE
+    assert decide(make_info("hevc", bitrate=1_000_000))[0] == REMUX
+    assert decide(make_info("hevc", "1920x1080", 1_000_000))[0] == ENCODE
+    assert decide(make_info("hevc", bitrate=1_000_000), policy={"efficient_action": SKIP})[0] == SKIP
+    assert decide(make_info(bitrate=400_000), policy={"min_bitrate": 500_000})[0] == REMUX
+    assert decide({"format": {}, "streams": []})[0] == SKIP
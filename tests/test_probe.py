@@ -0,0 +1,32 @@
+import json
+from types import SimpleNamespace
+from collections import OrderedDict
+from utils.ffmpeg import probe as probe_module
+from utils.ffmpeg.probe import probe
+
+
+def test_probe_cache_drops_least_recently_used(tmp_path, monkeypatch):
+    """Test that probe results are cached and the cache stays bounded """
+    calls = []
+    def run(args, **kwargs):
+        calls.append(args[-1])
+        return SimpleNamespace(returncode=0, stdout=json.dumps({"format": {}}), stderr="")
+
+    monkeypatch.setattr(probe_module, "_probe_cache", OrderedDict())
+    monkeypatch.setattr(probe_module, "PROBE_CACHE_SIZE", 2)
+    monkeypatch.setattr(probe_module.shutil, "which", lambda name: name)
+    monkeypatch.setattr(probe_module.subprocess, "run", run)
+    a, b, c = (str(tmp_path / name) for name in ("a.mp4", "b.mp4", "c.mp4"))
+    for path in (a, b, c):
+        open(path, "wb").close()
+
+    probe(a)
+    probe(b)
+    probe(a)
+    assert calls == [a, b]
+    # b was used least recently, so it's dropped for c
+    probe(c)
+    probe(a)
+    probe(b)
+    assert calls == [a, b, c, b]
+    assert len(probe_module._probe_cache) == 2
@@ -0,0 +1,42 @@
+from utils.ffmpeg.progress import ProgressParser, eta
+
+BLOCK = """frame=120
+fps=59.94
+stream_0_0_q=28.0
+bitrate=1234.5kbits/s
+total_size=1048576
+out_time_us=4000000
+out_time_ms=4000000
+out_time=00:00:04.000000
+dup_frames=0
+drop_frames=0
+speed=1.5x
+progress=continue
+"""
+
+
+def test_progress_parser():
+    """Test that ffmpeg -progress blocks are parsed into events """
+    parser = ProgressParser()
+    events = [parser.feed(line) for line in BLOCK.splitlines()]
+    assert events[:-1] == [None] * (len(events) - 1)
+
+    p = events[-1]
+    assert p.frame == 120
+    assert p.fps == 59.94
+    assert p.bitrate == 1234.5
+    assert p.out_time == 4.0
+    assert p.speed == 1.5
+    assert not p.done
+
+    # Values before the first frame are N/A
+    for line in ["frame=0", "speed=N/A", "out_time_us=N/A"]:
+        parser.feed(line)
+    p = parser.feed("progress=end")
+    assert p.speed == 0 and p.out_time == 0 and p.done
+
+
+def test_eta():
+    """Test that remaining time is formatted, unknown speed gives "?" """
+    assert eta(3661, 1.0) == "1:01:01"
+    assert eta(100, 0) == "?"
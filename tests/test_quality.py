@@ -0,0 +1,20 @@
+from utils.ffmpeg.quality import parse_scores
+from utils.metrics import MetricsReport
+
+
+def test_parse_scores():
+    log = (
+        "[Parsed_ssim_8 @ 0x1] SSIM Y:0.981 (17.2) U:0.990 (20.1) V:0.991 (20.4) All:0.984502 (18.1)\n"
+        "[Parsed_psnr_9 @ 0x2] PSNR y:40.12 u:45.01 v:45.30 average:41.53 min:38.90 max:44.10\n"
+    )
+    assert parse_scores(log) == (0.984502, 41.53)
+    assert parse_scores("PSNR y:inf u:inf v:inf average:inf min:inf max:inf") == (None, float("inf"))
+    assert parse_scores("") == (None, None)
+
+
+def test_scores_in_report():
+    report = MetricsReport()
+    record = report.add(input="a.mp4", status="converted")
+    report.update(record, ssim=0.97, psnr=40.5, unknown=1)
+    assert report.jobs[0]["ssim"] == 0.97 and report.jobs[0]["psnr"] == 40.5
+    assert "unknown" not in report.jobs[0]
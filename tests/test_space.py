@@ -0,0 +1,39 @@
+import shutil
+from types import SimpleNamespace
+from utils.space import SpaceReserver, Need
+
+
+def reserver(monkeypatch, room):
+    """Reserver on a disk with room bytes free """
+    disk = SimpleNamespace(free=room)
+    monkeypatch.setattr(shutil, "disk_usage", lambda path: disk)
+    return SpaceReserver(min_free=0), disk
+
+
+def test_reserve_and_release(tmp_path, monkeypatch):
+    space, _ = reserver(monkeypatch, 1_000_000)
+    assert space.reserve("a", [Need(str(tmp_path), 600_000)])
+    assert not space.reserve("b", [Need(str(tmp_path), 600_000)])
+    assert space.reserve("c", [Need(str(tmp_path / "missing" / "folder"), 100_000)])
+    space.release("a")
+    assert space.reserve("b", [Need(str(tmp_path), 600_000)])
+    space.release("b")
+    space.release("c")
+    assert space.idle()
+
+
+def test_needs_on_one_disk_add_up(tmp_path, monkeypatch):
+    space, _ = reserver(monkeypatch, 1_000_000)
+    assert not space.reserve("a", [Need(str(tmp_path), 600_000), Need(str(tmp_path), 600_000)])
+    assert space.idle()
+
+
+def test_written_output_is_not_counted_twice(tmp_path, monkeypatch):
+    space, disk = reserver(monkeypatch, 1_000_000)
+    output = tmp_path / "out.mkv"
+    assert space.reserve("a", [Need(str(tmp_path), 600_000, str(output))])
+    assert space.available(str(tmp_path)) == 400_000
+    output.write_bytes(b"x" * 200_000)
+    disk.free -= 200_000
+    # Free space went down, but so did what is still pending for the job
+    assert space.available(str(tmp_path)) == 400_000
@@ -0,0 +1,103 @@
+import os
+import sys
+import json
+import shutil
+import socket
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from utils.staging import Scratch, OWNER_NAME, recover_scratch
+
+
+def write(path, size):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+    return str(path)
+
+
+def test_prefetch_and_publish(tmp_path):
+    a = write(tmp_path / "nas" / "a.mkv", 1000)
+    b = write(tmp_path / "nas" / "b.mkv", 1000)
+    scratch = Scratch(str(tmp_path / "scratch"), budget=10_000)
+    try:
+        scratch.expect(a)
+        scratch.expect(b)
+        local = scratch.input(a)
+        assert local != a
+        assert open(local, "rb").read() == open(a, "rb").read()
+
+        out = scratch.output(a, str(tmp_path / "nas" / "out" / "a.mkv"))
+        assert out.startswith(str(tmp_path / "scratch"))
+        with open(out, "wb") as f:
+            f.write(b"encoded")
+        final = str(tmp_path / "nas" / "a.hevc.mkv")
+        scratch.publish(out, final)
+        assert open(final, "rb").read() == b"encoded"
+        assert not os.path.exists(out)
+        assert [n for n in os.listdir(tmp_path / "nas") if n.endswith(".tmp")] == []
+
+        scratch.release(a)
+        assert scratch.input(b) != b
+        scratch.release(b)
+        assert scratch.used == 0
+    finally:
+        scratch.close()
+    assert not os.path.exists(tmp_path / "scratch")
+
+
+def test_too_big_files_are_not_staged(tmp_path):
+    big = write(tmp_path / "nas" / "big.mkv", 1000)
+    scratch = Scratch(str(tmp_path / "scratch"), budget=1500)
+    try:
+        assert scratch.input(big) == big
+        output = str(tmp_path / "nas" / "big.hevc.mkv")
+        assert scratch.output(big, output) == output
+        scratch.release(big)
+    finally:
+        scratch.close()
+
+
+def test_prefetched_inputs_do_not_block(tmp_path, monkeypatch):
+    a = write(tmp_path / "nas" / "a.mkv", 1000)
+    b = write(tmp_path / "nas" / "b.mkv", 1000)
+    copying, copied = threading.Event(), threading.Event()
+    copyfile = shutil.copyfile
+
+    def slow_copy(src, dst):
+        copying.set()
+        copied.wait(10)
+        return copyfile(src, dst)
+
+    monkeypatch.setattr(shutil, "copyfile", slow_copy)
+    scratch = Scratch(str(tmp_path / "scratch"), budget=2500)
+    try:
+        # b is being prefetched and holds the budget, a must not wait for it
+        scratch.expect(b)
+        assert copying.wait(10)
+        with ThreadPoolExecutor(1) as pool:
+            assert pool.submit(scratch.input, a).result(timeout=5) == a
+        copied.set()
+        assert scratch.input(b) != b
+    finally:
+        copied.set()
+        scratch.close()
+
+
+def test_recover_scratch_of_stopped_runs(tmp_path):
+    """Test that staged files of runs that stopped are removed, not of running ones """
+    running = Scratch(str(tmp_path / "convert-videos-running"), budget=10_000)
+    dead = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"],
+                          capture_output=True, text=True)
+    stopped = tmp_path / "convert-videos-stopped"
+    write(stopped / "0" / "a.mkv", 1000)
+    (stopped / OWNER_NAME).write_text(
+        json.dumps({"host": socket.gethostname(), "pid": int(dead.stdout)}))
+    other = write(tmp_path / "other" / "b.mkv", 1000)
+    try:
+        recover_scratch(str(tmp_path))
+        assert not stopped.exists()
+        assert os.path.exists(running.folder) and os.path.exists(other)
+    finally:
+        running.close()
+    assert not os.path.exists(running.folder)
@@ -0,0 +1,58 @@
+from utils.ffmpeg.streams import audio_action, stream_args, stream_bitrate
+
+INFO = {
+    "streams": [
+        {"index": 0, "codec_type": "video", "codec_name": "h264"},
+        {"index": 1, "codec_type": "audio", "codec_name": "aac", "bit_rate": "96000"},
+        {"index": 2, "codec_type": "audio", "codec_name": "ac3", "bit_rate": "448000"},
+        {"index": 3, "codec_type": "subtitle", "codec_name": "subrip"},
+        {"index": 4, "codec_type": "subtitle", "codec_name": "hdmv_pgs_subtitle"},
+        {"index": 5, "codec_type": "attachment", "codec_name": "ttf"},
+    ]
+}
+
+
+def test_audio_action():
+    """Test that only audio in the output codec at or below the bitrate is copied """
+    assert audio_action({"codec_name": "aac", "bit_rate": "96000"}) == "copy"
+    assert audio_action({"codec_name": "aac", "bit_rate": "256000"}) == "encode"
+    assert audio_action({"codec_name": "ac3", "bit_rate": "96000"}) == "encode"
+    # Unknown bitrate is encoded, it may be anything
+    assert audio_action({"codec_name": "opus"}) == "encode"
+    assert audio_action({"codec_name": "aac", "bit_rate": "96000"}, "opus") == "encode"
+
+
+def test_audio_action_container():
+    """Test that audio is only copied into containers that can store its codec """
+    opus = {"codec_name": "opus", "bit_rate": "64000"}
+    assert audio_action(opus, "aac", "96k", ".mkv") == "copy"
+    assert audio_action(opus, "aac", "96k", ".avi") == "encode"
+    assert audio_action({"codec_name": "aac", "bit_rate": "96000"}, "aac", "96k", ".wmv") == "copy"
+    # Unknown containers always get re-encoded audio
+    assert audio_action({"codec_name": "aac", "bit_rate": "96000"}, "aac", "96k", ".ts") == "encode"
+
+
+def test_stream_bitrate_from_mkv_tags():
+    """Test that bitrate is read from MKV tags if the stream has none """
+    assert stream_bitrate({"tags": {"BPS": "128000"}}) == 128000
+    assert stream_bitrate({}) == 0
+
+
+def test_stream_args_mp4():
+    """Test that MP4 gets every audio stream and text subtitles as mov_text """
+    args = stream_args(INFO, "out.mp4")
+    assert args == [
+        "-map", "0:0",
+        "-map", "0:1", "-c:a:0", "copy",
+        "-map", "0:2", "-c:a:1", "aac", "-b:a:1", "96k",
+        "-map", "0:3", "-c:s:0", "mov_text",
+    ]
+
+
+def test_stream_args_mkv():
+    """Test that MKV keeps every stream and attachment of the second input """
+    args = stream_args(INFO, "out.mkv", "opus", input_index=1, map_video=False)
+    assert "1:0" not in args
+    assert args[args.index("1:1") + 1:][:2] == ["-c:a:0", "libopus"]
+    assert ["-map", "1:4", "-c:s:1", "copy"] == args[args.index("1:4") - 1:args.index("1:4") + 3]
+    assert "1:5" in args and args[-2:] == ["-c:t", "copy"]
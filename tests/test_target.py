@@ -0,0 +1,60 @@
+import math
+from utils.ffmpeg import target
+from utils.ffmpeg.target import CQ_RANGE, fit_cq, parse_bitrate, sample_windows, target_video_bitrate
+
+
+def test_target_video_bitrate():
+    """Test that audio is taken from the target bitrate """
+    assert parse_bitrate("96k") == 96_000
+    assert parse_bitrate("3M") == 3_000_000
+    # 100 MB in 800 seconds is 1 Mb/s
+    assert target_video_bitrate(800, target_size=100_000_000, audio_bitrate="96k") == 904_000
+    assert target_video_bitrate(10, target_bitrate=500_000, audio_bitrate="100k") == 400_000
+
+
+def test_sample_windows():
+    """Test that samples are spread across the video """
+    windows = sample_windows(90, 3, 4)
+    assert windows == [(13.0, 4), (43.0, 4), (73.0, 4)]
+    assert sample_windows(5, 3, 4) == [(0.0, 5)]
+    assert [start for start, _ in sample_windows(100.0, 5, 2.0)] == [9.0, 29.0, 49.0, 69.0, 89.0]
+
+
+def model_bitrate(cq):
+    """Bitrate of the fake sample encodes, exponential in CQ like real encoders """
+    return 4_000_000 * math.exp(-0.1 * (cq - 20))
+
+
+def fake_samples(monkeypatch, duration=100.0):
+    """Make sample encodes write files of the model bitrate and log their CQ """
+    tried = []
+    def run_ffmpeg(args, cpus=None):
+        path, cq, length = args
+        tried.append(cq)
+        with open(path, "wb") as f:
+            f.write(b"\0" * int(model_bitrate(cq) * length / 8))
+
+    monkeypatch.setattr(target, "probe", lambda path: {"format": {"duration": str(duration)}})
+    monkeypatch.setattr(target, "build_command",
+                        lambda input_path, path, hw, cq, length, **kwargs: (path, cq, length))
+    monkeypatch.setattr(target, "run_ffmpeg", run_ffmpeg)
+    return tried
+
+
+def test_fit_cq(monkeypatch):
+    """Test that fitted CQ converges to the target and stays in CQ_RANGE """
+    tried = fake_samples(monkeypatch)
+    audio = parse_bitrate("96k")
+    assert fit_cq("in.mkv", None, target_bitrate=int(model_bitrate(30)) + audio + 1000) == 30
+    # Three windows per CQ, at most four CQs are tried
+    assert len(tried) == 3 * len(set(tried)) <= 12
+
+    assert fit_cq("in.mkv", None, target_bitrate=audio + 1000) == CQ_RANGE[1]
+    assert fit_cq("in.mkv", None, target_bitrate=100_000_000) == CQ_RANGE[0]
+
+
+def test_fit_cq_without_duration(monkeypatch):
+    """Test that unknown duration falls back to the start CQ without sample encodes """
+    tried = fake_samples(monkeypatch, duration=0)
+    assert fit_cq("in.mkv", None, target_size=10_000_000, start_cq=26) == 26
+    assert tried == []
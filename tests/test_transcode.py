@@ -2,7 +2,7 @@ import os
 import subprocess
 import tempfile
 import pytest
-from utils.ffmpeg.transcoder import transcode
+from utils.ffmpeg.transcoder import transcode, build_rendition_command, Rendition
 
 
 def generate_test_video(
@@ -82,3 +82,17 @@ def test_video_encoding(encoder_config, resolution, bitrate):
         # Delete the test video at the end
         if os.path.exists(test_input):
             os.remove(test_input)
+
+
+def test_rendition_command():
+    """Test that renditions are split from one decode """
+    renditions = [Rendition("1280x720", 28, "_720p"), Rendition("1920x1080", 26, "_1080p")]
+    args = build_rendition_command("input.mp4", "out/video.mp4", None, renditions)
+
+    assert args.count("-i") == 1
+    graph = args[args.index("-filter_complex") + 1]
+    assert graph.startswith("[0:v]split=2[s0][s1]")
+    assert "scale=1920x1080" in graph
+    assert args[-1] == "out/video_1080p.mp4"
+    assert "out/video_720p.mp4" in args
+    assert args[args.index("-crf") + 1] == "28"
@@ -0,0 +1,32 @@
+import os
+import time
+from utils.watch import FolderWatcher
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def test_watcher_waits_for_quiet_period(tmp_path):
+    """Test that files are queued once, after they stop changing """
+    watcher = FolderWatcher(str(tmp_path), quiet_period=0.2, interval=0)
+    write(str(tmp_path / "a.mp4"), b"a")
+    assert watcher.poll() == []
+
+    # File is still being written
+    time.sleep(0.1)
+    write(str(tmp_path / "a.mp4"), b"aa")
+    assert watcher.poll() == []
+
+    time.sleep(0.3)
+    ready = watcher.poll()
+    assert [os.path.basename(f.path) for f in ready] == ["a.mp4"]
+    assert watcher.poll() == []
+
+    # New files in new folders are found too
+    write(str(tmp_path / "sub" / "b.mkv"), b"b")
+    watcher.poll()
+    time.sleep(0.3)
+    assert [os.path.basename(f.path) for f in watcher.poll()] == ["b.mkv"]
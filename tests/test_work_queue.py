@@ -0,0 +1,131 @@
+import os
+import time
+import multiprocessing
+from utils.work_queue import WorkQueue, FREE, LEASED, DONE, CLAIMED
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def drain(root, queue_folder, log_path, files):
+    """Worker process that converts every file it can claim """
+    queue = WorkQueue(queue_folder, root, lease_time=1.0)
+    with queue:
+        pending = list(files)
+        while pending:
+            for path in list(pending):
+                state = queue.state(path)
+                if state == DONE:
+                    pending.remove(path)
+                elif state == FREE and queue.claim(path):
+                    time.sleep(0.05)
+                    with open(log_path, "a") as f:
+                        f.write(f"{os.path.basename(path)}\n")
+                    queue.complete(path)
+                    pending.remove(path)
+            time.sleep(0.05)
+
+
+def crash(root, queue_folder, files):
+    """Worker process that claims files and dies without finishing them """
+    queue = WorkQueue(queue_folder, root, lease_time=1.0)
+    for path in files:
+        queue.claim(path)
+    os._exit(1)
+
+
+def test_claim_is_exclusive(tmp_path):
+    """Test that a file can only be claimed by one worker until released """
+    src = str(tmp_path / "in" / "a.mp4")
+    write(src, b"a")
+    first = WorkQueue(str(tmp_path / "queue"), str(tmp_path / "in"))
+    second = WorkQueue(str(tmp_path / "queue"), str(tmp_path / "in"))
+
+    assert first.claim(src)
+    assert not second.claim(src)
+    assert second.state(src) == LEASED
+
+    first.release(src)
+    assert second.claim(src)
+    second.complete(src, {"cq": 28})
+    assert first.state(src, {"cq": 28}) == DONE
+    assert first.state(src, {"cq": 30}) == FREE
+
+
+def test_expired_lease_is_taken_over(tmp_path):
+    """Test that leases that are not renewed expire and renewed ones don't """
+    src = str(tmp_path / "in" / "a.mp4")
+    write(src, b"a")
+    first = WorkQueue(str(tmp_path / "queue"), str(tmp_path / "in"), lease_time=0.3)
+    second = WorkQueue(str(tmp_path / "queue"), str(tmp_path / "in"), lease_time=0.3)
+
+    assert first.claim(src)
+    time.sleep(0.2)
+    first.renew()
+    time.sleep(0.2)
+    assert not second.claim(src)
+
+    time.sleep(0.3)
+    assert second.claim(src)
+    # First worker notices it lost the file
+    first.renew()
+    assert not first.held
+
+
+def test_claim_of_finished_file(tmp_path):
+    """Test that a file finished by another worker is reported as done, not as claimed """
+    src = str(tmp_path / "in" / "a.mp4")
+    write(src, b"a")
+    first = WorkQueue(str(tmp_path / "queue"), str(tmp_path / "in"))
+    second = WorkQueue(str(tmp_path / "queue"), str(tmp_path / "in"))
+
+    assert second.state(src, {"cq": 28}) == FREE
+    assert first.try_claim(src, {"cq": 28}) == CLAIMED
+    assert second.try_claim(src, {"cq": 28}) == LEASED
+    first.complete(src, {"cq": 28})
+    assert second.try_claim(src, {"cq": 28}) == DONE
+    assert not second.holds(src)
+
+
+def test_lease_taken_while_written(tmp_path):
+    """Test that renewing drops a lease another worker is still writing """
+    src = str(tmp_path / "in" / "a.mp4")
+    write(src, b"a")
+    queue = WorkQueue(str(tmp_path / "queue"), str(tmp_path / "in"))
+    assert queue.claim(src)
+    assert queue.holds(src)
+
+    # Half written lease of another worker
+    write(str(tmp_path / "queue" / f"{queue.key(src)}.lease"), b'{"input": ')
+    queue.renew()
+    assert not queue.holds(src)
+
+
+def test_workers_drain_queue_once(tmp_path):
+    """Test that several processes convert every file exactly once,
+    including files claimed by a worker that crashed """
+    root, queue_folder = str(tmp_path / "in"), str(tmp_path / "queue")
+    log_path = str(tmp_path / "log.txt")
+    files = [os.path.join(root, f"{i}.mp4") for i in range(20)]
+    for path in files:
+        write(path, b"x")
+
+    ctx = multiprocessing.get_context("spawn")
+    crashed = ctx.Process(target=crash, args=(root, queue_folder, files[:3]))
+    crashed.start()
+    crashed.join()
+
+    workers = [ctx.Process(target=drain, args=(root, queue_folder, log_path, files))
+               for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    with open(log_path) as f:
+        converted = f.read().split()
+    assert sorted(converted) == sorted(os.path.basename(p) for p in files)
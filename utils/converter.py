@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import uuid
+import threading
+
+from concurrent.futures import CancelledError, Future, ThreadPoolExecutor
+from typing import Optional, TextIO
+from utils.cpu import thread_budget
+from utils.jobs import resolve_jobs
+from utils.ffmpeg.core import speed_preset
+from utils.ffmpeg.calibrate import ensure_calibrated
+from utils.ffmpeg.probe import probe, get_duration
+from utils.ffmpeg.progress import Progress
+from utils.ffmpeg.transcoder import (
+    check_ffmpeg, get_encoder, build_command, run_ffmpeg, verify_output, output_state,
+)
+
+# Status of a job
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+class EventStream:
+    """
+    Writes events as JSON lines, one object per line with
+    time, event name and fields of the event.
+    """
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._lock = threading.Lock()
+
+    def emit(self, event: str, **fields):
+        line = json.dumps({"time": round(time.time(), 3), "event": event, **fields})
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+class Job:
+    """Handle of a conversion submitted to a Converter"""
+    def __init__(self, converter: "Converter", input_path: str, output_path: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.input = input_path
+        self.output = output_path
+        self.status = QUEUED
+        self.progress: Optional[Progress] = None
+        # Percent of the duration encoded, None if duration is unknown
+        self.percent: Optional[float] = None
+        self.error: Optional[str] = None
+        self._converter = converter
+        self._future: Optional[Future] = None
+        self._cancel = threading.Event()
+
+    def done(self) -> bool:
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    def result(self, timeout: Optional[float] = None) -> str:
+        """
+        Wait for the job and return path of the output.
+
+        Raises:
+            CancelledError: If the job was cancelled
+            RuntimeError: If the conversion failed
+        """
+        return self._future.result(timeout)
+
+    def cancel(self) -> bool:
+        """Cancel the job, a running ffmpeg is stopped and its output removed"""
+        if self.done():
+            return False
+        if self._future.cancel():
+            self.status = CANCELLED
+            self._converter._emit("cancelled", self)
+            return True
+        self._cancel.set()
+        return True
+
+    def to_dict(self) -> dict:
+        return {
+            "job": self.id,
+            "input": self.input,
+            "output": self.output,
+            "status": self.status,
+            "percent": self.percent,
+            "error": self.error,
+        }
+
+class Converter:
+    """
+    Converts videos for a long-running process, like an ingest service.
+
+    Encoder detection, calibration and encode arguments are resolved
+    once when it's created, every submitted file only has to be probed.
+    Jobs run in a thread pool and report to a JSON-lines event stream
+    instead of the console. Only queued and running jobs are kept in
+    jobs, callers keep the handles of finished ones they need.
+    """
+    def __init__(
+        self,
+        output_dir: Optional[str] = None,
+        suffix: str = "_converted",
+        cq: int = 28,
+        speed: Optional[str] = None,
+        prefer_gpu: bool = True,
+        jobs: str | int = "auto",
+        ten_bit: bool = True,
+        target_resolution: str = "1280x720",
+        audio_bitrate: Optional[str] = "96k",
+        audio_codec: str = "aac",
+        events: Optional[TextIO] = None,
+        progress_interval: float = 1.0,
+        overwrite: bool = False,
+    ):
+        """
+        Args:
+            output_dir (Optional[str]): Folder for outputs, next to the input if None
+            suffix (str): Suffix at the end of output file names
+            cq (int): Constant quality, lower is better quality
+            speed (Optional[str]): "fast", "balanced" or "archive", see SPEEDS,
+                detected encoder at best quality if None
+            prefer_gpu (bool): Should we use the GPU for encoding?
+            jobs (str | int): Number of files to convert at once or "auto"
+            ten_bit (bool): Should we use 10-bit encoding?
+            target_resolution (str): Target resolution for the outputs
+            audio_bitrate (Optional[str]): Bitrate of the audio, None drops audio
+            audio_codec (str): Codec for audio that can't be copied, "aac" or "opus"
+            events (Optional[TextIO]): Stream for JSON-lines events, like a file or sys.stdout
+            progress_interval (float): Min seconds between progress events of a job
+            overwrite (bool): Replace outputs that already exist, submit refuses them if False
+        """
+        check_ffmpeg()
+        if speed:
+            ensure_calibrated()
+        self.encoder = get_encoder(prefer_gpu, speed)
+        self.preset = speed_preset(self.encoder, speed)
+        self.workers = resolve_jobs(jobs, self.encoder)
+        self.threads = thread_budget(self.workers) if self.workers > 1 else None
+
+        self.output_dir = output_dir
+        self.suffix = suffix
+        self.cq = cq
+        self.ten_bit = ten_bit
+        self.target_resolution = target_resolution
+        self.audio_bitrate = audio_bitrate
+        self.audio_codec = audio_codec
+        self.events = EventStream(events) if events else None
+        self.progress_interval = progress_interval
+        self.overwrite = overwrite
+        # Queued and running jobs, finished ones are dropped
+        self.jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers)
+
+    def _emit(self, event: str, job: Job, **fields):
+        if self.events:
+            self.events.emit(event, job=job.id, input=job.input, **fields)
+
+    def output_path(self, input_path: str) -> str:
+        name, ext = os.path.splitext(os.path.basename(input_path))
+        folder = self.output_dir or os.path.dirname(os.path.abspath(input_path))
+        return os.path.join(folder, f"{name}{self.suffix}{ext}")
+
+    def submit(self, input_path: str, output_path: Optional[str] = None) -> Job:
+        """
+        Queue a file for conversion.
+
+        Args:
+            input_path (str): Path to the input video file
+            output_path (Optional[str]): Path to the output, named by output_dir and suffix if None
+
+        Returns:
+            Job: Handle with status, progress, result and cancel
+
+        Raises:
+            ValueError: If the output is the input, is written by another job
+                or already exists and overwrite is off
+        """
+        output_path = output_path or self.output_path(input_path)
+        if os.path.abspath(output_path) == os.path.abspath(input_path):
+            raise ValueError(f"Output would overwrite the input: {input_path}")
+        if not self.overwrite and os.path.exists(output_path):
+            raise ValueError(f"Output already exists: {output_path}")
+        job = Job(self, input_path, output_path)
+        with self._lock:
+            if any(os.path.abspath(other.output) == os.path.abspath(output_path)
+                   for other in self.jobs.values()):
+                raise ValueError(f"Output is written by another job: {output_path}")
+            self._emit("queued", job, output=output_path)
+            # Job is only published once it can be cancelled
+            job._future = self._pool.submit(self._run, job)
+            self.jobs[job.id] = job
+        # Runs right away if the job is already done
+        job._future.add_done_callback(lambda _, job=job: self._forget(job))
+        return job
+
+    def _forget(self, job: Job):
+        with self._lock:
+            self.jobs.pop(job.id, None)
+
+    def _run(self, job: Job) -> str:
+        job.status = RUNNING
+        start = time.time()
+        # Output is only removed on failure if this job wrote to it
+        before = output_state(job.output)
+        self._emit("started", job, encoder=self.encoder or "libx265", preset=self.preset)
+        try:
+            try:
+                info = probe(job.input)
+                duration = get_duration(info)
+            except RuntimeError:
+                info, duration = None, 0.0
+            last_event = [0.0]
+
+            def on_progress(p: Progress):
+                # ffmpeg is stopped by the exception
+                if job._cancel.is_set():
+                    raise CancelledError()
+                job.progress = p
+                if duration > 0:
+                    job.percent = round(min(100.0, p.out_time / duration * 100), 2)
+                now = time.time()
+                if now - last_event[0] >= self.progress_interval:
+                    last_event[0] = now
+                    self._emit("progress", job,
+                        percent=job.percent, frame=p.frame, fps=p.fps, speed=p.speed)
+
+            os.makedirs(os.path.dirname(os.path.abspath(job.output)), exist_ok=True)
+            run_ffmpeg(build_command(
+                job.input, job.output, self.encoder,
+                ten_bit=self.ten_bit,
+                audio_bitrate=self.audio_bitrate,
+                overwrite=self.overwrite,
+                cq=self.cq,
+                target_resolution=self.target_resolution,
+                preset=self.preset,
+                streams=info,
+                audio_codec=self.audio_codec,
+                threads=self.threads,
+            ), on_progress)
+            if job._cancel.is_set():
+                raise CancelledError()
+            verify_output(job.input, job.output, check_duration=duration > 0)
+        except BaseException as e:
+            if output_state(job.output) not in (None, before):
+                os.remove(job.output)
+            if isinstance(e, CancelledError):
+                job.status = CANCELLED
+                self._emit("cancelled", job)
+            else:
+                job.status, job.error = FAILED, str(e)
+                self._emit("failed", job, error=job.error)
+            raise
+
+        job.status, job.percent = DONE, 100.0
+        self._emit("finished", job,
+            output=job.output,
+            input_bytes=os.path.getsize(job.input),
+            output_bytes=os.path.getsize(job.output),
+            wall_time=round(time.time() - start, 3))
+        return job.output
+
+    def close(self, wait: bool = True):
+        """Stop taking jobs, queued jobs are cancelled if not waiting for them"""
+        if not wait:
+            with self._lock:
+                jobs = list(self.jobs.values())
+            for job in jobs:
+                job.cancel()
+        self._pool.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close(wait=exc[0] is None)
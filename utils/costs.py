@@ -0,0 +1,131 @@
+import os
+import json
+import heapq
+import threading
+
+from typing import Iterable, Optional
+from utils.ffmpeg.core import CAPABILITIES_CACHE
+from utils.logger import prdebug
+
+# Throughput and compression of previous runs are kept next to the capabilities
+COSTS_CACHE = os.path.join(os.path.dirname(CAPABILITIES_CACHE), "costs.json")
+
+# Seconds of video kept in the history of every encoder, older runs
+# are scaled down so the model follows ffmpeg and hardware changes
+HISTORY_DURATION = 100 * 3600
+
+# Used until an encoder has history, speed is seconds of video encoded
+# per second, output is bytes per second of video at default settings
+DEFAULT_SPEED = {"libx265": 0.5, "nvenc": 8.0, "qsv": 4.0, "amf": 4.0, "vaapi": 4.0}
+DEFAULT_REMUX_SPEED = 50.0
+DEFAULT_OUTPUT_RATE = 125_000  # about 1 Mb/s, HEVC 720p at CQ 28
+
+class CostModel:
+    """
+    Estimates encode time and output size of files from previous runs.
+
+    Totals of finished jobs are kept per encoder and action, so the
+    estimate of a file is its duration over the average speed and its
+    duration times the average output bitrate.
+    """
+    def __init__(self, path: str = COSTS_CACHE):
+        self.path = path
+        self.stats: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                self.stats = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def estimate(
+        self,
+        encoder: Optional[str],
+        action: str,
+        duration: float,
+        input_bytes: int,
+    ) -> tuple[float, int]:
+        """
+        Estimate one file.
+
+        Args:
+            encoder (Optional[str]): Encoder key, None is libx265
+            action (str): "encode" or "remux"
+            duration (float): Duration of the file (seconds), 0 if unknown
+            input_bytes (int): Size of the file
+
+        Returns:
+            tuple[float, int]: Encode time (seconds) and output size (bytes)
+        """
+        encoder = encoder or "libx265"
+        stats = self.stats.get(f"{encoder}|{action}")
+        if stats and stats["duration"] > 0 and stats["wall_time"] > 0:
+            speed = stats["duration"] / stats["wall_time"]
+            ratio = stats["output_bytes"] / stats["input_bytes"] if stats["input_bytes"] else 1.0
+            rate = stats["output_bytes"] / stats["duration"]
+        elif action == "remux":
+            speed, ratio, rate = DEFAULT_REMUX_SPEED, 1.0, None
+        else:
+            speed = DEFAULT_SPEED.get(encoder, 1.0)
+            ratio, rate = 0.25, DEFAULT_OUTPUT_RATE
+
+        if duration <= 0:
+            # Unknown duration, guess it from size at a typical source bitrate
+            duration = input_bytes / 500_000
+        output_bytes = input_bytes * ratio
+        if action != "remux" and rate:
+            # Output bitrate depends on target settings, not on the source,
+            # but converting never makes the file bigger than the source
+            output_bytes = min(input_bytes, duration * rate)
+        return duration / speed, int(output_bytes)
+
+    def learn(self, jobs: Iterable[dict]):
+        """
+        Add converted jobs of a MetricsReport to the history.
+
+        Args:
+            jobs (Iterable[dict]): Jobs with status, encoder, action,
+                duration, wall_time, input_bytes and output_bytes
+        """
+        with self._lock:
+            for job in jobs:
+                if job.get("status") != "converted" or not job.get("duration") \
+                        or not job.get("wall_time") or not job.get("output_bytes"):
+                    continue
+                key = f"{job.get('encoder') or 'libx265'}|{job.get('action') or 'encode'}"
+                stats = self.stats.setdefault(key, {
+                    "duration": 0.0, "wall_time": 0.0, "input_bytes": 0, "output_bytes": 0})
+                stats["duration"] += job["duration"]
+                stats["wall_time"] += job["wall_time"]
+                stats["input_bytes"] += job["input_bytes"] or 0
+                stats["output_bytes"] += job["output_bytes"]
+
+            for stats in self.stats.values():
+                if stats["duration"] > HISTORY_DURATION:
+                    scale = HISTORY_DURATION / stats["duration"]
+                    for field in stats:
+                        stats[field] *= scale
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with self._lock, open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.stats, f, indent=2)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            prdebug(f"Failed to save cost model: {e}")
+
+def makespan(costs: list[float], workers: int) -> float:
+    """
+    Time to run jobs on workers when every job goes to the worker
+    that is free first, in the given order.
+
+    Args:
+        costs (list[float]): Time of every job in the order they start
+        workers (int): Number of jobs that run at once
+    """
+    finish = [0.0] * max(1, workers)
+    for cost in costs:
+        heapq.heapreplace(finish, finish[0] + cost)
+    return max(finish)
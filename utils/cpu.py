@@ -0,0 +1,126 @@
+import os
+import glob
+import threading
+
+from typing import Optional
+from utils.logger import prdebug
+
+# How jobs are pinned to CPUs
+PIN_NONE = "none"
+PIN_CPUS = "cpus"
+PIN_NUMA = "numa"
+
+def parse_cpulist(value: str) -> list[int]:
+    """Parse Linux CPU list like "0-3,8,10-11" """
+    cpus = []
+    for part in value.strip().split(","):
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-")
+            cpus += range(int(start), int(end) + 1)
+        else:
+            cpus.append(int(part))
+    return cpus
+
+def available_cpus() -> list[int]:
+    """Return CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def numa_nodes() -> list[list[int]]:
+    """Return available CPUs of every NUMA node, one node if unknown"""
+    cpus = set(available_cpus())
+    nodes = []
+    for path in sorted(glob.glob("/sys/devices/system/node/node[0-9]*/cpulist")):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                node = [cpu for cpu in parse_cpulist(f.read()) if cpu in cpus]
+        except (OSError, ValueError):
+            continue
+        if node:
+            nodes.append(node)
+    return nodes or [sorted(cpus)]
+
+def thread_budget(jobs: int, cpus: Optional[int] = None) -> int:
+    """
+    Return how many threads every job can use so jobs don't fight for cores.
+
+    Args:
+        jobs (int): Number of jobs that run at once
+        cpus (Optional[int]): Number of CPUs, all available CPUs if None
+    """
+    cpus = cpus or len(available_cpus())
+    return max(1, cpus // max(1, jobs))
+
+def split_cpus(jobs: int, pin: str = PIN_CPUS, nodes: Optional[list[list[int]]] = None) -> list[list[int]]:
+    """
+    Split CPUs into one set for every job.
+
+    With PIN_CPUS every job gets its own cores, taken from one NUMA
+    node when they fit, so a job's threads share caches and memory.
+    With PIN_NUMA every job gets a whole node, nodes are shared by
+    jobs when there are more jobs than nodes.
+
+    Args:
+        jobs (int): Number of jobs that run at once
+        pin (str): PIN_CPUS or PIN_NUMA
+        nodes (Optional[list[list[int]]]): CPUs of every NUMA node, detected if None
+    """
+    nodes = nodes or numa_nodes()
+    jobs = max(1, jobs)
+    if pin == PIN_NUMA:
+        return [nodes[i % len(nodes)] for i in range(jobs)]
+
+    cpus = [cpu for node in nodes for cpu in node]
+    size = max(1, len(cpus) // jobs)
+    slots = []
+    for node in nodes:
+        # Whole slots from this node first, leftovers are joined across nodes
+        while len(node) >= size and len(slots) < jobs:
+            slots.append(node[:size])
+            node = node[size:]
+    used = {cpu for slot in slots for cpu in slot}
+    rest = [cpu for cpu in cpus if cpu not in used]
+    while len(slots) < jobs:
+        if len(rest) >= size:
+            slots.append(rest[:size])
+            rest = rest[size:]
+        else:
+            # More jobs than CPUs, jobs have to share them
+            slots.append(cpus[(len(slots) * size) % len(cpus):][:size] or cpus[:size])
+    return slots
+
+class CpuAllocator:
+    """
+    Hands out CPU sets to running jobs, every job gets a set
+    no other running job has, and gives it back when done.
+    """
+    def __init__(self, jobs: int, pin: str = PIN_CPUS):
+        self.pin = pin
+        self.free = split_cpus(jobs, pin)
+        self._lock = threading.Lock()
+        prdebug(f"CPU sets of jobs: {self.free}")
+
+    def acquire(self) -> Optional[list[int]]:
+        with self._lock:
+            return self.free.pop(0) if self.free else None
+
+    def release(self, cpus: Optional[list[int]]):
+        if cpus is None:
+            return
+        with self._lock:
+            self.free.append(cpus)
+
+def pin_process(pid: int, cpus: Optional[list[int]]):
+    """Run process only on these CPUs, does nothing where it's not supported"""
+    if not cpus:
+        return
+    if not hasattr(os, "sched_setaffinity"):
+        prdebug("Pinning jobs to CPUs is only supported on Linux")
+        return
+    try:
+        os.sched_setaffinity(pid, cpus)
+    except OSError as e:
+        prdebug(f"Failed to pin process {pid} to CPUs {cpus}: {e}")
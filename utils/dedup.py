@@ -0,0 +1,222 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+
+from typing import Optional
+from utils.ffmpeg.core import CAPABILITIES_CACHE
+from utils.files import VideoFile
+from utils.logger import prdebug
+
+# Fingerprints of scanned files and outputs of converted ones, kept between runs
+FINGERPRINTS_CACHE = os.path.join(os.path.dirname(CAPABILITIES_CACHE), "fingerprints.json")
+
+# Blocks read from every file, spread evenly from start to end
+SAMPLE_BLOCKS = 16
+SAMPLE_SIZE = 64 * 1024
+
+def sample_hash(path: str, size: int, blocks: int = SAMPLE_BLOCKS, block_size: int = SAMPLE_SIZE) -> str:
+    """Hash of size and a few blocks of a file, equal files have equal sample hashes"""
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        if size <= blocks * block_size:
+            h.update(f.read())
+            return h.hexdigest()
+        step = (size - block_size) // (blocks - 1)
+        for i in range(blocks):
+            f.seek(i * step)
+            h.update(f.read(block_size))
+    return h.hexdigest()
+
+def full_hash(path: str, block_size: int = 1024**2) -> str:
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+def link_or_copy(source: str, target: str):
+    """
+    Hard link a file to target, copy it if linking is not possible,
+    like across file systems. Target is replaced in one step.
+    """
+    if os.path.exists(target) and os.path.samefile(source, target):
+        return
+    os.makedirs(os.path.dirname(os.path.abspath(target)), exist_ok=True)
+    tmp_path = os.path.join(
+        os.path.dirname(os.path.abspath(target)),
+        f".{os.path.basename(target)}.{uuid.uuid4().hex[:8]}.tmp")
+    try:
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class FingerprintIndex:
+    """
+    Finds files with the same content, so they are converted once.
+
+    Files are compared by inode first, hard links are the same file.
+    Other files are compared by size and a hash of sampled blocks,
+    and only files whose samples match are hashed completely.
+
+    Fingerprints are cached by path, size and mtime, so unchanged
+    files are not read again on the next run. Outputs of converted
+    files are saved too, so copies that show up later are linked to
+    the output of an earlier run instead of being converted again.
+    """
+    def __init__(self, path: str = FINGERPRINTS_CACHE):
+        self.path = path
+        self.files: dict[str, dict] = {}
+        self.outputs: dict[str, dict] = {}
+        # Files of this run by inode and by sample, first one of every content
+        self.inodes: dict[tuple[int, int], str] = {}
+        self.samples: dict[str, list[str]] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.files = data.get("files", {})
+            self.outputs = data.get("outputs", {})
+        except (OSError, ValueError):
+            pass
+
+    def _entry(self, path: str, st: Optional[os.stat_result] = None) -> dict:
+        """Return fingerprint of a file, hashed again only if it changed"""
+        st = st or os.stat(path)
+        entry = self.files.get(path)
+        if entry is None or entry["size"] != st.st_size or entry["mtime"] != st.st_mtime:
+            entry = {
+                "size": st.st_size,
+                "mtime": st.st_mtime,
+                "sample": f"{st.st_size}:{sample_hash(path, st.st_size)}",
+                "full": None,
+            }
+            self.files[path] = entry
+        return entry
+
+    def _full(self, path: str) -> Optional[str]:
+        """Return full hash of a file, None if it changed since it was sampled"""
+        entry = self.files.get(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if entry is None or entry["size"] != st.st_size or entry["mtime"] != st.st_mtime:
+            return None
+        if entry["full"] is None:
+            prdebug(f"Samples match, hashing whole file: {path}")
+            entry["full"] = full_hash(path)
+        return entry["full"]
+
+    def add(self, file: VideoFile) -> Optional[str]:
+        """
+        Add a scanned file.
+
+        Args:
+            file (VideoFile): File found by the scan
+
+        Returns:
+            Optional[str]: Earlier file of this run with the same content, None if it's the first
+        """
+        st = os.stat(file.path)
+        with self._lock:
+            inode = (st.st_dev, st.st_ino)
+            if inode in self.inodes:
+                return self.inodes[inode]
+            entry = self._entry(file.path, st)
+            self.inodes[inode] = file.path
+            candidates = self.samples.setdefault(entry["sample"], [])
+            for candidate in candidates:
+                full = self._full(file.path)
+                if full is not None and full == self._full(candidate):
+                    return candidate
+            candidates.append(file.path)
+            return None
+
+    def hash_source(self, path: str):
+        """
+        Hash a whole added file before it's deleted or replaced by its
+        output, so copies found by later runs can still be matched to it.
+        """
+        with self._lock:
+            self._full(path)
+
+    def outputs_of(self, path: str, params: dict) -> Optional[list[str]]:
+        """
+        Return outputs of a file with the same content converted by an
+        earlier run with the same parameters, None if there are none.
+
+        Args:
+            path (str): Path to an added file
+            params (dict): Encode parameters of this run
+        """
+        with self._lock:
+            entry = self.files.get(path)
+            record = self.outputs.get(entry["sample"]) if entry else None
+            if record is None or record["source"] == path or record["params"] != params:
+                return None
+            for output in record["outputs"]:
+                try:
+                    st = os.stat(output["path"])
+                except OSError:
+                    return None
+                if st.st_size != output["size"] or st.st_mtime != output["mtime"]:
+                    return None
+            # Source may be deleted or replaced by now, then its full hash
+            # is only known if it was needed before
+            source = self.files.get(record["source"])
+            if record["full"] is None and source and source["sample"] == entry["sample"]:
+                record["full"] = self._full(record["source"])
+            if record["full"] is None or record["full"] != self._full(path):
+                return None
+            return [output["path"] for output in record["outputs"]]
+
+    def record(self, path: str, params: dict, outputs: list[str]):
+        """
+        Save outputs of a converted file for later runs.
+
+        Args:
+            path (str): Path to an added file
+            params (dict): Encode parameters of the outputs
+            outputs (list[str]): Paths of the outputs
+        """
+        with self._lock:
+            entry = self.files.get(path)
+            if entry is None:
+                return
+            records = []
+            for output in outputs:
+                st = os.stat(output)
+                records.append({"path": output, "size": st.st_size, "mtime": st.st_mtime})
+            self.outputs[entry["sample"]] = {
+                "source": path,
+                "full": entry["full"],
+                "params": params,
+                "outputs": records,
+            }
+
+    def save(self):
+        """Save fingerprints, files and outputs that are gone are dropped"""
+        with self._lock:
+            self.files = {path: entry for path, entry in self.files.items() if os.path.exists(path)}
+            self.outputs = {
+                sample: record for sample, record in self.outputs.items()
+                if all(os.path.exists(output["path"]) for output in record["outputs"])
+            }
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with self._lock, open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"files": self.files, "outputs": self.outputs}, f)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            prdebug(f"Failed to save fingerprints: {e}")
@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import shlex
+import signal
+import asyncio
+
+from typing import Optional
+from .core import Profile
+from .transcoder import check_ffmpeg, get_encoder, build_command, output_state
+from .probe import probe
+from .progress import ProgressParser, ProgressCallback
+from utils.cpu import pin_process
+from utils.logger import prdebug
+
+class TranscodeTimeoutError(RuntimeError):
+    """ffmpeg ran longer than the allowed wall-clock time"""
+
+class TranscodeStalledError(RuntimeError):
+    """ffmpeg didn't make any progress for too long"""
+
+# Seconds to wait for ffmpeg to exit after terminating it, before killing it
+KILL_TIMEOUT = 5.0
+
+def _signal_group(proc: asyncio.subprocess.Process, kill: bool = False):
+    """Stop ffmpeg and everything it started"""
+    if proc.returncode is not None:
+        return
+    try:
+        if sys.platform == "win32":
+            if kill:
+                proc.kill()
+            else:
+                proc.terminate()
+        else:
+            os.killpg(proc.pid, signal.SIGKILL if kill else signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+async def _stop(proc: asyncio.subprocess.Process):
+    """Terminate ffmpeg, kill it if it doesn't exit in time"""
+    _signal_group(proc)
+    try:
+        await asyncio.wait_for(proc.wait(), KILL_TIMEOUT)
+    except asyncio.TimeoutError:
+        _signal_group(proc, kill=True)
+        await proc.wait()
+
+async def run_ffmpeg_async(
+    args: list[str],
+    on_progress: Optional[ProgressCallback] = None,
+    timeout: Optional[float] = None,
+    stall_timeout: Optional[float] = None,
+    output_path: Optional[str] = None,
+    cpus: Optional[list[int]] = None,
+):
+    """
+    Run ffmpeg command without blocking the event loop.
+
+    Args:
+        args (list[str]): ffmpeg command
+        on_progress (Optional[ProgressCallback]): Called with every progress update
+        timeout (Optional[float]): Max wall-clock time (seconds)
+        stall_timeout (Optional[float]): Max time without progress (seconds)
+        output_path (Optional[str]): Removed if ffmpeg fails or is cancelled after
+            writing to it, a file that ffmpeg didn't touch (like with -n) is kept
+        cpus (Optional[list[int]]): Run ffmpeg only on these CPUs
+    """
+    args = [args[0], "-progress", "pipe:1", "-nostats", *args[1:]]
+    prdebug(f"Running ffmpeg: {' '.join(shlex.quote(a) for a in args if a)}")
+
+    # Only a file written by this run is removed when it fails
+    before = output_state(output_path)
+
+    def discard_output():
+        if output_path and output_state(output_path) not in (None, before):
+            os.remove(output_path)
+
+    # New process group, so we can stop ffmpeg and anything it started
+    if sys.platform == "win32":
+        kwargs = {"creationflags": 0x00000200}  # CREATE_NEW_PROCESS_GROUP
+    else:
+        kwargs = {"start_new_session": True}
+    proc = await asyncio.create_subprocess_exec(
+        *args, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, **kwargs)
+    pin_process(proc.pid, cpus)
+
+    start = last_progress = time.monotonic()
+    last_position = (-1, -1.0)
+
+    async def read_stdout():
+        nonlocal last_progress, last_position
+        parser = ProgressParser()
+        async for line in proc.stdout:
+            progress = parser.feed(line.decode(errors="replace"))
+            if progress is None:
+                continue
+            # Only moving forward counts as progress
+            if (progress.frame, progress.out_time) != last_position:
+                last_position = (progress.frame, progress.out_time)
+                last_progress = time.monotonic()
+            if on_progress:
+                on_progress(progress)
+
+    async def read_stderr():
+        async for line in proc.stderr:
+            prdebug(line.decode(errors="replace").rstrip("\r\n"))
+
+    async def watchdog():
+        while True:
+            await asyncio.sleep(0.5)
+            now = time.monotonic()
+            if timeout is not None and now - start > timeout:
+                raise TranscodeTimeoutError(f"ffmpeg timed out after {timeout:.0f}s")
+            if stall_timeout is not None and now - last_progress > stall_timeout:
+                raise TranscodeStalledError(
+                    f"ffmpeg made no progress for {stall_timeout:.0f}s")
+
+    readers = asyncio.gather(read_stdout(), read_stderr())
+    guard = asyncio.ensure_future(watchdog())
+    try:
+        done, _ = await asyncio.wait({readers, guard}, return_when=asyncio.FIRST_COMPLETED)
+        if guard in done:
+            guard.result()
+        await readers
+        await proc.wait()
+    except BaseException:
+        # Timeout, stall or cancellation, don't leave ffmpeg or a partial file behind
+        await asyncio.shield(_stop(proc))
+        readers.cancel()
+        # Collect results of the readers, so their errors are not reported as never retrieved
+        await asyncio.gather(readers, return_exceptions=True)
+        discard_output()
+        raise
+    finally:
+        guard.cancel()
+
+    if proc.returncode != 0:
+        discard_output()
+        raise RuntimeError(f"ffmpeg failed with return code {proc.returncode}")
+
+async def transcode_async(
+    input_path: str,
+    output_path: str,
+    ten_bit: bool = True,
+    audio_bitrate: str = "96k",
+    overwrite: bool = True,
+    prefer_gpu: bool = True,
+    cq: Optional[int] = None,
+    target_resolution: str = "1280x720",
+    on_progress: Optional[ProgressCallback] = None,
+    timeout: Optional[float] = None,
+    stall_timeout: Optional[float] = None,
+    audio_codec: str = "aac",
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    cpus: Optional[list[int]] = None,
+    profile: Optional[Profile] = None,
+):
+    """
+    Transcodes a video file like transcode, but as a coroutine.
+
+    Many jobs can run from one event loop, the job is stopped if it
+    runs longer than timeout or makes no progress for stall_timeout,
+    cancelling the task stops ffmpeg and removes the partial output.
+
+    Args:
+        input_path (str): Path to the input video file
+        output_path (str): Path to the output video file
+        ten_bit (bool): Should we use 10-bit encoding?
+        audio_bitrate (str): Bitrate of the audio, "96k" is the default
+        overwrite (bool): Should we overwrite output file if it exists?
+        prefer_gpu (bool): Should we use the GPU for encoding?
+        cq (Optional[int]): Constant quality, lower is better quality, see build_args
+        target_resolution (str): Target resolution for the output video
+        on_progress (Optional[ProgressCallback]): Called with every progress update
+        timeout (Optional[float]): Max wall-clock time (seconds)
+        stall_timeout (Optional[float]): Max time without progress (seconds)
+        audio_codec (str): Codec for audio that can't be copied, "aac" or "opus"
+        speed (Optional[str]): Speed/size trade-off that picks encoder and preset, see SPEEDS
+        threads (Optional[int]): Threads ffmpeg may use, all cores if None
+        cpus (Optional[list[int]]): Run ffmpeg only on these CPUs
+        profile (Optional[Profile]): Content profile that changes CQ, preset and frame rate
+    """
+    check_ffmpeg()
+    # Detection is cached, but the first one runs a few processes
+    hw = await asyncio.to_thread(get_encoder, prefer_gpu, speed)
+    try:
+        streams = await asyncio.to_thread(probe, input_path)
+    except RuntimeError:
+        streams = None
+
+    await run_ffmpeg_async(build_command(
+        input_path, output_path, hw,
+        ten_bit=ten_bit,
+        audio_bitrate=audio_bitrate,
+        overwrite=overwrite,
+        cq=cq,
+        target_resolution=target_resolution,
+        streams=streams,
+        audio_codec=audio_codec,
+        speed=speed,
+        threads=threads,
+        profile=profile,
+    ), on_progress, timeout, stall_timeout, output_path, cpus)
+
+    prdebug(f"Done: {output_path}")
+    return output_path
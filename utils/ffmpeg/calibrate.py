@@ -0,0 +1,150 @@
+import os
+import re
+import json
+import time
+import shutil
+import tempfile
+import subprocess
+
+from typing import Optional
+from .core import (
+    CALIBRATION_CACHE, SPEED_PRESETS, capabilities_key, get_capabilities, load_calibration,
+)
+from .transcoder import check_ffmpeg, build_command, run_ffmpeg
+from .progress import Progress
+from utils.logger import prdebug, prinfo, prwarn
+
+# Encoders to calibrate, with the ffmpeg encoder they need and presets to try
+CANDIDATES = {
+    "libx265": ("libx265", ["veryslow", "slow", "medium", "fast"]),
+    "libx264": ("libx264", ["slow", "medium", "veryfast"]),
+    "svtav1": ("libsvtav1", ["5", "8", "10"]),
+    "nvenc": ("hevc_nvenc", ["p7", "p6", "p4"]),
+    "qsv": ("hevc_qsv", [None]),
+    "amf": ("hevc_amf", [None]),
+    "vaapi": ("hevc_vaapi", [None]),
+}
+
+# Moving test pattern with some noise, so encoders have something to work on
+CLIP_SOURCE = "testsrc2=size={resolution}:rate=30,noise=alls=8:allf=t+u"
+
+def make_clip(path: str, resolution: str = "1280x720", duration: int = 3):
+    """Generate a lossless synthetic clip"""
+    subprocess.run([
+        "ffmpeg", "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", CLIP_SOURCE.format(resolution=resolution),
+        "-t", str(duration),
+        # FFV1 is lossless and built into ffmpeg
+        "-c:v", "ffv1", "-pix_fmt", "yuv420p",
+        path,
+    ], check=True)
+
+def measure_ssim(path: str, reference: str) -> float:
+    """Return SSIM of a video compared to the reference, 1.0 is identical"""
+    p = subprocess.run([
+        "ffmpeg", "-hide_banner", "-loglevel", "info",
+        "-i", path, "-i", reference,
+        "-lavfi", "[0:v]format=yuv420p[a];[1:v]format=yuv420p[b];[a][b]ssim",
+        "-f", "null", "-",
+    ], capture_output=True, text=True)
+    m = re.search(r"SSIM .*All:([\d.]+)", p.stderr)
+    if p.returncode != 0 or not m:
+        raise RuntimeError(f"Failed to measure SSIM of {path}")
+    return float(m.group(1))
+
+def calibrate(
+    resolution: str = "1280x720",
+    duration: int = 3,
+    cq: int = 28,
+    ten_bit: bool = True,
+) -> list[dict]:
+    """
+    Encode a short synthetic clip with every available encoder and
+    preset, measure fps, size and SSIM and save the ranked results.
+
+    Encoders that are listed by ffmpeg but fail to encode, like
+    hardware encoders without the device, are left out.
+
+    Args:
+        resolution (str): Resolution of the clip
+        duration (int): Length of the clip (seconds)
+        cq (int): Constant quality used for every encode
+        ten_bit (bool): Should we use 10-bit encoding?
+
+    Returns:
+        list[dict]: Results with encoder, preset, fps, bytes and ssim, fastest first
+    """
+    check_ffmpeg()
+    encoders = set(get_capabilities()["encoders"])
+    tmp_dir = tempfile.mkdtemp(prefix="convert-videos-calibration-")
+    results = []
+    try:
+        clip = os.path.join(tmp_dir, "clip.mkv")
+        make_clip(clip, resolution, duration)
+
+        for key, (ffmpeg_encoder, presets) in CANDIDATES.items():
+            if ffmpeg_encoder not in encoders:
+                continue
+            for preset in presets:
+                output = os.path.join(tmp_dir, "output.mkv")
+                frames = []
+
+                def on_progress(p: Progress):
+                    frames[:] = [p.frame]
+
+                start = time.time()
+                try:
+                    run_ffmpeg(build_command(
+                        clip, output, None if key == "libx265" else key,
+                        ten_bit=ten_bit,
+                        audio_bitrate=None,
+                        cq=cq,
+                        target_resolution=resolution,
+                        preset=preset,
+                    ), on_progress)
+                    wall_time = time.time() - start
+                    ssim = measure_ssim(output, clip)
+                except (RuntimeError, subprocess.CalledProcessError) as e:
+                    prdebug(f"Calibration of {key} {preset or ''} failed: {e}")
+                    continue
+                frame_count = frames[0] if frames else duration * 30
+                result = {
+                    "encoder": key,
+                    "preset": preset or SPEED_PRESETS.get(key, {}).get("archive"),
+                    "fps": round(frame_count / wall_time, 2) if wall_time else 0.0,
+                    "bytes": os.path.getsize(output),
+                    "ssim": round(ssim, 5),
+                }
+                prinfo(f"Calibrated {key} {preset or 'default'}: {result['fps']} fps, "
+                    f"{result['bytes']} bytes, SSIM {result['ssim']}")
+                results.append(result)
+                os.remove(output)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    if not results:
+        prwarn("No encoder could be calibrated")
+        return results
+    results.sort(key=lambda r: r["fps"], reverse=True)
+    save_calibration(results)
+    return results
+
+def save_calibration(results: list[dict]):
+    try:
+        os.makedirs(os.path.dirname(CALIBRATION_CACHE), exist_ok=True)
+        tmp_path = f"{CALIBRATION_CACHE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"key": capabilities_key(), "results": results}, f, indent=2)
+        os.replace(tmp_path, CALIBRATION_CACHE)
+    except OSError as e:
+        prdebug(f"Failed to save calibration: {e}")
+    # Encodes of this process use the new results
+    load_calibration(refresh=True)
+
+def ensure_calibrated(refresh: bool = False) -> Optional[list[dict]]:
+    """Calibrate encoders if this ffmpeg and platform were not calibrated yet"""
+    results = None if refresh else load_calibration()
+    if results is None:
+        prinfo("Calibrating encoders, this runs once for every ffmpeg version")
+        results = calibrate()
+    return results
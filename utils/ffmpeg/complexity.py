@@ -0,0 +1,105 @@
+import re
+import subprocess
+
+from typing import Optional
+from .core import Profile, PROFILES
+from .probe import probe, get_duration
+from .target import sample_windows
+from utils.logger import prdebug
+
+# Frames are compared in gray at this width, enough to tell
+# static from moving content and much faster to filter
+ANALYSIS_WIDTH = 160
+# Scene score of a frame above this is a cut
+SCENE_THRESHOLD = 0.3
+
+# Mean difference of neighbouring frames (0-255) below which a frame counts as still
+STILL_FRAME_DIFF = 1.0
+# Share of still frames and mean difference of static content
+STATIC_SHARE = 0.8
+STATIC_MAX_DIFF = 2.0
+# Mean difference or cuts per minute of high motion content
+MOTION_MIN_DIFF = 12.0
+MOTION_MIN_CUTS = 30.0
+
+def parse_frames(output: str) -> list[tuple[float, float]]:
+    """Return scene score and frame difference of every frame from metadata logs"""
+    scenes = [float(v) for v in re.findall(r"lavfi\.scene_score=([\d.]+)", output)]
+    diffs = [float(v) for v in re.findall(r"lavfi\.signalstats\.YDIF=([\d.]+)", output)]
+    return list(zip(scenes, diffs))
+
+def analyze(
+    input_path: str,
+    duration: Optional[float] = None,
+    segments: int = 4,
+    length: float = 5.0,
+    threads: Optional[int] = None,
+) -> dict:
+    """
+    Measure how much a video moves from a few short segments.
+
+    Args:
+        input_path (str): Path to the video
+        duration (Optional[float]): Duration of the video, probed if None
+        segments (int): Number of segments, evenly spaced
+        length (float): Length of every segment (seconds)
+        threads (Optional[int]): Threads of the decoder, all cores if None
+
+    Returns:
+        dict: Mean frame difference, share of still frames and cuts per minute
+    """
+    if not duration:
+        duration = get_duration(probe(input_path))
+    frames = []
+    seconds = 0.0
+    for start, window in sample_windows(duration, segments, length):
+        args = [
+            "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "info",
+            *(["-threads", str(threads)] if threads else []),
+            "-ss", f"{start:.3f}", "-t", f"{window:.3f}",
+            "-i", input_path,
+            # Only the video is analyzed
+            "-an", "-sn", "-dn",
+            # Scene score and difference to the previous frame of every frame
+            "-vf", f"scale={ANALYSIS_WIDTH}:-2,format=gray,"
+                   "select='gte(scene,0)',signalstats,metadata=mode=print",
+            "-f", "null", "-",
+        ]
+        p = subprocess.run(args, capture_output=True, text=True)
+        if p.returncode != 0:
+            raise RuntimeError(f"Failed to analyze {input_path} at {start:.1f}s")
+        # First frame of a segment has nothing to be compared to
+        frames += parse_frames(p.stderr)[1:]
+        seconds += window
+
+    if not frames:
+        raise RuntimeError(f"No frames to analyze in {input_path}")
+    cuts = sum(1 for scene, _ in frames if scene > SCENE_THRESHOLD)
+    return {
+        "motion": round(sum(diff for _, diff in frames) / len(frames), 3),
+        "still": round(sum(1 for _, diff in frames if diff < STILL_FRAME_DIFF) / len(frames), 3),
+        "cuts_per_minute": round(cuts / seconds * 60, 2) if seconds > 0 else 0.0,
+    }
+
+def classify(stats: dict) -> str:
+    """Return content class of analyze results, a key of PROFILES"""
+    if stats["still"] >= STATIC_SHARE and stats["motion"] < STATIC_MAX_DIFF:
+        return "static"
+    if stats["motion"] >= MOTION_MIN_DIFF or stats["cuts_per_minute"] >= MOTION_MIN_CUTS:
+        return "motion"
+    return "normal"
+
+def pick_profile(
+    input_path: str,
+    duration: Optional[float] = None,
+    threads: Optional[int] = None,
+) -> Profile:
+    """Analyze a video and return the profile of its content, normal if it can't be analyzed"""
+    try:
+        stats = analyze(input_path, duration, threads=threads)
+    except RuntimeError as e:
+        prdebug(f"Using normal profile, {e}")
+        return PROFILES["normal"]
+    name = classify(stats)
+    prdebug(f"Content of {input_path}: {stats}, {name} profile")
+    return PROFILES[name]
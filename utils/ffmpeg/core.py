@@ -1,8 +1,23 @@
 import subprocess
+import threading
 import platform
+import shutil
+import json
+import os
 import re
 
-from typing import Optional, Set
+from typing import NamedTuple, Optional, Set
+from utils.logger import prdebug
+
+# Detection results are stored here, so we don't have to run
+# nvidia-smi, lspci and ffmpeg -encoders again on every start
+CAPABILITIES_CACHE = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "convert-videos", "capabilities.json"
+)
+
+_capabilities: Optional[dict] = None
+_capabilities_lock = threading.Lock()
 
 def get_hardware_type() -> str:
     """Detect the hardware type of the system (NVIDIA, Intel, or AMD)"""
@@ -51,9 +66,8 @@ def get_ffmpeg_encoders() -> Set[str]:
             encoders.add(m.group(1))
     return encoders
 
-def detect_hw_encoder_key() -> Optional[str]:
-    encs = get_ffmpeg_encoders()
-    hw_type = get_hardware_type()
+def pick_encoder_key(encs: Set[str], hw_type: str) -> Optional[str]:
+    """Pick hardware encoder from ffmpeg encoders and hardware type"""
     if not encs:
         return None
 
@@ -79,25 +93,277 @@ def detect_hw_encoder_key() -> Optional[str]:
 
     return None
 
-def build_args(encoder_key: Optional[str], ten_bit: bool, cq: int):
+def capabilities_key() -> str:
+    """Cache key, detection must run again if ffmpeg or platform changes"""
+    ffmpeg = shutil.which("ffmpeg") or ""
+    mtime = os.path.getmtime(ffmpeg) if ffmpeg else 0
+    return f"{ffmpeg}|{mtime}|{platform.platform()}"
+
+def _load_capabilities(key: str) -> Optional[dict]:
+    try:
+        with open(CAPABILITIES_CACHE, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return data if data.get("key") == key else None
+
+def _save_capabilities(data: dict):
+    try:
+        os.makedirs(os.path.dirname(CAPABILITIES_CACHE), exist_ok=True)
+        tmp_path = f"{CAPABILITIES_CACHE}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, CAPABILITIES_CACHE)
+    except OSError as e:
+        prdebug(f"Failed to save capabilities cache: {e}")
+
+def get_capabilities(refresh: bool = False) -> dict:
+    """
+    Return detected hardware type, ffmpeg encoders and encoder key.
+
+    Detection runs once per process and is cached on disk, keyed
+    by ffmpeg binary path, its mtime and the platform.
+
+    Args:
+        refresh (bool): Ignore the cache and detect everything again
+
+    Returns:
+        dict: Capabilities with "hw_type", "encoders" and "encoder_key"
+    """
+    global _capabilities
+    with _capabilities_lock:
+        key = capabilities_key()
+        if not refresh and _capabilities and _capabilities["key"] == key:
+            return _capabilities
+
+        data = None if refresh else _load_capabilities(key)
+        if data is None:
+            prdebug("Detecting hardware and ffmpeg encoders")
+            encs = get_ffmpeg_encoders()
+            hw_type = get_hardware_type()
+            data = {
+                "key": key,
+                "hw_type": hw_type,
+                "encoders": sorted(encs),
+                "encoder_key": pick_encoder_key(encs, hw_type),
+            }
+            # Don't cache failed detection when ffmpeg is missing
+            if encs:
+                _save_capabilities(data)
+
+        _capabilities = data
+        return data
+
+def detect_hw_encoder_key(refresh: bool = False) -> Optional[str]:
+    """Return hardware encoder key, uses cached detection if possible"""
+    return get_capabilities(refresh)["encoder_key"]
+
+# Trade-offs between encode speed and output size for --speed
+SPEEDS = ("fast", "balanced", "archive")
+
+# Presets of every encoder for every speed, used until encoders are calibrated
+SPEED_PRESETS = {
+    "libx265": {"fast": "fast", "balanced": "medium", "archive": "slow"},
+    "libx264": {"fast": "veryfast", "balanced": "medium", "archive": "slow"},
+    "svtav1": {"fast": "10", "balanced": "8", "archive": "5"},
+    "nvenc": {"fast": "p4", "balanced": "p6", "archive": "p7"},
+}
+
+# CQ of the encoders if none is given. libx265 had its own CRF
+# before CQ was passed to it, so it keeps that one by default
+DEFAULT_CQ = 19
+X265_CRF = 24
+
+class Profile(NamedTuple):
+    """Changes to the encode settings of one file, picked by its content"""
+    name: str
+    # Added to CQ, positive is smaller and lower quality
+    cq_offset: int = 0
+    # Preset of this speed replaces the one of the run, see SPEEDS
+    speed: Optional[str] = None
+    # Frame rate is lowered to this if it's higher
+    max_fps: Optional[int] = None
+
+# Profile of every content class, see utils.ffmpeg.complexity
+PROFILES = {
+    # Screen recordings and slideshows, few pixels change between frames,
+    # so they look the same at much higher CQ and lower frame rate
+    "static": Profile("static", cq_offset=6, speed="fast", max_fps=15),
+    "normal": Profile("normal"),
+    # Sports, action and grain, every frame is new, CQ that is fine
+    # for normal footage shows blocks here
+    "motion": Profile("motion", cq_offset=-2),
+}
+
+# Results of encoder calibration, see utils.ffmpeg.calibrate
+CALIBRATION_CACHE = os.path.join(os.path.dirname(CAPABILITIES_CACHE), "calibration.json")
+
+_calibration: Optional[tuple[Optional[list[dict]]]] = None
+_calibration_lock = threading.Lock()
+
+def load_calibration(refresh: bool = False) -> Optional[list[dict]]:
+    """
+    Return calibration results for this ffmpeg and platform, None if not calibrated.
+
+    The cache is read once per process, every encode args build asks for it.
+
+    Args:
+        refresh (bool): Read the cache again, like after calibrating
+    """
+    global _calibration
+    with _calibration_lock:
+        if refresh or _calibration is None:
+            try:
+                with open(CALIBRATION_CACHE, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            # Wrapped, so "not calibrated" is cached too
+            _calibration = (data["results"] if data.get("key") == capabilities_key() else None,)
+        return _calibration[0]
+
+def pick_calibrated(results: list[dict], speed: str) -> Optional[dict]:
+    """
+    Pick encoder and preset from calibration results.
+
+    Only results with about the best quality are compared, "fast" is
+    the highest fps, "archive" the smallest output and "balanced" the
+    smallest output per fourth root of fps, so 16 times faster is
+    worth twice the size.
+
+    Args:
+        results (list[dict]): Results with encoder, preset, fps, bytes and ssim
+        speed (str): One of SPEEDS
+
+    Returns:
+        Optional[dict]: Picked result, None if there are no results
+    """
+    results = [r for r in results if r["fps"] > 0 and r["bytes"] > 0]
+    if not results:
+        return None
+    best_ssim = max(r["ssim"] for r in results)
+    results = [r for r in results if r["ssim"] >= best_ssim - 0.01]
+
+    if speed == "fast":
+        return max(results, key=lambda r: r["fps"])
+    if speed == "archive":
+        return min(results, key=lambda r: r["bytes"])
+    return min(results, key=lambda r: r["bytes"] / r["fps"] ** 0.25)
+
+def encoder_for_speed(speed: str) -> tuple[Optional[str], Optional[str]]:
+    """
+    Return encoder key and preset for a speed, from calibration if
+    encoders were calibrated, otherwise detected encoder and its preset.
+
+    Args:
+        speed (str): One of SPEEDS
+    """
+    results = load_calibration()
+    picked = pick_calibrated(results, speed) if results else None
+    if picked:
+        encoder = None if picked["encoder"] == "libx265" else picked["encoder"]
+        return encoder, picked["preset"]
+    encoder = detect_hw_encoder_key()
+    return encoder, SPEED_PRESETS.get(encoder or "libx265", {}).get(speed)
+
+def speed_preset(encoder_key: Optional[str], speed: Optional[str]) -> Optional[str]:
+    """Return preset of an encoder for a speed, calibrated one if it was picked"""
+    if not speed:
+        return None
+    picked_encoder, preset = encoder_for_speed(speed)
+    if picked_encoder == encoder_key and preset:
+        return preset
+    return SPEED_PRESETS.get(encoder_key or "libx265", {}).get(speed)
+
+# How many encodes can run at once on each encoder. Consumer NVIDIA
+# cards limit the number of concurrent NVENC sessions, other GPU
+# encoders don't have a hard limit but slow down a lot when shared.
+ENCODER_MAX_JOBS = {
+    "nvenc": 5,
+    "qsv": 2,
+    "amf": 2,
+    "vaapi": 2,
+}
+
+def max_parallel_jobs(encoder_key: Optional[str]) -> int:
+    """
+    Return how many encodes can run at once with this encoder.
+
+    Args:
+        encoder_key (Optional[str]): Encoder to use for video encoding
+
+    Returns:
+        int: Maximum number of concurrent jobs
+    """
+    if encoder_key in ENCODER_MAX_JOBS:
+        return ENCODER_MAX_JOBS[encoder_key]
+
+    # libx265 already uses several threads per encode, so
+    # give each job about 4 cores instead of one job per core
+    return max(1, (os.cpu_count() or 1) // 4)
+
+def x265_threads(threads: int) -> str:
+    """Return x265 params for a thread budget, frame threads scale like x265's own defaults"""
+    if threads >= 32:
+        frame_threads = 6
+    elif threads >= 16:
+        frame_threads = 5
+    elif threads >= 8:
+        frame_threads = 3
+    elif threads >= 4:
+        frame_threads = 2
+    else:
+        frame_threads = 1
+    return f"pools={threads}:frame-threads={frame_threads}"
+
+def build_args(
+    encoder_key: Optional[str],
+    ten_bit: bool,
+    cq: Optional[int],
+    preset: Optional[str] = None,
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    profile: Optional[Profile] = None,
+):
     """
     Hardware accelerated argument builder for ffmpeg.
     
     Args:
         encoder_key (Optional[str]): Encoder to use for video encoding
         ten_bit (bool): Should we use 10-bit encoding?
-        cq (int): Constant quality, lower is better quality
+        cq (Optional[int]): Constant quality, lower is better quality,
+            DEFAULT_CQ or X265_CRF with libx265 if None
+        preset (Optional[str]): Encoder preset, picked by speed if None
+        speed (Optional[str]): One of SPEEDS, best quality preset if None
+        threads (Optional[int]): Threads a CPU encoder may use, all cores if None
+        profile (Optional[Profile]): Content profile of the file, changes CQ, preset and frame rate
     
     Returns:
         List[str]: Arguments to pass to ffmpeg
     """
-    
+    if cq is None:
+        cq = X265_CRF if encoder_key in (None, "libx265") else DEFAULT_CQ
+
+    if profile:
+        args = build_args(
+            encoder_key, ten_bit,
+            min(51, max(0, cq + profile.cq_offset)),
+            # Explicit preset wins over the one of the profile
+            preset or speed_preset(encoder_key, profile.speed),
+            speed, threads)
+        # Output option, only drops frames if the source has a higher rate
+        if profile.max_fps:
+            args += ["-fpsmax", str(profile.max_fps)]
+        return args
+
+    preset = preset or speed_preset(encoder_key, speed)
+
     if encoder_key == "nvenc":
         return [
             # This uses GPU if NVENC is detected
             "-c:v", "hevc_nvenc", 
             # NVENC preset, p7 is the slowest and best quality
-            "-preset", "p7",
+            "-preset", preset or "p7",
             # Tune to prefer quality over speed
             "-tune", "hq",
 
@@ -155,6 +421,29 @@ def build_args(encoder_key: Optional[str], ten_bit: bool, cq: int):
             # Pixel format
             "-pix_fmt", "p010le" if ten_bit else "yuv420p"
         ]
+    # Only picked by --speed when calibration finds it's worth it
+    elif encoder_key == "libx264":
+        return [
+            "-c:v", "libx264",
+            "-preset", preset or "slow",
+            # Constant rate factor, lower is better quality
+            "-crf", str(cq),
+            # 10bit H.264 doesn't play on most devices
+            "-pix_fmt", "yuv420p",
+            # Encoder threads, after -c:v so it's not taken as decoder threads
+            *(["-threads:v", str(threads)] if threads else []),
+        ]
+    elif encoder_key == "svtav1":
+        return [
+            "-c:v", "libsvtav1",
+            # 0 is the slowest, 13 the fastest
+            "-preset", preset or "5",
+            # AV1 CRF goes up to 63, scale it so CQ means about the same quality
+            "-crf", str(round(cq * 63 / 51)),
+            "-pix_fmt", "yuv420p10le" if ten_bit else "yuv420p",
+            # Logical processors SVT-AV1 may use
+            *(["-svtav1-params", f"lp={threads}"] if threads else []),
+        ]
     # Fallback to libx265 if no GPU encoder is detected
     # This is actually may be a little better than other
     # encoders, but CPUs are usually slower than GPUs so
@@ -163,9 +452,13 @@ def build_args(encoder_key: Optional[str], ten_bit: bool, cq: int):
         return [
             "-c:v", "libx265",
             # Very slow, best quality
-            "-preset", "veryslow",
-            "-crf", "24",
-            "-pix_fmt", "yuv420p10le" if ten_bit else "yuv420p"
+            "-preset", preset or "veryslow",
+            # Constant rate factor, lower is better quality
+            "-crf", str(cq),
+            "-pix_fmt", "yuv420p10le" if ten_bit else "yuv420p",
+            # Thread pool and frames encoded at once, by default every
+            # job uses all cores and parallel jobs slow each other down
+            *(["-x265-params", x265_threads(threads)] if threads else []),
         ]
 
 if __name__ == "__main__":
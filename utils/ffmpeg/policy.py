@@ -0,0 +1,58 @@
+from typing import Optional
+from .probe import get_video_stream, get_bitrate
+
+SKIP = "skip"
+REMUX = "remux"
+ENCODE = "encode"
+
+DEFAULT_POLICY = {
+    # Codecs that are already efficient, re-encoding
+    # them usually gives bigger files
+    "efficient_codecs": ("hevc", "av1"),
+    # Max video bitrate (bits/s) of efficient files we keep as is,
+    # same as the max bitrate of our NVENC settings
+    "max_bitrate": 3_000_000,
+    # Files with lower bitrate than this are kept as is, whatever the codec
+    "min_bitrate": 0,
+    # What to do with files that don't need re-encoding,
+    # remux copies streams to the output without encoding
+    "efficient_action": REMUX,
+}
+
+def decide(
+    info: dict,
+    target_resolution: Optional[str] = "1280x720",
+    policy: Optional[dict] = None,
+) -> tuple[str, str]:
+    """
+    Decide if a file should be skipped, remuxed or encoded.
+
+    Args:
+        info (dict): Probe result from probe()
+        target_resolution (Optional[str]): Target resolution for the output video
+        policy (Optional[dict]): Rules that override DEFAULT_POLICY
+
+    Returns:
+        tuple[str, str]: Action (SKIP, REMUX or ENCODE) and reason
+    """
+    policy = {**DEFAULT_POLICY, **(policy or {})}
+    stream = get_video_stream(info)
+    if stream is None:
+        return SKIP, "no video stream"
+
+    codec = stream.get("codec_name", "unknown")
+    width, height = int(stream.get("width", 0)), int(stream.get("height", 0))
+    bitrate = get_bitrate(info)
+    desc = f"{codec} {width}x{height} {bitrate // 1000} kb/s"
+
+    # Downscaling always needs an encode
+    if target_resolution:
+        tw, th = map(int, target_resolution.split("x"))
+        if width > tw or height > th:
+            return ENCODE, f"{desc} is bigger than {target_resolution}"
+
+    if bitrate and bitrate <= policy["min_bitrate"]:
+        return policy["efficient_action"], f"{desc} is already below minimum bitrate"
+    if codec in policy["efficient_codecs"] and 0 < bitrate <= policy["max_bitrate"]:
+        return policy["efficient_action"], f"{desc} is already efficient"
+    return ENCODE, desc
@@ -0,0 +1,106 @@
+import subprocess
+import threading
+import shutil
+import json
+import os
+
+from collections import OrderedDict
+from typing import Optional
+
+# Probe results by path, size and mtime, so every stage
+# can call probe() and the file is only probed once
+_probe_cache: OrderedDict[tuple[str, int, float], dict] = OrderedDict()
+_probe_cache_lock = threading.Lock()
+# Least recently used results are dropped above this, watch mode
+# runs for days and would otherwise keep every file it ever saw
+PROBE_CACHE_SIZE = 4096
+
+def probe(path: str) -> dict:
+    """
+    Return format and streams of a media file using ffprobe.
+
+    Results are cached until the file changes, the last
+    PROBE_CACHE_SIZE files are kept.
+
+    Args:
+        path (str): Path to the media file
+
+    Returns:
+        dict: Parsed ffprobe output with "format" and "streams"
+    """
+    st = os.stat(path)
+    key = (os.path.abspath(path), st.st_size, st.st_mtime)
+    with _probe_cache_lock:
+        if key in _probe_cache:
+            _probe_cache.move_to_end(key)
+            return _probe_cache[key]
+
+    if shutil.which("ffprobe") is None:
+        raise RuntimeError(
+            "ffprobe not found in PATH. "
+            "Please install ffmpeg from https://www.ffmpeg.org/download.html"
+        )
+
+    p = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_format", "-show_streams",
+        str(path)
+    ], capture_output=True, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {p.stderr.strip()}")
+    info = json.loads(p.stdout)
+    with _probe_cache_lock:
+        _probe_cache[key] = info
+        while len(_probe_cache) > PROBE_CACHE_SIZE:
+            _probe_cache.popitem(last=False)
+    return info
+
+def get_video_stream(info: dict) -> Optional[dict]:
+    """Return first video stream that is not a cover picture"""
+    for stream in info.get("streams", []):
+        if stream.get("codec_type") != "video":
+            continue
+        if stream.get("disposition", {}).get("attached_pic"):
+            continue
+        return stream
+    return None
+
+def get_duration(info: dict) -> float:
+    """Return duration in seconds, 0 if unknown"""
+    try:
+        return float(info.get("format", {}).get("duration", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+def get_bitrate(info: dict) -> int:
+    """Return video bitrate in bits/s, uses overall bitrate if unknown"""
+    stream = get_video_stream(info) or {}
+    for value in (stream.get("bit_rate"), info.get("format", {}).get("bit_rate")):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return 0
+
+def count_video_frames(path: str) -> int:
+    """
+    Count frames of the first video stream.
+
+    Counts packets instead of decoding frames, this only
+    demuxes the file so its fast even for big files.
+    """
+    p = subprocess.run([
+        "ffprobe", "-v", "error",
+        "-select_streams", "v:0",
+        "-count_packets",
+        "-show_entries", "stream=nb_read_packets",
+        "-of", "csv=p=0",
+        str(path)
+    ], capture_output=True, text=True)
+    if p.returncode != 0:
+        raise RuntimeError(f"ffprobe failed for {path}: {p.stderr.strip()}")
+    try:
+        return int(p.stdout.strip().split(",")[0])
+    except ValueError:
+        return 0
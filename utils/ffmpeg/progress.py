@@ -0,0 +1,126 @@
+import os
+import time
+import threading
+
+from typing import Callable, NamedTuple, Optional
+from utils.logger import prinfo
+
+class Progress(NamedTuple):
+    """One progress update from ffmpeg -progress"""
+    frame: int
+    fps: float
+    bitrate: float
+    out_time: float
+    speed: float
+    done: bool
+
+ProgressCallback = Callable[[Progress], None]
+
+def _float(value: Optional[str]) -> float:
+    # ffmpeg reports "N/A" before the first frame
+    try:
+        return float(value.rstrip("xkbits/s")) if value else 0.0
+    except ValueError:
+        return 0.0
+
+class ProgressParser:
+    """
+    Parser of ffmpeg's -progress output.
+
+    ffmpeg writes key=value lines and ends every block with
+    progress=continue or progress=end, so we only keep the
+    values until the end of the block.
+    """
+    def __init__(self):
+        self.values: dict[str, str] = {}
+
+    def feed(self, line: str) -> Optional[Progress]:
+        """Feed one line, returns Progress when a block is complete"""
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return None
+        if key != "progress":
+            self.values[key] = value
+            return None
+
+        v = self.values
+        self.values = {}
+        # out_time_ms is actually in microseconds too
+        out_time = v.get("out_time_us") or v.get("out_time_ms")
+        return Progress(
+            frame=int(_float(v.get("frame"))),
+            fps=_float(v.get("fps")),
+            bitrate=_float(v.get("bitrate")),
+            out_time=max(0.0, _float(out_time) / 1_000_000),
+            speed=_float(v.get("speed")),
+            done=value == "end",
+        )
+
+def eta(remaining: float, speed: float) -> str:
+    """Format remaining media seconds at speed as time left"""
+    if speed <= 0:
+        return "?"
+    seconds = int(remaining / speed)
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    return f"{h}:{m:02d}:{s:02d}"
+
+class BatchProgress:
+    """
+    Prints progress of every file and ETA of the whole batch.
+
+    Args:
+        total_duration (float): Sum of durations of all files (seconds),
+            files can also be added later with add()
+        interval (float): Print progress of a file at most this often
+    """
+    def __init__(self, total_duration: float = 0.0, interval: float = 5.0):
+        self.total_duration = total_duration
+        self.interval = interval
+        self.start_time = time.time()
+        self.finished_duration = 0.0
+        self.running: dict[str, float] = {}
+        self._last_print: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def callback(self, name: str, duration: float) -> ProgressCallback:
+        """Return progress callback for one file, name is its path"""
+        def on_progress(p: Progress):
+            with self._lock:
+                self.running[name] = min(p.out_time, duration) if duration else p.out_time
+                now = time.time()
+                if p.done or now - self._last_print.get(name, 0) < self.interval:
+                    return
+                self._last_print[name] = now
+                batch = self._batch_status(now)
+            percent = f"{p.out_time / duration * 100:.1f}%" if duration else "?%"
+            prinfo(f"Progress: {os.path.basename(name)} {percent} "
+                f"{p.fps:.1f} fps {p.speed:.2f}x "
+                f"ETA {eta(duration - p.out_time, p.speed)}{batch}")
+        return on_progress
+
+    def add(self, duration: float):
+        """Add a file to the batch"""
+        with self._lock:
+            self.total_duration += duration
+
+    def finish(self, name: str, duration: float):
+        """Mark file as done"""
+        with self._lock:
+            self.running.pop(name, None)
+            self._last_print.pop(name, None)
+            self.finished_duration += duration
+
+    def skip(self, duration: float):
+        """Remove skipped file from the batch, so it doesn't change ETA"""
+        with self._lock:
+            self.total_duration = max(0.0, self.total_duration - duration)
+
+    def _batch_status(self, now: float) -> str:
+        if not self.total_duration:
+            return ""
+        done = self.finished_duration + sum(self.running.values())
+        elapsed = now - self.start_time
+        speed = done / elapsed if elapsed > 0 else 0
+        return (f" | Batch {done / self.total_duration * 100:.1f}% "
+            f"ETA {eta(self.total_duration - done, speed)}")
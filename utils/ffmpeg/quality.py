@@ -0,0 +1,97 @@
+import re
+import subprocess
+
+from typing import Optional
+from .probe import probe, get_duration
+from .target import sample_windows
+from utils.logger import prdebug
+
+# Windows are compared at the output resolution, the source is scaled to it
+QUALITY_FILTER = (
+    "[0:v]setpts=PTS-STARTPTS[out];"
+    "[1:v]setpts=PTS-STARTPTS[src];"
+    "[src][out]scale2ref=flags=bicubic[ref][dist];"
+    "[dist]format=yuv420p,split[dist1][dist2];"
+    "[ref]format=yuv420p,split[ref1][ref2];"
+    "[dist1][ref1]ssim;"
+    "[dist2][ref2]psnr"
+)
+
+def parse_scores(output: str) -> tuple[Optional[float], Optional[float]]:
+    """Return SSIM and PSNR from ffmpeg ssim and psnr filter logs"""
+    ssim = re.search(r"SSIM .*All:([\d.]+)", output)
+    psnr = re.search(r"PSNR .*average:([\d.]+|inf)", output)
+    return (
+        float(ssim.group(1)) if ssim else None,
+        # Identical frames have infinite PSNR
+        float(psnr.group(1)) if psnr else None,
+    )
+
+def measure_window(
+    source_path: str,
+    output_path: str,
+    start: float,
+    length: float = 2.0,
+    threads: Optional[int] = None,
+) -> tuple[float, float]:
+    """
+    Compare one window of the output to the same window of the source.
+
+    Returns:
+        tuple[float, float]: SSIM (1.0 is identical) and PSNR (dB)
+    """
+    window = ["-ss", f"{start:.3f}", "-t", f"{length:.3f}"]
+    args = [
+        "ffmpeg", "-hide_banner", "-nostats", "-loglevel", "info",
+        # Seeking before the input only decodes from the nearest keyframe
+        *window, "-i", output_path,
+        *window, "-i", source_path,
+    ]
+    if threads:
+        args += ["-filter_complex_threads", str(threads), "-threads", str(threads)]
+    args += ["-filter_complex", QUALITY_FILTER, "-f", "null", "-"]
+    p = subprocess.run(args, capture_output=True, text=True)
+    ssim, psnr = parse_scores(p.stderr)
+    if p.returncode != 0 or ssim is None or psnr is None:
+        raise RuntimeError(f"Failed to measure quality of {output_path} at {start:.1f}s")
+    return ssim, psnr
+
+def check_quality(
+    source_path: str,
+    output_path: str,
+    windows: int = 5,
+    length: float = 2.0,
+    min_ssim: float = 0.9,
+    threads: Optional[int] = None,
+    duration: Optional[float] = None,
+) -> dict:
+    """
+    Compare short windows of the output to the source, a full
+    comparison would take about as long as the encode.
+
+    Args:
+        source_path (str): Path to the source video
+        output_path (str): Path to the converted video
+        windows (int): Number of windows, evenly spaced
+        length (float): Length of every window (seconds)
+        min_ssim (float): Lowest SSIM every window must have
+        threads (Optional[int]): Threads of the filters, all cores if None
+        duration (Optional[float]): Duration of the source, probed if None
+
+    Returns:
+        dict: ssim and psnr of the worst window, all windows and if they passed
+    """
+    if not duration:
+        duration = get_duration(probe(source_path))
+    scores = []
+    # Videos shorter than all windows are compared whole
+    for start, window in sample_windows(duration, windows, length):
+        ssim, psnr = measure_window(source_path, output_path, start, window, threads)
+        prdebug(f"Quality at {start:.1f}s: SSIM {ssim:.4f}, PSNR {psnr:.2f} dB: {output_path}")
+        scores.append({"start": start, "ssim": ssim, "psnr": psnr})
+    return {
+        "ssim": min(s["ssim"] for s in scores),
+        "psnr": min(s["psnr"] for s in scores),
+        "windows": scores,
+        "passed": all(s["ssim"] >= min_ssim for s in scores),
+    }
@@ -0,0 +1,144 @@
+import os
+
+from typing import Optional
+from .probe import get_video_stream
+
+# Audio encoders by codec name, Opus has better quality at the same
+# bitrate, but its not supported on all devices, so AAC is the default
+AUDIO_ENCODERS = {
+    "aac": "aac",
+    "opus": "libopus",
+}
+
+# Audio codecs that are as good as or better than the key,
+# these are copied if their bitrate is not higher than the target
+AUDIO_AT_LEAST = {
+    "aac": ("aac", "opus"),
+    "opus": ("opus",),
+}
+
+# Subtitles that can be converted to mov_text, picture based
+# subtitles (PGS, VobSub) can't be stored in MP4 at all
+TEXT_SUBTITLES = ("subrip", "srt", "ass", "ssa", "webvtt", "mov_text", "text")
+
+MP4_CONTAINERS = (".mp4", ".mov", ".m4v")
+MKV_CONTAINERS = (".mkv",)
+
+# Audio codecs every container can store, audio is copied only into
+# these, other containers always get re-encoded audio
+CONTAINER_AUDIO = {
+    ".mkv": ("aac", "opus"),
+    ".mp4": ("aac", "opus"),
+    ".mov": ("aac",),
+    ".m4v": ("aac",),
+    ".avi": ("aac",),
+    ".flv": ("aac",),
+    ".wmv": ("aac",),
+}
+
+def parse_bitrate(value: str) -> int:
+    """Parse bitrate like "96k" or "3M" to bits/s"""
+    value = value.strip().lower()
+    multiplier = {"k": 1000, "m": 1000**2}.get(value[-1:], 1)
+    return int(float(value.rstrip("km")) * multiplier)
+
+def stream_bitrate(stream: dict) -> int:
+    """Return bitrate of a stream, MKV stores it in tags"""
+    tags = {k.upper(): v for k, v in stream.get("tags", {}).items()}
+    for value in (stream.get("bit_rate"), tags.get("BPS"), tags.get("BPS-ENG")):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            continue
+    return 0
+
+def audio_action(
+    stream: dict,
+    audio_codec: str = "aac",
+    audio_bitrate: str = "96k",
+    container: Optional[str] = None,
+) -> str:
+    """
+    Return copy if audio stream is already good enough, else encode.
+
+    Args:
+        stream (dict): Audio stream from probe()
+        audio_codec (str): Codec for re-encoded audio, "aac" or "opus"
+        audio_bitrate (str): Bitrate of re-encoded audio
+        container (Optional[str]): Extension of the output, like ".mkv",
+            audio is only copied if the container can store its codec
+    """
+    codec = stream.get("codec_name", "")
+    bitrate = stream_bitrate(stream)
+    if container is not None and codec not in CONTAINER_AUDIO.get(container, ()):
+        return "encode"
+    if codec in AUDIO_AT_LEAST.get(audio_codec, (audio_codec,)):
+        if 0 < bitrate <= parse_bitrate(audio_bitrate) * 1.1:
+            return "copy"
+    return "encode"
+
+def stream_args(
+    info: dict,
+    output_path: str,
+    audio_codec: str = "aac",
+    audio_bitrate: str = "96k",
+    input_index: int = 0,
+    map_video: bool = True,
+) -> list[str]:
+    """
+    Build -map and codec arguments for every stream of the input.
+
+    Audio is copied when its codec and bitrate are already at or
+    below the target and the container can store it, and re-encoded
+    otherwise. Subtitles and attachments are kept when the output
+    container can store them.
+
+    Args:
+        info (dict): Probe result of the input from probe()
+        output_path (str): Output path, its extension decides the container
+        audio_codec (str): Codec for re-encoded audio, "aac" or "opus"
+        audio_bitrate (str): Bitrate of re-encoded audio
+        input_index (int): Index of the input in the ffmpeg command
+        map_video (bool): Map main video stream, it's mapped by the caller if False
+
+    Returns:
+        list[str]: Arguments to pass to ffmpeg
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    args = []
+    video = get_video_stream(info)
+    if map_video and video is not None:
+        args += ["-map", f"{input_index}:{video['index']}"]
+
+    audio = subtitles = attachments = 0
+    for stream in info.get("streams", []):
+        index = f"{input_index}:{stream['index']}"
+        kind = stream.get("codec_type")
+
+        if kind == "audio":
+            args += ["-map", index]
+            if audio_action(stream, audio_codec, audio_bitrate, ext) == "copy":
+                args += [f"-c:a:{audio}", "copy"]
+            else:
+                args += [f"-c:a:{audio}", AUDIO_ENCODERS.get(audio_codec, audio_codec),
+                         f"-b:a:{audio}", audio_bitrate]
+            audio += 1
+
+        elif kind == "subtitle":
+            codec = stream.get("codec_name", "")
+            if ext in MKV_CONTAINERS:
+                args += ["-map", index, f"-c:s:{subtitles}", "copy"]
+            elif ext in MP4_CONTAINERS and codec in TEXT_SUBTITLES:
+                args += ["-map", index, f"-c:s:{subtitles}", "mov_text"]
+            else:
+                continue
+            subtitles += 1
+
+        elif kind == "attachment" and ext in MKV_CONTAINERS:
+            # Fonts for ASS subtitles are stored as attachments
+            args += ["-map", index]
+            attachments += 1
+
+    if attachments:
+        args += ["-c:t", "copy"]
+    return args
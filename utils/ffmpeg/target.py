@@ -0,0 +1,151 @@
+import os
+import math
+import shutil
+import tempfile
+
+from typing import Optional
+from .core import Profile
+from .probe import probe, get_duration
+from .transcoder import build_command, run_ffmpeg
+from .streams import parse_bitrate
+from utils.logger import prdebug, prwarn
+
+# Range of CQ values we can pick from
+CQ_RANGE = (14, 45)
+
+def target_video_bitrate(
+    duration: float,
+    target_size: Optional[int] = None,
+    target_bitrate: Optional[int] = None,
+    audio_bitrate: str = "96k",
+) -> int:
+    """
+    Return video bitrate (bits/s) needed to hit the target.
+
+    Args:
+        duration (float): Duration of the video (seconds)
+        target_size (Optional[int]): Target output size (bytes)
+        target_bitrate (Optional[int]): Target average bitrate (bits/s)
+        audio_bitrate (str): Bitrate of the audio, it is taken from the target
+    """
+    if target_size is not None:
+        if duration <= 0:
+            raise ValueError("Duration is needed for target size")
+        target_bitrate = int(target_size * 8 / duration)
+    if target_bitrate is None:
+        raise ValueError("Either target size or target bitrate is needed")
+    return max(1, target_bitrate - parse_bitrate(audio_bitrate))
+
+def sample_windows(duration: float, samples: int, length: float) -> list[tuple[float, float]]:
+    """Return (start, length) of samples spread evenly across the video"""
+    if duration <= length * samples:
+        return [(0.0, duration)]
+    step = duration / samples
+    return [(step * i + (step - length) / 2, length) for i in range(samples)]
+
+def fit_cq(
+    input_path: str,
+    hw: Optional[str],
+    target_size: Optional[int] = None,
+    target_bitrate: Optional[int] = None,
+    ten_bit: bool = True,
+    audio_bitrate: str = "96k",
+    target_resolution: str = "1280x720",
+    samples: int = 3,
+    sample_length: float = 4.0,
+    start_cq: int = 28,
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    cpus: Optional[list[int]] = None,
+    profile: Optional[Profile] = None,
+) -> int:
+    """
+    Find CQ that gives the target size or bitrate.
+
+    Short samples spread across the file are encoded, bitrate
+    is about exponential in CQ, so log(bitrate) is fitted as
+    a line through the sample encodes and solved for the target.
+
+    Args:
+        input_path (str): Path to the input video file
+        hw (Optional[str]): Encoder key from detect_hw_encoder_key
+        target_size (Optional[int]): Target output size (bytes)
+        target_bitrate (Optional[int]): Target average bitrate (bits/s)
+        ten_bit (bool): Should we use 10-bit encoding?
+        audio_bitrate (str): Bitrate of the audio
+        target_resolution (str): Target resolution for the output video
+        samples (int): Number of samples to encode
+        sample_length (float): Length of every sample (seconds)
+        start_cq (int): First CQ to try
+        speed (Optional[str]): Speed/size trade-off, must match the full encode
+        threads (Optional[int]): Threads ffmpeg may use, all cores if None
+        cpus (Optional[list[int]]): Run ffmpeg only on these CPUs
+        profile (Optional[Profile]): Content profile, must match the full encode,
+            returned CQ is before its offset
+
+    Returns:
+        int: CQ to use for the full encode, start_cq if the duration is unknown
+    """
+    duration = get_duration(probe(input_path))
+    if duration <= 0:
+        # Nothing to spread samples over, or to divide the target size by
+        prwarn(f"Unknown duration of {input_path}, using CQ {start_cq}")
+        return start_cq
+    target = target_video_bitrate(duration, target_size, target_bitrate, audio_bitrate)
+    windows = sample_windows(duration, samples, sample_length)
+    tmp_dir = tempfile.mkdtemp(prefix=".samples-")
+
+    def sample_bitrate(cq: int) -> float:
+        total_bytes, total_length = 0, 0.0
+        for i, (start, length) in enumerate(windows):
+            path = os.path.join(tmp_dir, f"sample_{i}.mkv")
+            run_ffmpeg(build_command(
+                input_path, path, hw,
+                ten_bit=ten_bit,
+                audio_bitrate=None,
+                cq=cq,
+                target_resolution=target_resolution,
+                start=start,
+                length=length,
+                speed=speed,
+                threads=threads,
+                profile=profile,
+            ), cpus=cpus)
+            total_bytes += os.path.getsize(path)
+            total_length += length
+            os.remove(path)
+        bitrate = total_bytes * 8 / total_length
+        prdebug(f"Sample CQ {cq}: {bitrate / 1000:.0f} kb/s (target {target / 1000:.0f} kb/s)")
+        return bitrate
+
+    def clamp(cq: float) -> int:
+        return int(min(CQ_RANGE[1], max(CQ_RANGE[0], round(cq))))
+
+    try:
+        # Two points are enough for the first guess, a third one
+        # near the guess corrects the slope for this content
+        points = [(start_cq, sample_bitrate(start_cq))]
+        second = clamp(start_cq + (6 if points[0][1] > target else -6))
+        points.append((second, sample_bitrate(second)))
+        for _ in range(2):
+            (cq1, b1), (cq2, b2) = points[-2], points[-1]
+            if b1 <= 0 or b2 <= 0 or cq1 == cq2 or b1 == b2:
+                break
+            slope = (math.log(b2) - math.log(b1)) / (cq2 - cq1)
+            guess = clamp(cq2 + (math.log(target) - math.log(b2)) / slope)
+            if guess in (cq for cq, _ in points):
+                break
+            points.append((guess, sample_bitrate(guess)))
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # Pick the best quality that is still at or below the target
+    under = [cq for cq, bitrate in points if bitrate <= target]
+    best = min(under) if under else max(cq for cq, _ in points)
+    if not under and best < CQ_RANGE[1]:
+        # Even the highest CQ we tried is too big, extrapolate from it
+        (cq1, b1), (cq2, b2) = sorted(points)[-2:]
+        if b1 > b2 > 0:
+            slope = (math.log(b2) - math.log(b1)) / (cq2 - cq1)
+            best = clamp(cq2 + (math.log(target) - math.log(b2)) / slope)
+    return best
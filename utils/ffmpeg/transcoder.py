@@ -1,50 +1,77 @@
 import subprocess
+import threading
+import tempfile
 import shlex
 import shutil
-from .core import detect_hw_encoder_key, build_args
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple, Optional
+from .core import (
+    detect_hw_encoder_key, encoder_for_speed, build_args, max_parallel_jobs, ENCODER_MAX_JOBS,
+    Profile,
+)
+from .probe import probe, get_duration, count_video_frames
+from .progress import ProgressParser, ProgressCallback, Progress
+from .streams import stream_args, AUDIO_ENCODERS
+from utils.cpu import pin_process, thread_budget
 from utils.logger import prwarn, prdebug
 
-def transcode(
-    input_path: str,
-    output_path: str,
-    ten_bit: bool = True,
-    audio_bitrate: str = "96k",
-    overwrite: bool = True,
-    prefer_gpu: bool = True,
-    cq: int = 19,
-    target_resolution: str = "1280x720",
-):
-    """
-    Transcodes a video file using ffmpeg from one format to another.
-
-    Args:
-        input_path (str): Path to the input video file
-        output_path (str): Path to the output video file
-        ten_bit (bool): Should we use 10-bit encoding?
-        audio_bitrate (str): Bitrate of the audio, "96k" is the default
-        overwrite (bool): Should we overwrite output file if it exists?
-        prefer_gpu (bool): Should we use the GPU for encoding?
-        cq (int): Constant quality, lower is better quality
-        target_resolution (str): Target resolution for the output video
-    """
-    # Check if ffmpeg is in PATH
+def check_ffmpeg():
+    """Check if ffmpeg is in PATH"""
     if shutil.which("ffmpeg") is None:
         raise RuntimeError(
             "ffmpeg not found in PATH. "
             "Please install ffmpeg from https://www.ffmpeg.org/download.html"
         )
 
-    # Check if NVENC is available
+def get_encoder(prefer_gpu: bool = True, speed: Optional[str] = None) -> Optional[str]:
+    """Return encoder key, picked by calibration if speed is given, None is libx265"""
+    if speed:
+        hw, _ = encoder_for_speed(speed)
+        # Calibration may pick a CPU encoder, but never a GPU one if we shouldn't use it
+        if not prefer_gpu and hw in ENCODER_MAX_JOBS:
+            hw = None
+        prdebug(f"Using encoder for {speed} speed: {hw or 'libx265'}")
+        return hw
     hw = detect_hw_encoder_key() if prefer_gpu else None
     if hw:
         prdebug(f"Using hardware encoder: {hw}")
     else:
         prwarn("No hardware HEVC encoder detected, using libx265 instead")
+    return hw
 
-    # Build ffmpeg arguments based on if hardware acceleration is available
-    video_args = build_args(hw, ten_bit, cq)
+# Encodes running at once in this process for every encoder, parallel jobs
+# and chunks share them so together they stay within max_parallel_jobs
+_sessions: dict[Optional[str], threading.BoundedSemaphore] = {}
+_sessions_lock = threading.Lock()
+
+def encoder_sessions(hw: Optional[str]) -> threading.BoundedSemaphore:
+    """Return semaphore of encodes that can still start with an encoder"""
+    with _sessions_lock:
+        if hw not in _sessions:
+            _sessions[hw] = threading.BoundedSemaphore(max_parallel_jobs(hw))
+        return _sessions[hw]
+
+class Rendition(NamedTuple):
+    """One output of a multi-rendition encode"""
+    resolution: str
+    cq: int
+    suffix: str
 
-    # Build ffmpeg command
+def rendition_path(output_path: str, suffix: str) -> str:
+    """Add rendition suffix to the output file name"""
+    name, ext = os.path.splitext(output_path)
+    return f"{name}{suffix}{ext}"
+
+def input_args(
+    input_path: str,
+    hw: Optional[str],
+    overwrite: bool = True,
+    start: Optional[float] = None,
+    length: Optional[float] = None,
+    threads: Optional[int] = None,
+) -> list[str]:
+    """Build start of ffmpeg command, up to and including the input"""
     args = [
         "ffmpeg",
         # Do we need to overwrite the output file if it exists?
@@ -66,42 +93,606 @@ def transcode(
     elif hw == "vaapi":
         args += ["-hwaccel", "vaapi"]
 
-    # Set input path and target resolution, force_original_aspect_ratio
-    # ensures that video wont be distorted by stretching
-    args += ["-i", str(input_path)]
+    # Decoding and filtering threads, so parallel jobs share the cores
+    if threads:
+        args += ["-filter_threads", str(threads), "-filter_complex_threads", str(threads)]
+        args += ["-threads", str(threads)]
+
+    # Seeking before the input is fast, it jumps to the nearest keyframe
+    if start is not None:
+        args += ["-ss", f"{start:.3f}"]
+    if length is not None:
+        args += ["-t", f"{length:.3f}"]
+
+    return args + ["-i", str(input_path)]
+
+def scale_filter(hw: Optional[str], ten_bit: bool, target_resolution: Optional[str]) -> str:
+    """Return video filter that scales to target resolution"""
     if hw == "vaapi":
         # VAAPI filter chain (10-bit p010 or 8-bit nv12)
         va_fmt = "p010" if ten_bit else "nv12"
-        w, h = map(int, target_resolution.split("x"))
-        vf_chain = f"format={va_fmt},hwupload,scale_vaapi=w={w}:h={h}:force_original_aspect_ratio=decrease"
-        args += ["-vf", vf_chain]
-    elif target_resolution:
-        # CPU-based scale for other encoders
-        args += ["-vf", f"scale={target_resolution}:force_original_aspect_ratio=decrease"]
+        vf_chain = f"format={va_fmt},hwupload"
+        if target_resolution:
+            w, h = map(int, target_resolution.split("x"))
+            vf_chain += f",scale_vaapi=w={w}:h={h}:force_original_aspect_ratio=decrease"
+        return vf_chain
+    # CPU-based scale for other encoders
+    return f"scale={target_resolution}:force_original_aspect_ratio=decrease"
+
+def build_command(
+    input_path: str,
+    output_path: str,
+    hw: Optional[str],
+    ten_bit: bool = True,
+    audio_bitrate: Optional[str] = "96k",
+    overwrite: bool = True,
+    cq: Optional[int] = None,
+    target_resolution: str = "1280x720",
+    preset: Optional[str] = None,
+    start: Optional[float] = None,
+    length: Optional[float] = None,
+    streams: Optional[dict] = None,
+    audio_codec: str = "aac",
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    profile: Optional[Profile] = None,
+) -> list[str]:
+    """
+    Build ffmpeg command for transcoding one file.
+
+    Args:
+        input_path (str): Path to the input video file
+        output_path (str): Path to the output video file
+        hw (Optional[str]): Encoder key from detect_hw_encoder_key
+        ten_bit (bool): Should we use 10-bit encoding?
+        audio_bitrate (Optional[str]): Bitrate of the audio, None drops audio
+        overwrite (bool): Should we overwrite output file if it exists?
+        cq (Optional[int]): Constant quality, lower is better quality, see build_args
+        target_resolution (str): Target resolution for the output video
+        preset (Optional[str]): Encoder preset, best quality preset if None
+        start (Optional[float]): Start encoding from this time (seconds)
+        length (Optional[float]): Encode only this many seconds
+        streams (Optional[dict]): Probe result of the input, if given all audio,
+            subtitle and attachment streams are kept by stream_args
+        audio_codec (str): Codec for re-encoded audio, "aac" or "opus"
+        speed (Optional[str]): Speed/size trade-off that picks the preset, see SPEEDS
+        threads (Optional[int]): Threads for decoding, filtering and CPU encoding
+        profile (Optional[Profile]): Content profile of the file, see build_args
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    # Build ffmpeg arguments based on if hardware acceleration is available
+    video_args = build_args(hw, ten_bit, cq, preset, speed, threads, profile)
+
+    args = input_args(input_path, hw, overwrite, start, length, threads)
+    # Set target resolution, force_original_aspect_ratio
+    # ensures that video wont be distorted by stretching
+    if hw == "vaapi" or target_resolution:
+        args += ["-vf", scale_filter(hw, ten_bit, target_resolution)]
 
     # Video arguments that were built earlier
     args += video_args
     # Audio arguments, "libopus" (Opus) is better at compression and has better quality,
     # but its usually not packaged with all devices, "aac" (AAC) can also be used as fallback
-    args += ["-c:a", "aac", "-b:a", audio_bitrate, str(output_path)]
+    if not audio_bitrate:
+        args += ["-an"]
+    elif streams is not None:
+        args += stream_args(streams, str(output_path), audio_codec, audio_bitrate)
+    else:
+        args += ["-c:a", AUDIO_ENCODERS.get(audio_codec, audio_codec), "-b:a", audio_bitrate]
+    args += [str(output_path)]
+    return args
 
-    # Finally, run ffmpeg
+def build_rendition_command(
+    input_path: str,
+    output_path: str,
+    hw: Optional[str],
+    renditions: list[Rendition],
+    ten_bit: bool = True,
+    audio_bitrate: Optional[str] = "96k",
+    overwrite: bool = True,
+    preset: Optional[str] = None,
+    streams: Optional[dict] = None,
+    audio_codec: str = "aac",
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    profile: Optional[Profile] = None,
+) -> list[str]:
+    """
+    Build ffmpeg command that encodes all renditions at once.
+
+    Input is read and decoded once, the decoded video is split
+    in the filter graph and every branch is scaled and encoded
+    to its own output.
+
+    Args:
+        input_path (str): Path to the input video file
+        output_path (str): Output path, rendition suffix is added to it
+        hw (Optional[str]): Encoder key from detect_hw_encoder_key
+        renditions (list[Rendition]): Outputs to produce
+        ten_bit (bool): Should we use 10-bit encoding?
+        audio_bitrate (Optional[str]): Bitrate of the audio, None drops audio
+        overwrite (bool): Should we overwrite output files if they exist?
+        preset (Optional[str]): Encoder preset, best quality preset if None
+        streams (Optional[dict]): Probe result of the input, see build_command
+        audio_codec (str): Codec for re-encoded audio, "aac" or "opus"
+        speed (Optional[str]): Speed/size trade-off that picks the preset, see SPEEDS
+        threads (Optional[int]): Threads for decoding and filtering, split
+            between renditions for CPU encoding
+        profile (Optional[Profile]): Content profile of the file, applied to every rendition
+
+    Returns:
+        list[str]: ffmpeg command
+    """
+    args = input_args(input_path, hw, overwrite, threads=threads)
+    # Every rendition has its own encoder running at the same time
+    encoder_threads = max(1, threads // len(renditions)) if threads else None
+
+    # VAAPI uploads frames once before they are split
+    n = len(renditions)
+    graph = f"[0:v]{scale_filter(hw, ten_bit, None) + ',' if hw == 'vaapi' else ''}split={n}"
+    graph += "".join(f"[s{i}]" for i in range(n))
+    for i, rendition in enumerate(renditions):
+        scale = scale_filter(hw, ten_bit, rendition.resolution)
+        if hw == "vaapi":
+            # Frames are already uploaded, only scale here
+            scale = scale.split(",", 2)[-1]
+        graph += f";[s{i}]{scale}[v{i}]"
+    args += ["-filter_complex", graph]
+
+    for i, rendition in enumerate(renditions):
+        path = rendition_path(str(output_path), rendition.suffix)
+        args += ["-map", f"[v{i}]"]
+        args += build_args(hw, ten_bit, rendition.cq, preset, speed, encoder_threads, profile)
+        if not audio_bitrate:
+            args += ["-an"]
+        elif streams is not None:
+            args += stream_args(streams, path, audio_codec, audio_bitrate, map_video=False)
+        else:
+            args += ["-map", "0:a?",
+                     "-c:a", AUDIO_ENCODERS.get(audio_codec, audio_codec), "-b:a", audio_bitrate]
+        args += [path]
+    return args
+
+def output_state(path: Optional[str]) -> Optional[tuple]:
+    """
+    Return inode, size and mtime of an output, None if it doesn't exist.
+    An output whose state didn't change during a failed run was not
+    written by it and must not be removed.
+    """
+    try:
+        st = os.stat(path)
+    except (OSError, TypeError):
+        return None
+    return st.st_ino, st.st_size, st.st_mtime_ns
+
+def run_ffmpeg(
+    args: list[str],
+    on_progress: Optional[ProgressCallback] = None,
+    cpus: Optional[list[int]] = None,
+):
+    """
+    Run ffmpeg command and print its output as debug.
+
+    Args:
+        args (list[str]): ffmpeg command
+        on_progress (Optional[ProgressCallback]): Called with every progress update
+        cpus (Optional[list[int]]): Run ffmpeg only on these CPUs
+    """
+    # Machine readable progress goes to stdout, logs stay on stderr
+    args = [args[0], "-progress", "pipe:1", "-nostats", *args[1:]]
     prdebug(f"Running ffmpeg: {' '.join(shlex.quote(a) for a in args if a)}")
     proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
                             text=True, bufsize=1, universal_newlines=True)
-    
-    # Print ffmpeg's output as debug
+    # ffmpeg starts its threads after opening the input, they inherit this
+    pin_process(proc.pid, cpus)
+
+    # Print ffmpeg's output as debug, in a thread so
+    # neither of the pipes can fill up and block ffmpeg
+    def read_stderr():
+        for line in proc.stderr:
+            prdebug(line.rstrip("\r\n"))
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    parser = ProgressParser()
     try:
-        if proc.stderr:
-            for line in proc.stderr:
-                prdebug(line.rstrip("\r\n"))
-    except KeyboardInterrupt:
+        for line in proc.stdout:
+            progress = parser.feed(line)
+            if progress and on_progress:
+                on_progress(progress)
+    except BaseException:
+        # Interrupted, or on_progress raised to cancel the encode
         proc.terminate()
         raise
     finally:
         proc.wait()
+        stderr_thread.join()
     if proc.returncode != 0:
         raise RuntimeError(f"ffmpeg failed with return code {proc.returncode}")
 
+def transcode(
+    input_path: str,
+    output_path: str,
+    ten_bit: bool = True,
+    audio_bitrate: str = "96k",
+    overwrite: bool = True,
+    prefer_gpu: bool = True,
+    cq: Optional[int] = None,
+    target_resolution: str = "1280x720",
+    chunk_min_size: Optional[int] = None,
+    chunk_min_duration: Optional[float] = None,
+    chunks: Optional[int] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    renditions: Optional[list[Rendition]] = None,
+    audio_codec: str = "aac",
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    cpus: Optional[list[int]] = None,
+    profile: Optional[Profile] = None,
+):
+    """
+    Transcodes a video file using ffmpeg from one format to another.
+
+    Args:
+        input_path (str): Path to the input video file
+        output_path (str): Path to the output video file
+        ten_bit (bool): Should we use 10-bit encoding?
+        audio_bitrate (str): Bitrate of the audio, "96k" is the default
+        overwrite (bool): Should we overwrite output file if it exists?
+        prefer_gpu (bool): Should we use the GPU for encoding?
+        cq (Optional[int]): Constant quality, lower is better quality, see build_args
+        target_resolution (str): Target resolution for the output video
+        chunk_min_size (Optional[int]): Encode in chunks if file is bigger (bytes)
+        chunk_min_duration (Optional[float]): Encode in chunks if file is longer (seconds)
+        chunks (Optional[int]): Number of chunks, picked by encoder if None
+        on_progress (Optional[ProgressCallback]): Called with every progress update
+        renditions (Optional[list[Rendition]]): Encode all of these in one pass,
+            target_resolution and cq are ignored and outputs are named with
+            rendition_path, list of output paths is returned
+        audio_codec (str): Codec for audio that can't be copied, "aac" or "opus"
+        speed (Optional[str]): Speed/size trade-off that picks encoder and preset,
+            see SPEEDS, detected encoder at best quality if None
+        threads (Optional[int]): Threads ffmpeg may use, all cores if None
+        cpus (Optional[list[int]]): Run ffmpeg only on these CPUs
+        profile (Optional[Profile]): Content profile that changes CQ, preset and frame rate
+    """
+    check_ffmpeg()
+
+    # Audio, subtitles and attachments are mapped from the probe result,
+    # fall back to first audio stream if the input can't be probed
+    try:
+        streams = probe(input_path)
+    except RuntimeError:
+        streams = None
+
+    # Every rendition is encoded from the same decoded frames
+    if renditions:
+        hw = get_encoder(prefer_gpu, speed)
+        with encoder_sessions(hw):
+            run_ffmpeg(build_rendition_command(
+                input_path, output_path, hw, renditions,
+                ten_bit=ten_bit,
+                audio_bitrate=audio_bitrate,
+                overwrite=overwrite,
+                streams=streams,
+                audio_codec=audio_codec,
+                speed=speed,
+                threads=threads,
+                profile=profile,
+            ), on_progress, cpus)
+
+        outputs = [rendition_path(output_path, r.suffix) for r in renditions]
+        prdebug(f"Done: {', '.join(outputs)}")
+        return outputs
+
+    # Big files are split into chunks that are encoded in parallel
+    if should_chunk(input_path, chunk_min_size, chunk_min_duration):
+        prdebug(f"Encoding in chunks: {input_path}")
+        return transcode_chunked(
+            input_path, output_path,
+            ten_bit=ten_bit,
+            audio_bitrate=audio_bitrate,
+            overwrite=overwrite,
+            prefer_gpu=prefer_gpu,
+            cq=cq,
+            target_resolution=target_resolution,
+            chunks=chunks,
+            on_progress=on_progress,
+            audio_codec=audio_codec,
+            speed=speed,
+            threads=threads,
+            cpus=cpus,
+            profile=profile,
+        )
+
+    hw = get_encoder(prefer_gpu, speed)
+
+    # Finally, run ffmpeg
+    with encoder_sessions(hw):
+        run_ffmpeg(build_command(
+            input_path, output_path, hw,
+            ten_bit=ten_bit,
+            audio_bitrate=audio_bitrate,
+            overwrite=overwrite,
+            cq=cq,
+            target_resolution=target_resolution,
+            streams=streams,
+            audio_codec=audio_codec,
+            speed=speed,
+            threads=threads,
+            profile=profile,
+        ), on_progress, cpus)
+
+    prdebug(f"Done: {output_path}")
+    return output_path
+
+def remux(
+    input_path: str,
+    output_path: str,
+    overwrite: bool = True,
+    on_progress: Optional[ProgressCallback] = None,
+    audio_bitrate: str = "96k",
+    audio_codec: str = "aac",
+):
+    """
+    Copy video stream to the output without re-encoding, audio is
+    copied too unless it's bigger than audio_bitrate or the codec
+    can't be stored in the output container.
+
+    Args:
+        input_path (str): Path to the input video file
+        output_path (str): Path to the output video file
+        overwrite (bool): Should we overwrite output file if it exists?
+        on_progress (Optional[ProgressCallback]): Called with every progress update
+        audio_bitrate (str): Bitrate of re-encoded audio, "96k" is the default
+        audio_codec (str): Codec for audio that can't be copied, "aac" or "opus"
+    """
+    check_ffmpeg()
+    run_ffmpeg([
+        "ffmpeg", "-y" if overwrite else "-n", "-hide_banner", "-loglevel", "info",
+        "-i", str(input_path),
+        "-c:v", "copy",
+        *stream_args(probe(input_path), str(output_path), audio_codec, audio_bitrate),
+        str(output_path),
+    ], on_progress)
+
+    prdebug(f"Done: {output_path}")
+    return output_path
+
+def should_chunk(
+    input_path: str,
+    min_size: Optional[int] = None,
+    min_duration: Optional[float] = None,
+) -> bool:
+    """
+    Check if file is big enough to be encoded in chunks.
+
+    Args:
+        input_path (str): Path to the input video file
+        min_size (Optional[int]): Minimum file size in bytes
+        min_duration (Optional[float]): Minimum duration in seconds
+    """
+    if min_size is not None and os.path.getsize(input_path) >= min_size:
+        return True
+    if min_duration is not None:
+        return get_duration(probe(input_path)) >= min_duration
+    return False
+
+def transcode_chunked(
+    input_path: str,
+    output_path: str,
+    ten_bit: bool = True,
+    audio_bitrate: str = "96k",
+    overwrite: bool = True,
+    prefer_gpu: bool = True,
+    cq: Optional[int] = None,
+    target_resolution: str = "1280x720",
+    chunks: Optional[int] = None,
+    on_progress: Optional[ProgressCallback] = None,
+    audio_codec: str = "aac",
+    speed: Optional[str] = None,
+    threads: Optional[int] = None,
+    cpus: Optional[list[int]] = None,
+    profile: Optional[Profile] = None,
+):
+    """
+    Transcodes a big video file by splitting it into chunks
+    and encoding them in parallel.
+
+    Video is split on keyframes without re-encoding, every chunk
+    is encoded separately, then chunks are joined with the concat
+    demuxer and audio from the source is added back.
+
+    Args:
+        input_path (str): Path to the input video file
+        output_path (str): Path to the output video file
+        ten_bit (bool): Should we use 10-bit encoding?
+        audio_bitrate (str): Bitrate of the audio, "96k" is the default
+        overwrite (bool): Should we overwrite output file if it exists?
+        prefer_gpu (bool): Should we use the GPU for encoding?
+        cq (Optional[int]): Constant quality, lower is better quality, see build_args
+        target_resolution (str): Target resolution for the output video
+        chunks (Optional[int]): Number of chunks, picked by encoder if None, they
+            run at once as far as encoder sessions of other jobs allow
+        on_progress (Optional[ProgressCallback]): Called with combined progress of all chunks
+        audio_codec (str): Codec for audio that can't be copied, "aac" or "opus"
+        speed (Optional[str]): Speed/size trade-off, see SPEEDS
+        threads (Optional[int]): Threads of the whole job, split between chunks, all cores if None
+        cpus (Optional[list[int]]): Run all chunks only on these CPUs
+        profile (Optional[Profile]): Content profile, same for every chunk
+    """
+    check_ffmpeg()
+    if not overwrite and os.path.exists(output_path):
+        raise RuntimeError(f"Output file already exists: {output_path}")
+
+    hw = get_encoder(prefer_gpu, speed)
+    chunks = chunks or max(2, max_parallel_jobs(hw))
+    info = probe(input_path)
+    duration = get_duration(info)
+    if duration <= 0:
+        raise RuntimeError(f"Could not get duration of {input_path}")
+
+    # Only a file written by this encode is removed when it fails
+    before = output_state(output_path)
+    # Keep chunks next to the output, so they are on the same disk
+    tmp_dir = tempfile.mkdtemp(prefix=".chunks-", dir=os.path.dirname(output_path) or ".")
+    try:
+        # 1. Split video stream on keyframes, audio is taken
+        #    from the source later so it has no gaps between chunks
+        run_ffmpeg([
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "info",
+            "-i", str(input_path),
+            "-map", "0:v:0", "-c", "copy", "-an",
+            "-f", "segment",
+            "-segment_time", f"{duration / chunks:.3f}",
+            "-reset_timestamps", "1",
+            os.path.join(tmp_dir, "source_%04d.mkv"),
+        ], cpus=cpus)
+        sources = sorted(f for f in os.listdir(tmp_dir) if f.startswith("source_"))
+        prdebug(f"Split {input_path} into {len(sources)} chunks")
+
+        # 2. Encode chunks in parallel, progress of all chunks is
+        #    combined as if it was one encode. The job has one encoder
+        #    session, other chunks only run in sessions no other job uses
+        sessions = encoder_sessions(hw)
+        sessions.acquire()
+        extra = 0
+        while extra < len(sources) - 1 and sessions.acquire(blocking=False):
+            extra += 1
+        parallel = 1 + extra
+        # Chunks split the threads of the job, or all cores if it has no budget,
+        # so parallel chunks don't each start a thread per core
+        chunk_threads = thread_budget(parallel, threads or (len(cpus) if cpus else None))
+        prdebug(f"Encoding {parallel} of {len(sources)} chunks at once")
+        chunk_progress: dict[str, Progress] = {}
+        progress_lock = threading.Lock()
+
+        def encode(name: str) -> str:
+            def on_chunk_progress(p: Progress):
+                with progress_lock:
+                    # Finished chunks still count for time, but not for speed
+                    chunk_progress[name] = p._replace(fps=0.0, speed=0.0) if p.done else p
+                    on_progress(Progress(
+                        frame=sum(c.frame for c in chunk_progress.values()),
+                        fps=sum(c.fps for c in chunk_progress.values()),
+                        bitrate=p.bitrate,
+                        out_time=sum(c.out_time for c in chunk_progress.values()),
+                        speed=sum(c.speed for c in chunk_progress.values()),
+                        done=False,
+                    ))
+
+            chunk_output = os.path.join(tmp_dir, name.replace("source_", "encoded_"))
+            run_ffmpeg(build_command(
+                os.path.join(tmp_dir, name), chunk_output, hw,
+                ten_bit=ten_bit,
+                audio_bitrate=None,
+                cq=cq,
+                target_resolution=target_resolution,
+                speed=speed,
+                threads=chunk_threads,
+                profile=profile,
+            ), on_chunk_progress if on_progress else None, cpus)
+            return chunk_output
+
+        try:
+            with ThreadPoolExecutor(max_workers=parallel) as pool:
+                encoded = list(pool.map(encode, sources))
+        finally:
+            for _ in range(parallel):
+                sessions.release()
+
+        # 3. Join chunks without re-encoding and add audio, subtitles
+        #    and attachments from the source
+        list_path = os.path.join(tmp_dir, "chunks.txt")
+        with open(list_path, "w", encoding="utf-8") as f:
+            for path in encoded:
+                f.write(f"file '{os.path.basename(path)}'\n")
+        run_ffmpeg([
+            "ffmpeg", "-y", "-hide_banner", "-loglevel", "info",
+            "-f", "concat", "-safe", "0", "-i", list_path,
+            "-i", str(input_path),
+            "-map", "0:v:0",
+            "-c:v", "copy",
+            *stream_args(info, str(output_path), audio_codec, audio_bitrate,
+                         input_index=1, map_video=False),
+            str(output_path),
+        ], cpus=cpus)
+
+        # 4. Check that nothing was lost while joining chunks
+        verify_chunked(input_path, output_path, duration, len(encoded),
+                       profile.max_fps if profile else None)
+    except BaseException:
+        if output_state(output_path) not in (None, before):
+            os.remove(output_path)
+        raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
     prdebug(f"Done: {output_path}")
-    return output_path
\ No newline at end of file
+    return output_path
+
+def verify_output(input_path: str, output_path: str, check_duration: bool = True):
+    """
+    Check that output is complete before the input is deleted or replaced.
+
+    Output must have a video stream, every audio stream of the input
+    and about the same duration.
+    """
+    info_in, info_out = probe(input_path), probe(output_path)
+
+    def count(info: dict, kind: str) -> int:
+        return sum(1 for s in info.get("streams", []) if s.get("codec_type") == kind
+                   and not s.get("disposition", {}).get("attached_pic"))
+
+    if count(info_out, "video") < 1:
+        raise RuntimeError(f"No video stream in output: {output_path}")
+    if count(info_out, "audio") != count(info_in, "audio"):
+        raise RuntimeError(
+            f"Audio stream count mismatch: "
+            f"{count(info_in, 'audio')} -> {count(info_out, 'audio')}"
+        )
+
+    duration, out_duration = get_duration(info_in), get_duration(info_out)
+    if check_duration and abs(out_duration - duration) > max(0.5, duration * 0.005):
+        raise RuntimeError(
+            f"Duration mismatch in output: {duration:.2f}s -> {out_duration:.2f}s"
+        )
+
+def verify_chunked(
+    input_path: str,
+    output_path: str,
+    duration: float,
+    chunks: int,
+    max_fps: Optional[int] = None,
+):
+    """
+    Check that duration and frame count of output match the source.
+
+    Args:
+        input_path (str): Path to the source video
+        output_path (str): Path to the joined output
+        duration (float): Duration of the source (seconds)
+        chunks (int): Number of joined chunks
+        max_fps (Optional[int]): Frame rate the output was capped to, see Profile
+    """
+    out_duration = get_duration(probe(output_path))
+    if abs(out_duration - duration) > max(0.5, duration * 0.005):
+        raise RuntimeError(
+            f"Duration mismatch after joining chunks: "
+            f"{duration:.2f}s -> {out_duration:.2f}s"
+        )
+
+    # Every chunk boundary may be off by one frame
+    in_frames = count_video_frames(input_path)
+    out_frames = count_video_frames(output_path)
+    expected, tolerance = in_frames, chunks
+    if max_fps and in_frames > duration * max_fps:
+        # Frames above the capped rate were dropped, one more for rounding
+        expected, tolerance = round(duration * max_fps), chunks + 1
+    if abs(expected - out_frames) > tolerance:
+        raise RuntimeError(
+            f"Frame count mismatch after joining chunks: "
+            f"{in_frames} -> {out_frames}, expected {expected}"
+        )
@@ -1,32 +1,142 @@
 import os
-from typing import Optional
+from typing import Iterable, Iterator, NamedTuple, Optional
 from utils.logger import prwarn
 
 VIDEO_EXTENSIONS = (".mp4", ".mkv", ".avi", ".mov", ".flv", ".wmv")
+# Folders this tool creates next to videos, like the work queue and temporary chunks
+TOOL_FOLDERS = (".convert-videos", ".chunks-")
+
+class VideoFile(NamedTuple):
+    """Video file found by scan_video_files, with its stat result"""
+    path: str
+    size: int
+    mtime: float
 
 def get_file_size(file_path: str) -> int:
     return os.path.getsize(file_path)
 
+def list_video_dir(
+    root: str,
+    extensions=VIDEO_EXTENSIONS,
+    ignore_suffix: Optional[str | tuple[str, ...]] = None,
+    excluded: frozenset[str] | set[str] = frozenset(),
+    verbose: bool = True,
+) -> tuple[list[str], list[VideoFile]]:
+    """
+    List one directory with os.scandir.
+
+    Args:
+        root (str): Directory to list
+        extensions (tuple): File extensions to look for
+        ignore_suffix (Optional[str | tuple[str, ...]]): Ignore files that have this suffix,
+            or any of these suffixes
+        excluded (set[str]): Real paths of folders to skip
+        verbose (bool): Print ignored files
+
+    Returns:
+        tuple: Subdirectories and video files, sorted by name
+    """
+    try:
+        with os.scandir(root) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError as e:
+        prwarn(f"Can't scan {root}: {e}")
+        return [], []
+
+    dirs, files = [], []
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            # Our own folders are skipped, other hidden folders are scanned
+            if entry.name.startswith(TOOL_FOLDERS):
+                continue
+            if os.path.realpath(entry.path) not in excluded:
+                dirs.append(entry.path)
+            continue
+        if not entry.name.lower().endswith(extensions):
+            continue
+        if ignore_suffix and os.path.splitext(entry.name)[0].endswith(ignore_suffix):
+            if verbose:
+                prwarn(f"Ignoring: {entry.path}")
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            # File was removed while we were listing
+            continue
+        files.append(VideoFile(entry.path, st.st_size, st.st_mtime))
+    return dirs, files
+
+def scan_video_files(
+    folder_path: str,
+    extensions=VIDEO_EXTENSIONS,
+    ignore_suffix: Optional[str | tuple[str, ...]] = None,
+    exclude: Iterable[str] = (),
+    verbose: bool = True,
+) -> Iterator[VideoFile]:
+    """
+    Walk the folder once with os.scandir and yield video files.
+
+    Files are yielded while scanning, so the work can start before
+    the whole tree is scanned. Every directory is listed completely
+    before its files are yielded, so outputs written next to the
+    inputs are not picked up by the same scan.
+
+    Args:
+        folder_path (str): Folder to scan
+        extensions (tuple): File extensions to look for
+        ignore_suffix (Optional[str | tuple[str, ...]]): Ignore files that have this suffix,
+            or any of these suffixes
+        exclude (Iterable[str]): Folders to skip, like the output folder
+        verbose (bool): Print ignored files
+    """
+    excluded = {os.path.realpath(path) for path in exclude}
+    stack = [folder_path]
+    while stack:
+        dirs, files = list_video_dir(stack.pop(), extensions, ignore_suffix, excluded, verbose)
+        yield from files
+        # Reversed so subfolders are scanned in name order
+        stack.extend(reversed(dirs))
+
+class FileIndex:
+    """
+    Index of scanned video files, filled while it is iterated.
+
+    Sizes are served from the stat results of the scan,
+    so nothing has to be stat'ed or walked again.
+    """
+    def __init__(self, files: Iterable[VideoFile]):
+        self._files = iter(files)
+        self.entries: dict[str, VideoFile] = {}
+
+    def __iter__(self) -> Iterator[VideoFile]:
+        for file in self._files:
+            self.entries[file.path] = file
+            yield file
+
+    def size(self, path: str) -> int:
+        """Return size of an indexed file"""
+        return self.entries[path].size
+
+    def total_size(self) -> int:
+        """Return size of all files scanned so far"""
+        return sum(file.size for file in self.entries.values())
+
 def get_folder_size(folder_path: str, ignore_suffix: Optional[str] = None) -> int:
-    total_size = 0
-    for root, _, files in os.walk(folder_path):
-        for file in files:
-            if file.lower().endswith(VIDEO_EXTENSIONS):
-                if not (ignore_suffix and os.path.splitext(file)[0].endswith(ignore_suffix)):
-                    file_path = os.path.join(root, file)
-                    total_size += get_file_size(file_path)
-    return total_size
+    return sum(file.size for file in scan_video_files(
+        folder_path, ignore_suffix=ignore_suffix, verbose=False))
 
 def get_all_video_files(folder_path: str, extensions=VIDEO_EXTENSIONS, ignore_suffix: Optional[str] = None) -> list[str]:
-    video_files = []
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
-            if file.lower().endswith(extensions):
-                if not (ignore_suffix and os.path.splitext(file)[0].endswith(ignore_suffix)):
-                    video_files.append(os.path.join(root, file))
-                else:
-                    prwarn(f"Ignoring: {os.path.join(root, file)}")
-    return video_files
+    return [file.path for file in scan_video_files(folder_path, extensions, ignore_suffix)]
+
+def get_output_root(
+    input_folder: str,
+    output_folder: Optional[str] = None,
+    same_dir: bool = False
+) -> str:
+    """Return folder where converted videos are saved"""
+    if same_dir:
+        return input_folder
+    return output_folder or os.path.join(os.getcwd(), "converted")
 
 def get_output_path(
     file_path: str, 
@@ -54,5 +164,5 @@ def get_output_path(
              "converted", 
              f"{name}{suffix}{ext}")
 
-    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    # Folder is created when the output is written, so planning creates nothing
     return output_path, overwriting
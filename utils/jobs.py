@@ -0,0 +1,105 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+from utils.ffmpeg.core import max_parallel_jobs
+from utils.logger import prwarn
+
+def resolve_jobs(jobs: str | int, encoder_key: Optional[str]) -> int:
+    """
+    Resolve the --jobs option to a number of workers.
+
+    Args:
+        jobs (str | int): Number of jobs or "auto"
+        encoder_key (Optional[str]): Encoder that will be used
+
+    Returns:
+        int: Number of workers, capped by the encoder limit
+    """
+    limit = max_parallel_jobs(encoder_key)
+    if str(jobs).lower() == "auto":
+        return limit
+
+    jobs = int(jobs)
+    if jobs < 1:
+        raise ValueError(f"Invalid number of jobs: {jobs}")
+    if jobs > limit:
+        prwarn(f"Limiting jobs to {limit} for encoder {encoder_key or 'libx265'}")
+        return limit
+    return jobs
+
+# Marks the end of items in the queue of finished jobs
+_END = object()
+
+def run_jobs(
+    func: Callable[[Any], Any],
+    items: Iterable[Any],
+    workers: int = 1,
+) -> Iterator[tuple[Any, Any, Optional[Exception]]]:
+    """
+    Run func for every item in a thread pool.
+
+    ffmpeg does the actual work in its own process, so threads
+    are enough here and we don't need a process pool.
+
+    Items are taken from another thread while jobs run, so results
+    are yielded as soon as they finish even if items come slowly,
+    like from a folder scan or a watched folder.
+
+    Args:
+        func (Callable): Function to call with every item
+        items (Iterable): Items to process
+        workers (int): Number of jobs to run at once
+
+    Yields:
+        tuple: (item, result, error) in the order jobs finish
+    """
+    done: queue.Queue = queue.Queue()
+    stop = threading.Event()
+    # Only a count, watch mode runs for days and must not keep every finished job
+    submitted = 0
+
+    def feed(pool: ThreadPoolExecutor):
+        nonlocal submitted
+        error = None
+        try:
+            for item in items:
+                if stop.is_set():
+                    break
+                future = pool.submit(func, item)
+                submitted += 1
+                future.add_done_callback(lambda f, item=item: done.put((item, f)))
+        except Exception as e:
+            error = e
+        done.put((_END, error))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        feeder = threading.Thread(target=feed, args=(pool,), daemon=True)
+        feeder.start()
+        received = 0
+        fed = False
+        try:
+            # The count is final once the feeder is done
+            while not fed or received < submitted:
+                try:
+                    item, future = done.get(timeout=0.5)
+                except queue.Empty:
+                    continue
+                if item is _END:
+                    fed = True
+                    if future is not None:
+                        raise future
+                    continue
+                received += 1
+                if future.cancelled():
+                    continue
+                try:
+                    yield item, future.result(), None
+                except Exception as e:
+                    yield item, None, e
+        except (KeyboardInterrupt, GeneratorExit):
+            # Don't start jobs that are still waiting in the queue
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
@@ -0,0 +1,228 @@
+import os
+import sys
+import json
+import time
+import socket
+import hashlib
+import threading
+
+from typing import Optional
+from utils.logger import prwarn, prdebug
+
+JOURNAL_NAME = ".convert-videos-journal.jsonl"
+
+def partial_hash(path: str, block_size: int = 1024**2) -> str:
+    """
+    Fast hash of a file, reads only the start, middle and end.
+
+    Args:
+        path (str): Path to the file
+        block_size (int): Bytes to read from every part
+    """
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(digest_size=16)
+    h.update(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, size // 2, max(0, size - block_size)):
+            f.seek(offset)
+            h.update(f.read(block_size))
+    return h.hexdigest()
+
+def file_state(path: str) -> dict:
+    """Return size, mtime and partial hash of a file"""
+    st = os.stat(path)
+    return {
+        "size": st.st_size,
+        "mtime": st.st_mtime,
+        "hash": partial_hash(path),
+    }
+
+def process_alive(host: Optional[str], pid: Optional[int]) -> bool:
+    """Check if a process is running, processes on other hosts always count as running"""
+    if host is None or pid is None:
+        return False
+    if host != socket.gethostname():
+        return True
+    if pid == os.getpid():
+        return True
+    if sys.platform == "win32":
+        # os.kill would terminate the process on Windows
+        import ctypes
+        handle = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        ctypes.windll.kernel32.CloseHandle(handle)
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def output_paths(output_path: str | list[str]) -> list[str]:
+    """Return absolute paths of one output or of all renditions"""
+    paths = [output_path] if isinstance(output_path, str) else output_path
+    return [os.path.abspath(path) for path in paths]
+
+class Journal:
+    """
+    Persistent JSON-lines journal of converted files.
+
+    Every input has a "started" entry written before encoding and a
+    "done" entry written after, so on the next run finished files can
+    be skipped and outputs of interrupted encodes can be discarded by
+    recover(). Started entries have the host and pid of their run, so
+    outputs of runs that are still encoding are never discarded.
+
+    Args:
+        path (str): Path to the journal file
+        discard_partial (bool): Remove outputs of unfinished encodes, must be
+            off when other workers may be writing to the same output folder
+    """
+    def __init__(self, path: str, discard_partial: bool = True):
+        self.path = path
+        self.discard_partial = discard_partial
+        self.entries: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self) -> int:
+        """Read entries, return size of the journal that was read"""
+        self.entries.clear()
+        if not os.path.exists(self.path):
+            return 0
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = f.read()
+        for line in data.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                # Last line may be cut if we crashed while writing
+                continue
+            self.entries[entry["input"]] = entry
+        return len(data.encode("utf-8"))
+
+    def recover(self):
+        """
+        Discard outputs of encodes that never finished and keep only the
+        latest entry of every input. Only runs that convert should call
+        this, entries of runs that are still going are left alone.
+        """
+        with self._lock:
+            size = self._load()
+            for entry in list(self.entries.values()):
+                if entry["status"] == "done":
+                    continue
+                if process_alive(entry.get("host"), entry.get("pid")):
+                    prdebug(f"Still converting in another run: {entry['input']}")
+                    continue
+                for output in entry.get("outputs", [entry.get("output")]):
+                    if (self.discard_partial and output and output != entry["input"]
+                            and os.path.exists(output)):
+                        prwarn(f"Discarding partial output: {output}")
+                        os.remove(output)
+                del self.entries[entry["input"]]
+
+            # Another run appended while we were reading, its entries must not be lost
+            if not os.path.exists(self.path) or os.path.getsize(self.path) != size:
+                return
+            tmp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self.entries.values():
+                    f.write(json.dumps(entry) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def _append(self, entry: dict):
+        with self._lock:
+            self.entries[entry["input"]] = entry
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def is_done(self, input_path: str, params: dict) -> bool:
+        """
+        Check if input was already converted with the same parameters.
+
+        Args:
+            input_path (str): Path to the input video file
+            params (dict): Encode parameters of this run
+        """
+        entry = self.entries.get(os.path.abspath(input_path))
+        if not entry or entry["status"] != "done" or entry["params"] != params:
+            return False
+        # Run stopped before the output was checked, the original was kept
+        if entry.get("pending"):
+            return False
+
+        # Outputs must still be there and be the ones we wrote
+        outputs = entry.get("outputs", [entry["output"]])
+        sizes = entry.get("output_sizes", [entry["output_size"]])
+        for output, size in zip(outputs, sizes):
+            if not os.path.exists(output) or os.path.getsize(output) != size:
+                return False
+
+        # Input must not have changed, hash is only
+        # checked when mtime is different
+        st = os.stat(input_path)
+        if st.st_size != entry["size"]:
+            return False
+        if st.st_mtime != entry["mtime"]:
+            if partial_hash(input_path) != entry["hash"]:
+                return False
+        prdebug(f"Journal match: {input_path}")
+        return True
+
+    def start(self, input_path: str, output_path: str | list[str], params: dict):
+        """Record that conversion of input started, output_path is a list for renditions"""
+        outputs = output_paths(output_path)
+        self._append({
+            "input": os.path.abspath(input_path),
+            "status": "started",
+            "output": outputs[0],
+            **({"outputs": outputs} if len(outputs) > 1 else {}),
+            "params": params,
+            # Other runs don't touch the output while this process is alive
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "time": time.time(),
+        })
+
+    def finish(
+        self,
+        input_path: str,
+        output_path: str | list[str],
+        params: dict,
+        state: Optional[dict] = None,
+        pending: bool = False,
+    ):
+        """
+        Record that input was converted.
+
+        Args:
+            input_path (str): Path to the input video file
+            output_path (str | list[str]): Path to the converted file, or to every rendition
+            params (dict): Encode parameters of this run
+            state (Optional[dict]): Input state from file_state, taken
+                from the output if input was overwritten
+            pending (bool): Output is complete, but its quality check is not done
+                yet, recover() keeps it and is_done() converts it again
+        """
+        outputs = output_paths(output_path)
+        if state is None or os.path.abspath(input_path) == outputs[0]:
+            state = file_state(outputs[0])
+        sizes = [os.path.getsize(output) for output in outputs]
+        self._append({
+            "input": os.path.abspath(input_path),
+            "status": "done",
+            **state,
+            "params": params,
+            "output": outputs[0],
+            "output_size": sizes[0],
+            **({"outputs": outputs, "output_sizes": sizes} if len(outputs) > 1 else {}),
+            **({"pending": True} if pending else {}),
+            "time": time.time(),
+        })
@@ -0,0 +1,107 @@
+import os
+import csv
+import json
+import time
+import threading
+
+from typing import Optional
+from utils.ffmpeg.probe import get_video_stream, get_bitrate
+
+# Columns of every job in the report
+FIELDS = (
+    "input", "output", "status", "action", "encoder", "cq", "profile", "threads", "cpus",
+    "source_codec", "source_resolution", "source_bitrate",
+    "input_bytes", "output_bytes", "compression_ratio",
+    "duration", "wall_time", "fps", "speed", "ssim", "psnr", "error",
+)
+
+def percentile(values: list[float], p: float) -> float:
+    """Return p-th percentile (0-100) using linear interpolation"""
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(values) - 1)
+    return values[lo] + (values[hi] - values[lo]) * (k - lo)
+
+class MetricsReport:
+    """
+    Collects metrics of every job and writes them as JSON or CSV.
+
+    Jobs can be added from several threads at once.
+    """
+    def __init__(self):
+        self.jobs: list[dict] = []
+        self.start_time = time.time()
+        self._lock = threading.Lock()
+
+    def add(self, **job) -> dict:
+        """Add one job, missing fields are left empty"""
+        record = {field: job.get(field) for field in FIELDS}
+        if record["input_bytes"] and record["output_bytes"] is not None:
+            record["compression_ratio"] = round(record["output_bytes"] / record["input_bytes"], 4)
+        if record["duration"] and record["wall_time"]:
+            record["speed"] = round(record["duration"] / record["wall_time"], 3)
+        with self._lock:
+            self.jobs.append(record)
+        return record
+
+    def update(self, record: dict, **fields):
+        """Set fields of a job that are known only later, like quality scores"""
+        with self._lock:
+            record.update({k: v for k, v in fields.items() if k in FIELDS})
+
+    def totals(self) -> dict:
+        """Return batch totals and percentiles of finished jobs"""
+        with self._lock:
+            jobs = list(self.jobs)
+        done = [j for j in jobs if j["status"] == "converted"]
+        input_bytes = sum(j["input_bytes"] or 0 for j in done)
+        output_bytes = sum(j["output_bytes"] or 0 for j in done)
+
+        totals = {
+            "jobs": len(jobs),
+            "wall_time": round(time.time() - self.start_time, 3),
+            "input_bytes": input_bytes,
+            "output_bytes": output_bytes,
+            "reduction": round((1 - output_bytes / input_bytes) * 100, 2) if input_bytes else 0.0,
+            "duration": round(sum(j["duration"] or 0 for j in done), 3),
+            "encode_time": round(sum(j["wall_time"] or 0 for j in done), 3),
+        }
+        for status in ("converted", "skipped", "failed"):
+            totals[status] = sum(1 for j in jobs if j["status"] == status)
+        for field in ("fps", "speed", "compression_ratio"):
+            values = [j[field] for j in done if j[field] is not None]
+            for p in (50, 90, 99):
+                totals[f"{field}_p{p}"] = round(percentile(values, p), 4)
+        return totals
+
+    def write(self, path: str):
+        """Write report, CSV if path ends with .csv, JSON otherwise"""
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        totals = self.totals()
+        with self._lock:
+            jobs = list(self.jobs)
+
+        if path.lower().endswith(".csv"):
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.DictWriter(f, fieldnames=FIELDS)
+                writer.writeheader()
+                writer.writerows(jobs)
+            # Totals go next to the CSV, they don't fit its columns
+            path = os.path.splitext(path)[0] + ".totals.json"
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(totals, f, indent=2)
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"totals": totals, "jobs": jobs}, f, indent=2)
+
+def source_info(info: Optional[dict]) -> dict:
+    """Return source codec, resolution and bitrate from probe result"""
+    stream = get_video_stream(info or {}) or {}
+    return {
+        "source_codec": stream.get("codec_name"),
+        "source_resolution": f"{stream['width']}x{stream['height']}" if "width" in stream else None,
+        "source_bitrate": get_bitrate(info) if info else None,
+    }
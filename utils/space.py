@@ -0,0 +1,107 @@
+import os
+import shutil
+import threading
+
+from typing import NamedTuple, Optional
+from utils.logger import prdebug
+
+# Free space that is never reserved, so other programs keep working
+MIN_FREE = 512 * 1024**2
+# Output size estimates are off for some files, reserve a bit more
+SAFETY = 1.25
+
+class Need(NamedTuple):
+    """Space one job needs in a folder"""
+    folder: str
+    size: int
+    # File that is written there, it takes free space as it grows
+    path: Optional[str] = None
+
+def existing_folder(path: str) -> str:
+    """Return path or its closest parent that exists"""
+    path = os.path.abspath(path)
+    while not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
+
+def written(path: Optional[str]) -> int:
+    try:
+        return os.path.getsize(path) if path else 0
+    except OSError:
+        return 0
+
+class SpaceReserver:
+    """
+    Reserves disk space for the outputs of jobs before they start,
+    so an encode doesn't fail on a full disk after hours of work.
+
+    Free space is measured again for every reservation, so space of
+    originals that were deleted or replaced counts as soon as they are
+    gone. Outputs that are being written already take free space, only
+    the part of their reservation they didn't write yet is counted.
+    """
+    def __init__(self, min_free: int = MIN_FREE):
+        """
+        Args:
+            min_free (int): Bytes that are left free on every file system
+        """
+        self.min_free = min_free
+        # Job -> (file system, need) of every folder it writes to
+        self.reservations: dict[str, list[tuple[int, Need]]] = {}
+        self._cond = threading.Condition()
+
+    def available(self, folder: str) -> int:
+        """Return bytes that can still be reserved on the file system of a folder"""
+        folder = existing_folder(folder)
+        device = os.stat(folder).st_dev
+        with self._cond:
+            pending = sum(
+                max(0, need.size - written(need.path))
+                for entries in self.reservations.values()
+                for dev, need in entries if dev == device
+            )
+        return shutil.disk_usage(folder).free - pending - self.min_free
+
+    def reserve(self, job: str, needs: list[Need]) -> bool:
+        """
+        Reserve space for a job if all of it is available.
+
+        Args:
+            job (str): Name of the job, used to release it
+            needs (list[Need]): Space needed in every folder
+
+        Returns:
+            bool: True if space was reserved, nothing is reserved if False
+        """
+        with self._cond:
+            entries = [(os.stat(existing_folder(need.folder)).st_dev, need) for need in needs]
+            totals: dict[int, tuple[str, int]] = {}
+            for dev, need in entries:
+                folder, size = totals.get(dev, (need.folder, 0))
+                totals[dev] = (folder, size + need.size)
+            for folder, size in totals.values():
+                available = self.available(folder)
+                if size > available:
+                    prdebug(f"Not enough space for {job}: needs {size}, {available} available")
+                    return False
+            self.reservations[job] = entries
+            return True
+
+    def release(self, job: str):
+        """Give back space of a finished job"""
+        with self._cond:
+            if self.reservations.pop(job, None) is not None:
+                self._cond.notify_all()
+
+    def idle(self) -> bool:
+        """Check if no job holds a reservation"""
+        with self._cond:
+            return not self.reservations
+
+    def wait(self, timeout: float):
+        """Wait until a job releases its space, or timeout for space freed by others"""
+        with self._cond:
+            self._cond.wait(timeout)
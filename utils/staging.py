@@ -0,0 +1,260 @@
+import os
+import json
+import uuid
+import shutil
+import socket
+import threading
+
+from collections import deque
+from typing import Optional
+from utils.journal import process_alive
+from utils.logger import prdebug, prwarn
+
+# Every run stages its files in its own folder with this prefix
+SCRATCH_PREFIX = "convert-videos-"
+# Host and pid of the run that owns a scratch folder
+OWNER_NAME = "owner.json"
+
+def recover_scratch(scratch_dir: str):
+    """
+    Remove scratch folders of runs that stopped without cleaning up.
+
+    Like Journal.recover, folders of runs that are still going,
+    or of runs on other hosts, are left alone.
+
+    Args:
+        scratch_dir (str): Folder that holds the scratch folders of all runs
+    """
+    try:
+        names = os.listdir(scratch_dir)
+    except OSError:
+        return
+    for name in names:
+        folder = os.path.join(scratch_dir, name)
+        if not name.startswith(SCRATCH_PREFIX) or not os.path.isdir(folder):
+            continue
+        try:
+            with open(os.path.join(folder, OWNER_NAME), "r", encoding="utf-8") as f:
+                owner = json.load(f)
+        except (OSError, ValueError):
+            # Not ours, or its run is still writing the owner
+            continue
+        if process_alive(owner.get("host"), owner.get("pid")):
+            continue
+        prwarn(f"Removing scratch folder of a stopped run: {folder}")
+        shutil.rmtree(folder, ignore_errors=True)
+
+class _Staged:
+    """Local copy of one input and the outputs written next to it"""
+    def __init__(self, path: str, size: int):
+        self.path = path
+        self.size = size
+        self.local: Optional[str] = None
+        self.folder: Optional[str] = None
+        self.ready = threading.Event()
+        self.error: Optional[Exception] = None
+
+class Scratch:
+    """
+    Local scratch folder for inputs and outputs that live on network storage.
+
+    Inputs are copied to the scratch folder before they are encoded,
+    the next ones are prefetched in the background while the current
+    one encodes. Outputs are written to the scratch folder too, and
+    published to their final path with an atomic rename when done.
+
+    Every staged input reserves twice its size from the budget, for
+    itself and its output. Files that don't fit even when nothing else
+    is staged are encoded directly from and to their final paths.
+
+    The folder records host and pid of its run, so recover_scratch
+    can remove it if the run stops without closing it.
+    """
+    def __init__(self, folder: str, budget: int, read_ahead: int = 1):
+        """
+        Args:
+            folder (str): Local folder for staged files
+            budget (int): Max bytes of staged files
+            read_ahead (int): Number of inputs prefetched before they are needed
+        """
+        self.folder = folder
+        self.budget = budget
+        self.read_ahead = read_ahead
+        self.used = 0
+        self.entries: dict[str, _Staged] = {}
+        self.queue: deque[str] = deque()
+        self.prefetched: set[str] = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, OWNER_NAME), "w", encoding="utf-8") as f:
+            json.dump({"host": socket.gethostname(), "pid": os.getpid()}, f)
+        self._thread = threading.Thread(target=self._prefetch_loop, daemon=True)
+        self._thread.start()
+
+    def _reserve(self, path: str) -> _Staged:
+        """Add entry for a file, called with the lock held"""
+        entry = _Staged(path, os.path.getsize(path))
+        if entry.size * 2 > self.budget:
+            prdebug(f"Too big for scratch folder, not staging: {path}")
+            return self._bypass(path, entry.size)
+        self.used += entry.size * 2
+        self.entries[path] = entry
+        return entry
+
+    def _bypass(self, path: str, size: int = 0) -> _Staged:
+        """Add entry for a file that is used from its own path"""
+        entry = _Staged(path, size)
+        entry.local = path
+        entry.ready.set()
+        self.entries[path] = entry
+        return entry
+
+    def _running(self) -> bool:
+        """Check if space is held by inputs that are being encoded"""
+        return any(
+            path not in self.prefetched and entry.local != entry.path
+            for path, entry in self.entries.items()
+        )
+
+    def _fits(self, path: str) -> bool:
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            return True
+        return size * 2 > self.budget or self.used + size * 2 <= self.budget
+
+    def _copy(self, entry: _Staged):
+        try:
+            entry.folder = os.path.join(self.folder, uuid.uuid4().hex)
+            os.makedirs(entry.folder)
+            local = os.path.join(entry.folder, os.path.basename(entry.path))
+            shutil.copyfile(entry.path, local)
+            entry.local = local
+            prdebug(f"Staged: {entry.path}")
+        except OSError as e:
+            entry.error = e
+        finally:
+            entry.ready.set()
+
+    def _prefetch_loop(self):
+        while True:
+            with self._cond:
+                while not self._closed and not (
+                    self.queue
+                    and len(self.prefetched) < self.read_ahead
+                    and self._fits(self.queue[0])
+                ):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                path = self.queue.popleft()
+                try:
+                    entry = self._reserve(path)
+                except OSError:
+                    continue
+                if entry.ready.is_set():
+                    continue
+                self.prefetched.add(path)
+            self._copy(entry)
+
+    def expect(self, path: str):
+        """Queue an input that will be needed soon, in the order it's needed"""
+        with self._cond:
+            if path not in self.entries and path not in self.queue:
+                self.queue.append(path)
+                self._cond.notify_all()
+
+    def input(self, path: str) -> str:
+        """
+        Return local copy of an input, waits for its prefetch or copies it now.
+
+        Args:
+            path (str): Path to the input file
+
+        Returns:
+            str: Path to read the input from
+        """
+        with self._cond:
+            entry = self.entries.get(path)
+            copy = entry is None
+            if copy:
+                if path in self.queue:
+                    self.queue.remove(path)
+                # Wait for other jobs to free the space, unless it's only
+                # held by prefetched inputs, their jobs may wait for this one
+                while not self._fits(path) and self._running():
+                    self._cond.wait()
+                entry = self._reserve(path) if self._fits(path) else self._bypass(path)
+            self.prefetched.discard(path)
+            self._cond.notify_all()
+        if copy and not entry.ready.is_set():
+            self._copy(entry)
+        entry.ready.wait()
+        if entry.error:
+            raise RuntimeError(f"Failed to stage {path}: {entry.error}")
+        return entry.local
+
+    def output(self, input_path: str, output_path: str) -> str:
+        """Return scratch path to write an output of a staged input to"""
+        entry = self.entries.get(input_path)
+        if entry is None or entry.folder is None:
+            return output_path
+        folder = os.path.join(entry.folder, "out")
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, os.path.basename(output_path))
+
+    def publish(self, local_path: str, output_path: str):
+        """
+        Move a finished output from the scratch folder to its final path.
+
+        It's copied next to the final path under a temporary name first,
+        so the final path is replaced in one step and is never partial.
+        """
+        if os.path.abspath(local_path) == os.path.abspath(output_path):
+            return
+        folder = os.path.dirname(os.path.abspath(output_path))
+        tmp_path = os.path.join(folder, f".{os.path.basename(output_path)}.{uuid.uuid4().hex[:8]}.tmp")
+        try:
+            with open(local_path, "rb") as src, open(tmp_path, "wb") as dst:
+                shutil.copyfileobj(src, dst, 16 * 1024**2)
+                dst.flush()
+                os.fsync(dst.fileno())
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        os.remove(local_path)
+
+    def release(self, path: str):
+        """Remove staged input and outputs and give back their space"""
+        with self._cond:
+            if path in self.queue:
+                self.queue.remove(path)
+            entry = self.entries.pop(path, None)
+            self.prefetched.discard(path)
+            self._cond.notify_all()
+        if entry is None:
+            return
+        entry.ready.wait()
+        if entry.folder:
+            shutil.rmtree(entry.folder, ignore_errors=True)
+        with self._cond:
+            if entry.local != entry.path:
+                self.used -= entry.size * 2
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        for path in list(self.entries):
+            self.release(path)
+        # Owner is kept with files left behind, so a later run removes them
+        if os.listdir(self.folder) != [OWNER_NAME]:
+            prwarn(f"Scratch folder is not empty: {self.folder}")
+            return
+        os.remove(os.path.join(self.folder, OWNER_NAME))
+        os.rmdir(self.folder)
@@ -0,0 +1,108 @@
+import os
+import time
+
+from typing import Iterable, Iterator, Optional
+from utils.files import VIDEO_EXTENSIONS, VideoFile, list_video_dir
+from utils.logger import prdebug
+
+class FolderWatcher:
+    """
+    Polls a folder and yields video files once they stop changing.
+
+    Only directories whose mtime changed are listed again, so a
+    poll of a big library costs one stat per directory plus one
+    stat per file that is still being written. Files that are
+    created, renamed or moved in are found, but not changes to the
+    content of a file that was already queued.
+
+    Args:
+        folder_path (str): Folder to watch
+        quiet_period (float): Seconds size and mtime must stay the same
+        interval (float): Seconds between polls
+        extensions (tuple): File extensions to look for
+        ignore_suffix (Optional[str | tuple[str, ...]]): Ignore files that have this suffix,
+            or any of these suffixes
+        exclude (Iterable[str]): Folders to skip, like the output folder
+    """
+    def __init__(
+        self,
+        folder_path: str,
+        quiet_period: float = 30.0,
+        interval: float = 5.0,
+        extensions=VIDEO_EXTENSIONS,
+        ignore_suffix: Optional[str | tuple[str, ...]] = None,
+        exclude: Iterable[str] = (),
+    ):
+        self.folder_path = folder_path
+        self.quiet_period = quiet_period
+        self.interval = interval
+        self.extensions = extensions
+        self.ignore_suffix = ignore_suffix
+        self.excluded = {os.path.realpath(path) for path in exclude}
+        # Directory -> mtime when it was last listed
+        self.dirs: dict[str, float] = {}
+        # File -> (size, mtime, time when it was last seen changing)
+        self.pending: dict[str, tuple[int, float, float]] = {}
+        # File -> (size, mtime) when it was yielded
+        self.queued: dict[str, tuple[int, float]] = {}
+
+    def _list(self, root: str):
+        try:
+            self.dirs[root] = os.stat(root).st_mtime
+        except OSError:
+            self.dirs.pop(root, None)
+            return
+        dirs, files = list_video_dir(
+            root, self.extensions, self.ignore_suffix, self.excluded, verbose=False)
+        now = time.time()
+        for file in files:
+            if file.path in self.pending:
+                continue
+            # Files replaced by a new file are queued again, files rewritten
+            # in place don't change the mtime of their folder and are not seen
+            if self.queued.get(file.path) == (file.size, file.mtime):
+                continue
+            self.pending[file.path] = (file.size, file.mtime, now)
+        for path in dirs:
+            if path not in self.dirs:
+                self._list(path)
+
+    def poll(self) -> list[VideoFile]:
+        """Check for changes once, returns files that are ready"""
+        if not self.dirs:
+            self._list(self.folder_path)
+        else:
+            for root, mtime in list(self.dirs.items()):
+                try:
+                    changed = os.stat(root).st_mtime != mtime
+                except OSError:
+                    # Directory was removed
+                    self.dirs.pop(root, None)
+                    continue
+                if changed:
+                    self._list(root)
+
+        # Files are ready when they didn't change for quiet period
+        now = time.time()
+        ready = []
+        for path, (size, mtime, since) in list(self.pending.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                del self.pending[path]
+                continue
+            if (st.st_size, st.st_mtime) != (size, mtime):
+                self.pending[path] = (st.st_size, st.st_mtime, now)
+            elif now - since >= self.quiet_period:
+                del self.pending[path]
+                self.queued[path] = (st.st_size, st.st_mtime)
+                ready.append(VideoFile(path, st.st_size, st.st_mtime))
+        return ready
+
+    def watch(self) -> Iterator[VideoFile]:
+        """Yield ready files forever"""
+        while True:
+            for file in self.poll():
+                prdebug(f"Ready: {file.path}")
+                yield file
+            time.sleep(self.interval)
@@ -0,0 +1,288 @@
+import os
+import json
+import time
+import uuid
+import socket
+import hashlib
+import threading
+
+from typing import Optional
+from utils.logger import prwarn, prdebug
+
+QUEUE_NAME = ".convert-videos-queue"
+# Seconds a claim is valid without being renewed, leases are renewed
+# three times per lease time so a slow disk doesn't lose them
+LEASE_TIME = 120.0
+
+# States of a file in the queue
+FREE = "free"
+LEASED = "leased"
+DONE = "done"
+# Result of try_claim when this worker got the file
+CLAIMED = "claimed"
+
+class LeaseLostError(RuntimeError):
+    """Another worker took over a file this worker is converting"""
+
+def worker_id() -> str:
+    """Unique name of this worker, host name is kept for logs"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class WorkQueue:
+    """
+    Work queue shared by workers on different machines through a folder.
+
+    Every file has a lease file that is created with O_EXCL, so only one
+    worker can claim it, even over NFS/SMB. Leases are renewed from a
+    background thread while the file is converted and a lease that is
+    not renewed in time belongs to a crashed worker, so any other worker
+    can take the file over. Finished files get a done marker.
+
+    Files are identified by their path relative to the input folder,
+    so machines can mount the shared folder at different paths.
+    Lease expiry uses wall-clock time, clocks of workers must be synced.
+    """
+    def __init__(
+        self,
+        folder: str,
+        root: str,
+        worker: Optional[str] = None,
+        lease_time: float = LEASE_TIME,
+    ):
+        """
+        Args:
+            folder (str): Shared folder for lease and done files
+            root (str): Input folder, files are keyed relative to it
+            worker (Optional[str]): Name of this worker, unique by default
+            lease_time (float): Seconds a claim is valid without renewal
+        """
+        self.folder = folder
+        self.root = root
+        self.worker = worker or worker_id()
+        self.lease_time = lease_time
+        self.held: set[str] = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._renewer: Optional[threading.Thread] = None
+        os.makedirs(folder, exist_ok=True)
+
+    def key(self, path: str) -> str:
+        relative = os.path.relpath(os.path.abspath(path), os.path.abspath(self.root))
+        return hashlib.blake2b(relative.replace(os.sep, "/").encode(), digest_size=16).hexdigest()
+
+    def _path(self, key: str, ext: str) -> str:
+        return os.path.join(self.folder, f"{key}.{ext}")
+
+    def _read(self, path: str) -> Optional[dict]:
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except ValueError:
+            # Still being written or cut by a crash, age decides if it's stale
+            try:
+                return {"worker": None, "expires": os.path.getmtime(path) + self.lease_time}
+            except FileNotFoundError:
+                return None
+
+    def _lease(self, path: str) -> dict:
+        return {
+            "input": os.path.relpath(os.path.abspath(path), os.path.abspath(self.root)),
+            "worker": self.worker,
+            "expires": time.time() + self.lease_time,
+        }
+
+    def _write(self, target: str, data: dict):
+        # Write and rename, so others never read a half written file
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(data))
+        os.replace(tmp_path, target)
+
+    def _create(self, path: str, lease_path: str) -> bool:
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(json.dumps(self._lease(path)))
+        return True
+
+    def _steal(self, path: str, lease_path: str, seen: dict) -> bool:
+        """Take over an expired lease, only one worker can win"""
+        stale_path = f"{lease_path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(lease_path, stale_path)
+        except FileNotFoundError:
+            return self._create(path, lease_path)
+        if self._read(stale_path) != seen:
+            # Lease was renewed or claimed again after we read it, put it back
+            try:
+                os.link(stale_path, lease_path)
+            except OSError:
+                pass
+            os.remove(stale_path)
+            return False
+        os.remove(stale_path)
+        prwarn(f"Requeued from {seen.get('worker') or 'unknown worker'}: {path}")
+        return self._create(path, lease_path)
+
+    def _is_done(self, key: str, path: str, params: Optional[dict]) -> bool:
+        done = self._read(self._path(key, "done"))
+        if done is None or (params is not None and done.get("params") != params):
+            return False
+        try:
+            return os.path.getsize(path) == done.get("size")
+        except FileNotFoundError:
+            return True
+
+    def state(self, path: str, params: Optional[dict] = None) -> str:
+        """
+        Return DONE, LEASED or FREE, expired leases are FREE.
+
+        Args:
+            path (str): Path to the input file
+            params (Optional[dict]): Done markers with other parameters don't count
+        """
+        key = self.key(path)
+        if self._is_done(key, path, params):
+            return DONE
+        lease = self._read(self._path(key, "lease"))
+        if lease is not None and lease["expires"] > time.time():
+            return LEASED
+        return FREE
+
+    def try_claim(self, path: str, params: Optional[dict] = None) -> str:
+        """
+        Try to claim a file for this worker.
+
+        Args:
+            path (str): Path to the input file
+            params (Optional[dict]): Files done with these parameters are not claimed
+
+        Returns:
+            str: CLAIMED if this worker should convert the file, DONE if another
+                worker already converted it, LEASED if another worker holds it
+        """
+        key = self.key(path)
+        lease_path = self._path(key, "lease")
+        claimed = self._create(path, lease_path)
+        if not claimed:
+            lease = self._read(lease_path)
+            if lease is None:
+                claimed = self._create(path, lease_path)
+            elif lease["expires"] <= time.time():
+                claimed = self._steal(path, lease_path, lease)
+        if claimed and self._is_done(key, path, params):
+            # Another worker finished it after we last checked
+            os.remove(lease_path)
+            return DONE
+        if not claimed:
+            return DONE if self._is_done(key, path, params) else LEASED
+        with self._lock:
+            self.held.add(key)
+        prdebug(f"Claimed: {path}")
+        return CLAIMED
+
+    def claim(self, path: str, params: Optional[dict] = None) -> bool:
+        """Try to claim a file, True if this worker should convert it, see try_claim"""
+        return self.try_claim(path, params) == CLAIMED
+
+    def holds(self, path: str) -> bool:
+        """Check if this worker still holds the lease of a file"""
+        with self._lock:
+            return self.key(path) in self.held
+
+    def renew(self):
+        """Extend all leases of this worker, leases taken over by others are dropped"""
+        with self._lock:
+            held = list(self.held)
+        for key in held:
+            lease_path = self._path(key, "lease")
+            lease = self._read(lease_path)
+            if lease is None or lease.get("worker") != self.worker:
+                # Lease file may still be written by the worker that took it
+                prwarn(f"Lost lease: {lease.get('input', key) if lease else key}")
+                with self._lock:
+                    self.held.discard(key)
+                continue
+            lease["expires"] = time.time() + self.lease_time
+            self._write(lease_path, lease)
+
+    def release(self, path: str):
+        """Give a claimed file back, so another worker can convert it"""
+        key = self.key(path)
+        with self._lock:
+            if key not in self.held:
+                return
+            self.held.discard(key)
+        lease_path = self._path(key, "lease")
+        lease = self._read(lease_path)
+        if lease is not None and lease.get("worker") == self.worker:
+            try:
+                os.remove(lease_path)
+            except FileNotFoundError:
+                pass
+
+    def complete(self, path: str, params: Optional[dict] = None):
+        """
+        Mark a claimed file as done and drop its lease.
+
+        Args:
+            path (str): Path to the input file
+            params (Optional[dict]): Encode parameters, checked by state()
+        """
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            # Original was deleted or overwritten after conversion
+            size = None
+        self._write(self._path(self.key(path), "done"), {
+            "input": os.path.relpath(os.path.abspath(path), os.path.abspath(self.root)),
+            "worker": self.worker,
+            "params": params,
+            "size": size,
+            "time": time.time(),
+        })
+        self.release(path)
+
+    def _renew_loop(self):
+        while not self._stop.wait(self.lease_time / 3):
+            # Renewing must go on, or every lease of this worker expires
+            try:
+                self.renew()
+            except Exception as e:
+                prwarn(f"Failed to renew leases: {e}")
+
+    def start(self):
+        """Start renewing leases in the background"""
+        self._stop.clear()
+        self._renewer = threading.Thread(target=self._renew_loop, daemon=True)
+        self._renewer.start()
+
+    def stop(self):
+        """Stop renewing leases and give back the ones we still hold"""
+        self._stop.set()
+        if self._renewer:
+            self._renewer.join()
+            self._renewer = None
+        with self._lock:
+            held = list(self.held)
+        for key in held:
+            lease_path = self._path(key, "lease")
+            lease = self._read(lease_path)
+            if lease is not None and lease.get("worker") == self.worker:
+                try:
+                    os.remove(lease_path)
+                except FileNotFoundError:
+                    pass
+        with self._lock:
+            self.held.clear()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()